@@ -0,0 +1,68 @@
+# benchmarks/compare_benchmarks.py
+#
+# Compare two sets of crawl_benchmark.py results, e.g. before and after a change.
+#
+#   python3 benchmarks/compare_benchmarks.py before.jsonl after.jsonl
+#   python3 benchmarks/compare_benchmarks.py results.jsonl --labels 1a2b3c4 5d6e7f8
+#
+# Results are matched on mode, output format and cache.  Outputs one JSON line per match
+# with the percent change of files/second, MB/second and peak RSS, and exits with status 1
+# when files/second dropped by more than --threshold percent anywhere.
+import sys
+import json
+from argparse import ArgumentParser
+
+METRICS = ['files_per_second', 'mb_per_second', 'peak_rss_kb', ]
+
+
+def load(path, label=None):
+    results = {}
+    with open(path, 'r') as fd:
+        for line in fd:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            if label is not None and result.get('label') != label:
+                continue
+            # a later result for the same run replaces an earlier one
+            results[(result['mode'], result['output_format'], result['cache'], )] = result
+    return results
+
+
+def change(before, after):
+    if not before:
+        return None
+    return round(100.0 * (after - before) / before, 1)
+
+
+def main():
+    parser = ArgumentParser(description="Compare crawl_benchmark.py results")
+    parser.add_argument("before", help="Results file.")
+    parser.add_argument("after", help="Results file. Default: the before file", nargs='?', default=None)
+    parser.add_argument("--labels", help="Before and after labels, to pick results from the files.",
+        nargs=2, default=[None, None])
+    parser.add_argument("--threshold", help="Percent drop in files/second that counts as slower. Default: 5",
+        type=float, default=5.0)
+    args = vars(parser.parse_args())
+
+    before = load(args['before'], args['labels'][0])
+    after = load(args['after'] or args['before'], args['labels'][1])
+
+    slower = False
+    for key in sorted(set(before) & set(after)):
+        comparison = {'mode': key[0], 'output_format': key[1], 'cache': key[2], }
+        for metric in METRICS:
+            comparison[metric] = [before[key][metric], after[key][metric]]
+            comparison[metric + '_change'] = change(before[key][metric], after[key][metric])
+        drop = comparison['files_per_second_change']
+        if drop is not None and drop < -args['threshold']:
+            comparison['slower'] = True
+            slower = True
+        print(json.dumps(comparison, sort_keys=True))
+
+    if slower:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
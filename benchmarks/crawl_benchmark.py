@@ -0,0 +1,182 @@
+# benchmarks/crawl_benchmark.py
+#
+# Run file_system_searcher.py over a synthetic corpus in each mode and output format,
+# starting from a cold and from a warm page cache.
+#
+#   python3 benchmarks/crawl_benchmark.py /tmp/fss-corpus --results results.jsonl
+#
+# The corpus is built first if needed, see synthetic_corpus.py for its parameters.  Each run
+# is a separate process so peak RSS is the maximum resident set size of that run alone.
+# Outputs one JSON line per run and appends it to --results, compare the results of two
+# commits with compare_benchmarks.py.  Needs nothing beyond the Python standard library and
+# the searcher's own requirements, it runs offline.
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+from synthetic_corpus import build_corpus, corpus_arguments, corpus_parameters
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_system_searcher import OUTPUT_FORMATS
+
+SEARCHER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'file_system_searcher.py')
+
+MODES = {
+    'no_hash': ['--no_hash', ],
+    'hash': [],
+    'search_archives': ['--search_archives', '--archive_depth', '3', ],
+    'async': ['--async_concurrency', '64', ],
+}
+CACHES = ['cold', 'warm', ]
+
+
+def drop_page_cache(directory, drop_caches=False):
+    """
+    Drop the corpus from the page cache.  Returns the method used: 'drop_caches' also drops
+    dentries and inodes but needs root, 'fadvise' only drops file data.
+    """
+    if drop_caches:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as fd:
+            fd.write('3\n')
+        return 'drop_caches'
+    if not hasattr(os, 'posix_fadvise'):
+        return None
+    for root, directories, files in os.walk(directory):
+        for name in files:
+            try:
+                fd = os.open(os.path.join(root, name), os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+    return 'fadvise'
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(SEARCHER),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, universal_newlines=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_searcher(command):
+    """
+    Run command, returning (seconds, peak RSS in KiB, --stats report).
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    process.stderr.close()
+    # wait4() rather than wait() for this child's own resource usage
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed:\n{stderr.decode(errors='replace')}")
+    # --stats is the last line written to stderr
+    report = json.loads(stderr.decode().strip().splitlines()[-1])
+    return elapsed, usage.ru_maxrss, report
+
+
+def measure(corpus, mode, output_format, cache, directory, repeat=1, drop_caches=False):
+    output = os.path.join(directory, 'crawl_benchmark.' + output_format)
+    command = [
+        sys.executable, SEARCHER, corpus, '--output_format', output_format,
+        '--output_file', output, '--stats',
+    ] + MODES[mode]
+
+    runs = []
+    cache_method = None
+    for i in range(repeat):
+        if os.path.exists(output):
+            os.remove(output)
+        if cache == 'cold':
+            cache_method = drop_page_cache(corpus, drop_caches)
+        elif not runs:
+            # untimed run to fill the page cache
+            run_searcher(command)
+            os.remove(output)
+        runs.append(run_searcher(command) + (os.stat(output).st_size, ))
+    os.remove(output)
+
+    # the median run by time
+    runs.sort(key=lambda run: run[0])
+    elapsed, peak_rss, report, output_bytes = runs[len(runs) // 2]
+    mib = 1024 * 1024
+    return {
+        'mode': mode,
+        'output_format': output_format,
+        'cache': cache,
+        'cache_method': cache_method,
+        'repeat': repeat,
+        'seconds': round(elapsed, 3),
+        'seconds_all': [round(run[0], 3) for run in runs],
+        'files': report['files'],
+        'bytes': report['bytes'],
+        'bytes_hashed': report['bytes_hashed'],
+        'files_per_second': round(report['files'] / elapsed, 1),
+        'mb_per_second': round(report['bytes'] / mib / elapsed, 1),
+        'mb_hashed_per_second': round(report['bytes_hashed'] / mib / elapsed, 1),
+        'peak_rss_kb': peak_rss,
+        'output_bytes': output_bytes,
+        'stages': report['stages'],
+    }
+
+
+def main():
+    parser = ArgumentParser(description="Crawler benchmark on a synthetic corpus")
+    parser.add_argument("corpus", help="Corpus directory, built by synthetic_corpus.py when missing.")
+    parser.add_argument("--modes", nargs='*', choices=list(MODES), default=list(MODES))
+    parser.add_argument("--output_formats", nargs='*', choices=OUTPUT_FORMATS, default=OUTPUT_FORMATS)
+    parser.add_argument("--caches", nargs='*', choices=CACHES, default=CACHES)
+    parser.add_argument("--repeat", help="Runs per measurement, the median is reported. Default: 1",
+        type=int, default=1)
+    parser.add_argument("--drop_caches", help="Drop caches through /proc/sys/vm/drop_caches, needs root.",
+        default=False, action='store_true')
+    parser.add_argument("--label", help="Label for the results. Default: the current git commit", default=None)
+    parser.add_argument("--results", help="JSON Lines file the results are appended to.", default=None)
+    parser.add_argument("--directory", help="Where output is written. Default: a new temporary directory",
+        default=None)
+    corpus_arguments(parser)
+    args = vars(parser.parse_args())
+
+    summary = build_corpus(args['corpus'], **corpus_parameters(args))
+    common = {
+        'label': args['label'] or commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': summary['parameters'],
+    }
+
+    with tempfile.TemporaryDirectory(dir=args['directory']) as directory:
+        for mode in args['modes']:
+            for output_format in args['output_formats']:
+                for cache in args['caches']:
+                    result = dict(common)
+                    result.update(measure(
+                        args['corpus'], mode, output_format, cache, directory,
+                        repeat=args['repeat'], drop_caches=args['drop_caches']
+                    ))
+                    line = json.dumps(result, sort_keys=True)
+                    print(line, flush=True)
+                    if args['results']:
+                        with open(args['results'], 'a') as fd:
+                            fd.write(line + '\n')
+
+
+if __name__ == "__main__":
+    main()
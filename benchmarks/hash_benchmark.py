@@ -0,0 +1,105 @@
+# benchmarks/hash_benchmark.py
+#
+# Compare the original read() based dropbox_hash against the readinto() and mmap hashing core.
+#
+#   python3 benchmarks/hash_benchmark.py --size_mb 4096
+#   python3 benchmarks/hash_benchmark.py --file /path/to/large.vmdk
+#
+# Reports elapsed time, throughput and Python heap allocations (tracemalloc) for each method.
+import os
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+from hashlib import sha256
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_system_searcher import HASH_BLOCK_SIZE, dropbox_hash
+
+
+def read_dropbox_hash(path):
+    # the original implementation - new bytes object per block, digests kept in a list
+    hash_list = []
+    with open(path, 'rb', 0) as fd:
+        while True:
+            chunk = fd.read(HASH_BLOCK_SIZE)
+            if not chunk:
+                break
+            hash_list.append(sha256(chunk).digest())
+    return sha256(b"".join(hash_list)).hexdigest()
+
+
+METHODS = {
+    'read': read_dropbox_hash,
+    'readinto': lambda path: dropbox_hash(path),
+    'mmap': lambda path: dropbox_hash(path, use_mmap=True),
+}
+
+
+def make_file(directory, size):
+    path = os.path.join(directory, 'hash_benchmark.bin')
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as fd:
+        remaining = size
+        while remaining > 0:
+            fd.write(block[:min(remaining, len(block))])
+            remaining -= len(block)
+    return path
+
+
+def measure(name, path, size):
+    method = METHODS[name]
+
+    start = time.perf_counter()
+    digest = method(path)
+    elapsed = time.perf_counter() - start
+
+    # allocation profile in a separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    method(path)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'method': name,
+        'size': size,
+        'seconds': round(elapsed, 3),
+        'mb_per_second': round(size / (1024 * 1024) / elapsed, 1) if elapsed else None,
+        'peak_allocated_bytes': peak,
+        'dropbox_hash': digest,
+    }
+
+
+def main():
+    parser = ArgumentParser(description="dropbox_hash micro-benchmark")
+    parser.add_argument("--file", help="Existing file to hash.  Default: generate a file.", default=None)
+    parser.add_argument("--size_mb", help="Size of the generated file in MiB. Default: 2048", type=int, default=2048)
+    parser.add_argument("--directory", help="Where to generate the file. Default: system temp directory", default=None)
+    parser.add_argument("--methods", nargs='*', choices=list(METHODS), default=list(METHODS))
+    args = vars(parser.parse_args())
+
+    generated = None
+    path = args['file']
+    if not path:
+        generated = path = make_file(args['directory'] or tempfile.gettempdir(), args['size_mb'] * 1024 * 1024)
+
+    try:
+        size = os.stat(path).st_size
+        results = [measure(name, path, size) for name in args['methods']]
+    finally:
+        if generated:
+            os.remove(generated)
+
+    for result in results:
+        print(json.dumps(result, sort_keys=True))
+
+    if len({result['dropbox_hash'] for result in results}) > 1:
+        print("dropbox_hash values differ between methods", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
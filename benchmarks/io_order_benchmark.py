@@ -0,0 +1,84 @@
+# benchmarks/io_order_benchmark.py
+#
+# Measure hashing throughput of each Crawler io_order on a real directory tree,
+# typically a mounted USB hard drive.
+#
+#   python3 benchmarks/io_order_benchmark.py /media/usb-drive/photos
+#
+# Before each run, the files are dropped from the page cache with posix_fadvise(DONTNEED)
+# so each io_order starts from a cold cache.  Outputs one JSON line per io_order.
+import os
+import sys
+import json
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_system_searcher import Crawler, IO_ORDERS, IO_WINDOW, scandir_walk
+
+
+def drop_page_cache(base_path):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for entry, st in scandir_walk(base_path):
+        try:
+            fd = os.open(entry.path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def measure(base_path, io_order, io_window, use_fadvise):
+    drop_page_cache(base_path)
+
+    crawler = Crawler(
+        base_path=base_path, walker='scandir', io_order=io_order, io_window=io_window,
+        use_fadvise=use_fadvise
+    )
+    files = 0
+    size = 0
+    start = time.perf_counter()
+    for record in crawler:
+        files += 1
+        size += record['size']
+        # dropbox_hash is computed when read, reading it hashes the file
+        record['dropbox_hash']
+    elapsed = time.perf_counter() - start
+
+    return {
+        'io_order': io_order,
+        'io_window': io_window,
+        'fadvise': use_fadvise,
+        'files': files,
+        'size': size,
+        'seconds': round(elapsed, 3),
+        'files_per_second': round(files / elapsed, 1) if elapsed else None,
+        'mb_per_second': round(size / (1024 * 1024) / elapsed, 1) if elapsed else None,
+    }
+
+
+def main():
+    parser = ArgumentParser(description="Crawler io_order throughput benchmark")
+    parser.add_argument("base_path", help="Directory tree to hash.")
+    parser.add_argument("--io_window", type=int, default=IO_WINDOW)
+    parser.add_argument("--fadvise", default=False, action='store_true')
+    parser.add_argument("--io_orders", nargs='*', choices=IO_ORDERS, default=IO_ORDERS)
+    args = vars(parser.parse_args())
+
+    if not hasattr(os, 'posix_fadvise'):
+        print("posix_fadvise() not available, runs after the first won't start from a cold cache",
+            file=sys.stderr)
+
+    for io_order in args['io_orders']:
+        result = measure(args['base_path'], io_order, args['io_window'], args['fadvise'])
+        print(json.dumps(result, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
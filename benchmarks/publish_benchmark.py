@@ -0,0 +1,93 @@
+# benchmarks/publish_benchmark.py
+#
+# Time how long Publish takes to write N synthetic records in each output format,
+# e.g. the sqlite output (including index builds) against the json output.
+#
+#   python3 benchmarks/publish_benchmark.py --records 10000000
+#
+# Outputs one JSON line per output format.
+import os
+import sys
+import json
+import time
+import tempfile
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_system_searcher import Publish, OUTPUT_FORMATS
+
+
+def synthetic_records(count):
+    suffixes = ['.jpg', '.txt', '.mp4', '.pdf', '.docx', '', ]
+    for i in range(count):
+        suffix = suffixes[i % len(suffixes)]
+        file_name = f"file{i}{suffix}"
+        relative_path = f"dir{i % 997}/sub{i % 31}/{file_name}"
+        yield {
+            'hostname': 'benchmark',
+            'volume': 'volume1',
+            'file_name': file_name,
+            'relative_path': relative_path,
+            'full_path': '/media/volume1/' + relative_path,
+            'size': (i * 7919) % 100000000,
+            'dropbox_hash': f"{(i * 2654435761) % (1 << 64):064x}",
+            'created': '2020-01-01T00:00:00+00:00',
+            'modified': '2020-01-01T00:00:00+00:00',
+            'suffix': suffix,
+            'mime_type': None,
+            'mime_encoding': None,
+            'is_archive': False,
+        }
+
+
+def measure(output_format, count, directory):
+    path = os.path.join(directory, 'publish_benchmark.' + output_format)
+    if output_format == 'sqlite':
+        publish = Publish(output_format, path)
+    else:
+        publish = Publish(output_format, open(path, mode='w', newline=''))
+
+    start = time.perf_counter()
+    first_time = True
+    for record in synthetic_records(count):
+        if first_time:
+            first_time = False
+            publish.header(record)
+        else:
+            publish.body(record)
+    publish.footer()
+    publish.close()
+    elapsed = time.perf_counter() - start
+
+    size = sum(
+        os.stat(os.path.join(directory, name)).st_size
+        for name in os.listdir(directory) if name.startswith('publish_benchmark.')
+    )
+    for name in os.listdir(directory):
+        if name.startswith('publish_benchmark.'):
+            os.remove(os.path.join(directory, name))
+
+    return {
+        'output_format': output_format,
+        'records': count,
+        'seconds': round(elapsed, 3),
+        'records_per_second': round(count / elapsed, 1) if elapsed else None,
+        'output_bytes': size,
+    }
+
+
+def main():
+    parser = ArgumentParser(description="Publish output format benchmark")
+    parser.add_argument("--records", help="Number of records. Default: 1000000", type=int, default=1000000)
+    parser.add_argument("--directory", help="Where output is written. Default: a new temporary directory", default=None)
+    parser.add_argument("--output_formats", nargs='*', choices=OUTPUT_FORMATS, default=['json', 'jsonl', 'sqlite', ])
+    args = vars(parser.parse_args())
+
+    with tempfile.TemporaryDirectory(dir=args['directory']) as directory:
+        for output_format in args['output_formats']:
+            print(json.dumps(measure(output_format, args['records'], directory), sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
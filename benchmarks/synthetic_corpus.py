@@ -0,0 +1,238 @@
+# benchmarks/synthetic_corpus.py
+#
+# Build a deterministic synthetic directory tree for benchmarking the Crawler:
+#
+#   tree/       a deep and wide directory tree of tiny files
+#   huge/       a few huge files
+#   archives/   zip, tgz and tar.bz2 archives plus archives nested inside archives
+#
+#   python3 benchmarks/synthetic_corpus.py /tmp/fss-corpus --tiny_files 1000000
+#
+# The same parameters always give the same file names, contents, sizes and modification
+# times, so results from different commits are comparable.  A corpus.json file in the
+# corpus directory records the parameters, an existing corpus built with the same
+# parameters is reused.  Outputs the corpus summary as one JSON line.
+import os
+import io
+import json
+import gzip
+import bz2
+import random
+import shutil
+import tarfile
+import zipfile
+from argparse import ArgumentParser
+
+# 2020-01-01T00:00:00+00:00, used for every file and archive member
+CORPUS_TIME = 1577836800
+CORPUS_VERSION = 1
+
+DEFAULTS = {
+    'seed': 0,
+    'depth': 4,
+    'width': 4,
+    'tiny_files': 20000,
+    'tiny_size': 512,
+    'huge_files': 2,
+    'huge_mb': 256,
+    'archives': 4,
+    'archive_members': 200,
+}
+
+BLOCK = 1024 * 1024
+
+
+def random_bytes(rng, size):
+    if size == 0:
+        return b''
+    return rng.getrandbits(size * 8).to_bytes(size, 'little')
+
+
+def write_file(path, data):
+    with open(path, 'wb') as fd:
+        fd.write(data)
+    os.utime(path, (CORPUS_TIME, CORPUS_TIME))
+
+
+def leaf_directories(base, depth, width):
+    # breadth first listing of every directory path at depth levels below base
+    level = [base, ]
+    for d in range(depth):
+        level = [os.path.join(parent, f"d{d}_{i}") for parent in level for i in range(width)]
+    return level
+
+
+def build_tree(directory, rng, depth, width, tiny_files, tiny_size):
+    leaves = leaf_directories(os.path.join(directory, 'tree'), depth, width)
+    for leaf in leaves:
+        os.makedirs(leaf, exist_ok=True)
+    suffixes = ['.txt', '.jpg', '.json', '.c', '', ]
+    size = 0
+    for i in range(tiny_files):
+        length = rng.randint(0, tiny_size)
+        path = os.path.join(leaves[i % len(leaves)], f"f{i}{suffixes[i % len(suffixes)]}")
+        write_file(path, random_bytes(rng, length))
+        size += length
+    return tiny_files, size
+
+
+def build_huge(directory, rng, huge_files, huge_mb):
+    os.makedirs(os.path.join(directory, 'huge'), exist_ok=True)
+    for i in range(huge_files):
+        path = os.path.join(directory, 'huge', f"huge{i}.bin")
+        with open(path, 'wb') as fd:
+            for block in range(huge_mb):
+                fd.write(random_bytes(rng, BLOCK))
+        os.utime(path, (CORPUS_TIME, CORPUS_TIME))
+    return huge_files, huge_files * huge_mb * BLOCK
+
+
+def members(rng, count, prefix):
+    return [
+        (f"{prefix}/m{i}.txt", random_bytes(rng, rng.randint(0, 64 * 1024)))
+        for i in range(count)
+    ]
+
+
+def zip_bytes(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        for name, data in entries:
+            # fixed timestamps keep the archive bytes identical between builds
+            z.writestr(zipfile.ZipInfo(name, date_time=(2020, 1, 1, 0, 0, 0)), data)
+    return buffer.getvalue()
+
+
+def tar_bytes(entries):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w', format=tarfile.GNU_FORMAT) as tar:
+        for name, data in entries:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = CORPUS_TIME
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def tgz_bytes(entries):
+    return gzip.compress(tar_bytes(entries), mtime=0)
+
+
+def tbz2_bytes(entries):
+    return bz2.compress(tar_bytes(entries))
+
+
+def build_archives(directory, rng, archives, archive_members):
+    base = os.path.join(directory, 'archives')
+    os.makedirs(base, exist_ok=True)
+    kinds = [('.zip', zip_bytes), ('.tgz', tgz_bytes), ('.tar.bz2', tbz2_bytes), ]
+    count = 0
+    size = 0
+    for i in range(archives):
+        suffix, build = kinds[i % len(kinds)]
+        data = build(members(rng, archive_members, f"a{i}"))
+        write_file(os.path.join(base, f"archive{i}{suffix}"), data)
+        count += 1 + archive_members
+        size += len(data)
+
+    # three levels: outer.tgz > inner.zip > deep.tar.bz2, and outer.zip > inner.tgz
+    deep = tbz2_bytes(members(rng, 20, 'deep'))
+    inner = zip_bytes(members(rng, 20, 'inner') + [('inner/deep.tar.bz2', deep), ])
+    outer = tgz_bytes(members(rng, 20, 'outer') + [('outer/inner.zip', inner), ])
+    write_file(os.path.join(base, 'nested.tgz'), outer)
+    size += len(outer)
+    inner = tgz_bytes(members(rng, 20, 'inner'))
+    outer = zip_bytes(members(rng, 20, 'outer') + [('outer/inner.tgz', inner), ])
+    write_file(os.path.join(base, 'nested.zip'), outer)
+    size += len(outer)
+    # records with --archive_depth 3: the two archives, their 5 * 20 members and 3 inner archives
+    count += 2 + 5 * 20 + 3
+    return count, size
+
+
+def build_corpus(directory, **parameters):
+    """
+    Build the corpus in directory, reusing it when corpus.json shows it was built with the
+    same parameters.  Returns the corpus summary.
+    """
+    settings = dict(DEFAULTS)
+    settings.update({k: v for k, v in parameters.items() if v is not None})
+    settings['version'] = CORPUS_VERSION
+
+    summary_path = os.path.join(directory, 'corpus.json')
+    try:
+        with open(summary_path, 'r') as fd:
+            summary = json.load(fd)
+        if summary['parameters'] == settings:
+            return summary
+    except (OSError, ValueError, KeyError):
+        pass
+
+    for name in ('tree', 'huge', 'archives', ):
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+    # one generator per part, so changing one part's parameters leaves the others unchanged
+    seed = settings['seed']
+    tiny_count, tiny_size = build_tree(
+        directory, random.Random(f"{seed}-tree"), settings['depth'], settings['width'],
+        settings['tiny_files'], settings['tiny_size']
+    )
+    huge_count, huge_size = build_huge(
+        directory, random.Random(f"{seed}-huge"), settings['huge_files'], settings['huge_mb']
+    )
+    archive_count, archive_size = build_archives(
+        directory, random.Random(f"{seed}-archives"), settings['archives'], settings['archive_members']
+    )
+
+    # corpus.json is a file of the corpus too
+    summary = {
+        'parameters': settings,
+        'files': tiny_count + huge_count + settings['archives'] + 2 + 1,
+        'records_with_archives': tiny_count + huge_count + archive_count + 1,
+        'bytes': tiny_size + huge_size + archive_size,
+        'directories': sum(settings['width'] ** d for d in range(settings['depth'] + 1)) + 2,
+    }
+    with open(summary_path, 'w') as fd:
+        json.dump(summary, fd, sort_keys=True)
+    return summary
+
+
+def corpus_arguments(parser):
+    """
+    Add the corpus parameters to an ArgumentParser, all defaulting to None for DEFAULTS.
+    """
+    parser.add_argument("--seed", type=int, default=None, help=f"Default: {DEFAULTS['seed']}")
+    parser.add_argument("--depth", type=int, default=None, help=f"Tree depth. Default: {DEFAULTS['depth']}")
+    parser.add_argument("--width", type=int, default=None,
+        help=f"Sub-directories per directory. Default: {DEFAULTS['width']}")
+    parser.add_argument("--tiny_files", type=int, default=None,
+        help=f"Number of tiny files. Default: {DEFAULTS['tiny_files']}")
+    parser.add_argument("--tiny_size", type=int, default=None,
+        help=f"Largest tiny file in bytes. Default: {DEFAULTS['tiny_size']}")
+    parser.add_argument("--huge_files", type=int, default=None,
+        help=f"Number of huge files. Default: {DEFAULTS['huge_files']}")
+    parser.add_argument("--huge_mb", type=int, default=None,
+        help=f"Size of each huge file in MiB. Default: {DEFAULTS['huge_mb']}")
+    parser.add_argument("--archives", type=int, default=None,
+        help=f"Number of zip, tgz and tar.bz2 archives, besides the nested ones. Default: {DEFAULTS['archives']}")
+    parser.add_argument("--archive_members", type=int, default=None,
+        help=f"Members per archive. Default: {DEFAULTS['archive_members']}")
+
+
+def corpus_parameters(args):
+    return {k: args[k] for k in DEFAULTS}
+
+
+def main():
+    parser = ArgumentParser(description="Build a deterministic synthetic corpus")
+    parser.add_argument("directory", help="Where the corpus is built.")
+    corpus_arguments(parser)
+    args = vars(parser.parse_args())
+
+    summary = build_corpus(args['directory'], **corpus_parameters(args))
+    print(json.dumps(summary, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
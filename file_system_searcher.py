@@ -1,57 +1,450 @@
 # file_system_searcher.py
 import os
 import sys
+import re
+import fnmatch
+import stat
+import time
 import pytz
 import mimetypes
 import socket
 import json
 import csv
+import io
 import zipfile
 import tarfile
+import sqlite3
+import threading
+import tempfile
+import mmap
+import struct
+import queue
+import multiprocessing
+import signal
+import functools
+import select
+import errno
+import ctypes
+import ctypes.util
+import heapq
+import marshal
+import asyncio
+import itertools
+from collections import deque
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path, WindowsPath, PurePath
 from platform import uname
 from argparse import ArgumentParser
 from datetime import datetime, MINYEAR
 from hashlib import sha256
 
+PROGRESS_INTERVAL = 10
+TELEMETRY_STAGES = ('list', 'stat', 'crawl', 'hash', 'archive', 'publish', 'write', )
+
+class Telemetry():
+    """
+    Per stage timers and counters for --stats, --progress and SIGUSR1.
+
+    Each stage has its total time, number of calls and number of errors.  Times are exclusive,
+    time spent in a nested stage - hashing an archive member while listing the archive, or a
+    lazily computed dropbox_hash while publishing - only counts towards the inner stage.  Stages
+    run on several threads, e.g. with --hash_workers, add up and can exceed the elapsed time.
+
+    Instrumented code checks the module level telemetry, which stays None unless enabled, so
+    the instrumentation costs one comparison per call when off.
+    """
+    def __init__(self):
+        # reentrant - the SIGUSR1 handler runs on the main thread, possibly inside add()
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.started = time.monotonic()
+        self.stages = {stage: [0.0, 0, 0] for stage in TELEMETRY_STAGES}
+        self.counters = {'files': 0, 'bytes': 0, 'bytes_hashed': 0, 'directories': 0, }
+        self.progress_stop = threading.Event()
+        self.progress_thread = None
+
+    def call(self, stage, function, args=(), kwargs=None, failed=None):
+        """
+        Time function(*args, **kwargs) as stage.  An exception, other than StopIteration, or a
+        result for which failed(result) is True counts as an error.
+        """
+        local = self.local
+        outer = getattr(local, 'nested', 0.0)
+        local.nested = 0.0
+        error = False
+        start = time.perf_counter()
+        try:
+            result = function(*args, **(kwargs or {}))
+            error = failed is not None and failed(result)
+            return result
+        except StopIteration:
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add(stage, elapsed - local.nested, errors=int(error))
+            local.nested = outer + elapsed
+
+    def add(self, stage, seconds, calls=1, errors=0):
+        with self.lock:
+            totals = self.stages[stage]
+            totals[0] += seconds
+            totals[1] += calls
+            totals[2] += errors
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def merge(self, report):
+        """
+        Add a report() from another process, e.g. a --workers crawl worker.
+        """
+        with self.lock:
+            for name in self.counters:
+                self.counters[name] += report[name]
+            for stage, totals in report['stages'].items():
+                self.add(stage, totals['seconds'], calls=totals['calls'], errors=totals['errors'])
+
+    def instrument_publish(self, publish):
+        """
+        Time publish's header(), body() and footer() as 'publish' and its output writes as
+        'write', counting published records and their sizes.
+        """
+        def published(function):
+            def wrapper(record):
+                with self.lock:
+                    self.counters['files'] += 1
+                    self.counters['bytes'] += record.get('size') or 0
+                return self.call('publish', function, (record, ))
+            return wrapper
+
+        footer = publish.footer
+        write_data = publish.write_data
+        publish.header = published(publish.header)
+        publish.body = published(publish.body)
+        publish.footer = lambda: self.call('publish', footer)
+        publish.write_data = lambda data: self.call('write', write_data, (data, ))
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        with self.lock:
+            counters = dict(self.counters)
+            stages = {
+                stage: {'seconds': round(seconds, 3), 'calls': calls, 'errors': errors, }
+                for stage, (seconds, calls, errors) in self.stages.items()
+            }
+        report = {'elapsed': round(elapsed, 3), }
+        report.update(counters)
+        report['files_per_second'] = round(counters['files'] / elapsed, 1) if elapsed else None
+        report['bytes_hashed_per_second'] = round(counters['bytes_hashed'] / elapsed, 1) if elapsed else None
+        report['errors'] = sum(totals['errors'] for totals in stages.values())
+        report['stages'] = stages
+        return report
+
+    def dump(self):
+        print(json.dumps(self.report(), sort_keys=True), file=sys.stderr, flush=True)
+
+    def progress(self):
+        report = self.report()
+        rate = report['bytes_hashed_per_second'] or 0
+        print(
+            f"Progress: {report['elapsed']:.0f}s, {report['files']} files "
+            f"({report['files_per_second']}/s), {report['directories']} directories, "
+            f"{report['bytes_hashed'] / (1024 * 1024):.1f} MiB hashed ({rate / (1024 * 1024):.1f} MiB/s), "
+            f"{report['errors']} errors",
+            file=sys.stderr, flush=True
+        )
+
+    def start_progress(self, interval=PROGRESS_INTERVAL):
+        """
+        Print a progress line to stderr every interval seconds until stop_progress().
+        """
+        def progress_loop():
+            while not self.progress_stop.wait(interval):
+                self.progress()
+
+        self.progress_thread = threading.Thread(target=progress_loop, name='Progress', daemon=True)
+        self.progress_thread.start()
+
+    def stop_progress(self):
+        if self.progress_thread:
+            self.progress_stop.set()
+            self.progress_thread.join()
+            self.progress_thread = None
+
+
+# enabled by --stats and --progress
+telemetry = None
+
+def timed(stage, failed=None):
+    """
+    Decorator timing each call as stage while telemetry is enabled, see Telemetry.call().
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if telemetry is None:
+                return function(*args, **kwargs)
+            return telemetry.call(stage, function, args, kwargs, failed=failed)
+        return wrapper
+    return decorate
+
+
+def hash_failed(digest):
+    return digest == ''
+
+
 HASH_BLOCK_SIZE = 4 * 1024 * 1024
 
-def dropbox_hash(path, verbose=False):
-    hash_list = []
+# one reusable HASH_BLOCK_SIZE buffer per thread
+hash_buffers = threading.local()
+
+def hash_buffer():
+    buffer = getattr(hash_buffers, 'buffer', None)
+    if buffer is None:
+        buffer = bytearray(HASH_BLOCK_SIZE)
+        hash_buffers.buffer = buffer
+    return memoryview(buffer)
+
+
+def read_blocks(fd):
+    """
+    HASH_BLOCK_SIZE blocks of a binary file object, each a view of the per-thread buffer that
+    is only valid until the next block is read.
+    """
+    view = hash_buffer()
+    while True:
+        # readinto() may come up short on archive members, only a short block ends the data
+        filled = 0
+        while filled < HASH_BLOCK_SIZE:
+            count = fd.readinto(view[filled:])
+            if not count:
+                break
+            filled += count
+        if filled == 0:
+            break
+        yield view[:filled]
+        if filled < HASH_BLOCK_SIZE:
+            break
+
+
+class HashBudgetExceeded(Exception):
+    pass
+
+
+class HashBudget():
+    """
+    Per file hashing limits.  seconds is wall clock time and max_bytes the number of bytes read,
+    either None for no limit.  check() is called before each block is hashed, so a file stops
+    within one block of its budget.  status is '' while within budget, 'skipped' for a file
+    that isn't a regular file or grew past max_bytes and 'timeout' for a file that ran out of time.
+    """
+    __slots__ = ('seconds', 'max_bytes', 'deadline', 'count', 'status', )
+
+    def __init__(self, seconds=None, max_bytes=None):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.count = 0
+        self.status = ''
+
+    def check(self, size):
+        self.count += size
+        if self.max_bytes is not None and self.count > self.max_bytes:
+            self.status = 'skipped'
+            raise HashBudgetExceeded(f"more than {self.max_bytes} bytes")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.status = 'timeout'
+            raise HashBudgetExceeded(f"more than {self.seconds} seconds")
+
+
+class DropboxHasher():
+    """
+    Shared hashing core for dropbox_hash(), zip_dropbox_hash() and tar_dropbox_hash().
+
+    The Dropbox content hash is the sha256 of the concatenated sha256 digests of each
+    HASH_BLOCK_SIZE block.  Block digests are fed into a running outer sha256 instead of being
+    kept in a list, and blocks are read with readinto() into a per-thread buffer, so hashing
+    doesn't allocate a new 4 MiB bytes object per block.
+    """
+    def __init__(self, budget=None):
+        self.outer = sha256()
+        self.blocks = 0
+        self.budget = budget
+
+    def update_block(self, block):
+        if self.budget is not None:
+            self.budget.check(len(block))
+        if telemetry is not None:
+            telemetry.count('bytes_hashed', len(block))
+        self.outer.update(sha256(block).digest())
+        self.blocks += 1
+
+    def update_file_object(self, fd):
+        """
+        Hash everything readable from a binary file object.
+        """
+        for block in read_blocks(fd):
+            self.update_block(block)
+
+    def update_mmap(self, fd):
+        """
+        Hash a regular file through mmap.  Falls back to update_file_object() for files that
+        can't be mapped, e.g. empty files or files too large for a 32 bit address space.
+        """
+        try:
+            mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError, OverflowError):
+            self.update_file_object(fd)
+            return
+
+        with mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for offset in range(0, len(view), HASH_BLOCK_SIZE):
+                    self.update_block(view[offset:offset + HASH_BLOCK_SIZE])
+
+    def hexdigest(self):
+        return self.outer.hexdigest()
+
+
+def fadvise(fd, advice):
+    # page cache hints are only a nicety, ignore platforms and file systems without them
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        except OSError:
+            pass
+
+
+def nonblocking_opener(path, flags):
+    # a FIFO put in place of a file since it was stat'ed would otherwise block open()
+    return os.open(path, flags | getattr(os, 'O_NONBLOCK', 0))
+
+@timed('hash', failed=hash_failed)
+def dropbox_hash(path, verbose=False, use_mmap=False, use_fadvise=False, budget=None):
+    """
+    With a HashBudget, hashing stops with '' and budget.status set once the file is over budget.
+    """
+    hasher = DropboxHasher(budget=budget)
 
     try:
         # no buffering - otherwise read fails on large files - HASH_BLOCK_SIZE > default buffer size
-        with open(path, 'rb', 0) as fd:
-            while True:
-                chunk = fd.read(HASH_BLOCK_SIZE)
-                if not chunk or len(chunk) == 0:
+        with open(path, 'rb', 0, opener=nonblocking_opener if budget else None) as fd:
+            if budget is not None and not stat.S_ISREG(os.fstat(fd.fileno()).st_mode):
+                budget.status = 'skipped'
+                raise HashBudgetExceeded('not a regular file')
+            if use_fadvise:
+                fadvise(fd.fileno(), getattr(os, 'POSIX_FADV_SEQUENTIAL', 0))
+            if use_mmap:
+                hasher.update_mmap(fd)
+            else:
+                hasher.update_file_object(fd)
+            if use_fadvise:
+                # done with this file, don't push everything else out of the page cache
+                fadvise(fd.fileno(), getattr(os, 'POSIX_FADV_DONTNEED', 0))
+
+    except:
+        if verbose:
+            e = sys.exc_info()[0]
+            print(f"\nException: {e}", file=sys.stderr)
+            print(f"File Name: {path}", file=sys.stderr)
+            print(f"Hash List Length: {hasher.blocks}\n", file=sys.stderr)
+        return ''
+
+    return hasher.hexdigest()
+
+
+LARGE_FILE_THRESHOLD = 256 * 1024 * 1024
+
+@timed('hash', failed=hash_failed)
+def parallel_dropbox_hash(path, executor, workers, verbose=False, use_fadvise=False, budget=None):
+    """
+    Same result as dropbox_hash() but the HASH_BLOCK_SIZE blocks are read with os.pread()
+    at their offsets and hashed concurrently on executor.  At most 2 * workers blocks are
+    in memory at any time.  Falls back to dropbox_hash() where os.pread() isn't available.
+    """
+    if not hasattr(os, 'pread'):
+        return dropbox_hash(path, verbose=verbose, use_fadvise=use_fadvise, budget=budget)
+
+    def hash_block(fd, offset):
+        if hasattr(os, 'preadv'):
+            # read straight into this thread's buffer
+            view = hash_buffer()
+            filled = 0
+            while filled < HASH_BLOCK_SIZE:
+                count = os.preadv(fd, [view[filled:], ], offset + filled)
+                if not count:
                     break
+                filled += count
+            return sha256(view[:filled]).digest()
+
+        chunks = []
+        remaining = HASH_BLOCK_SIZE
+        while remaining > 0:
+            chunk = os.pread(fd, remaining, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+            remaining -= len(chunk)
+        return sha256(b"".join(chunks)).digest()
 
-                hash_list.append(sha256(chunk).digest())
+    outer = sha256()
+    blocks = 0
+    fd = None
+    in_flight = deque()
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        st = os.fstat(fd)
+        size = st.st_size
+        if budget is not None and not stat.S_ISREG(st.st_mode):
+            budget.status = 'skipped'
+            raise HashBudgetExceeded('not a regular file')
+        for offset in range(0, size, HASH_BLOCK_SIZE):
+            if budget is not None:
+                budget.check(min(HASH_BLOCK_SIZE, size - offset))
+            if telemetry is not None:
+                telemetry.count('bytes_hashed', min(HASH_BLOCK_SIZE, size - offset))
+            in_flight.append(executor.submit(hash_block, fd, offset))
+            if len(in_flight) >= 2 * workers:
+                outer.update(in_flight.popleft().result())
+                blocks += 1
+        while in_flight:
+            outer.update(in_flight.popleft().result())
+            blocks += 1
+        if use_fadvise:
+            fadvise(fd, getattr(os, 'POSIX_FADV_DONTNEED', 0))
 
     except:
         if verbose:
             e = sys.exc_info()[0]
             print(f"\nException: {e}", file=sys.stderr)
             print(f"File Name: {path}", file=sys.stderr)
-            print(f"Hash List Length: {len(hash_list)}\n", file=sys.stderr)
+            print(f"Hash List Length: {blocks}\n", file=sys.stderr)
         return ''
-    
-    hash = sha256(b"".join(hash_list))
-    return  hash.hexdigest()
+    finally:
+        if fd is not None:
+            # wait for any outstanding reads before closing the descriptor
+            for future in in_flight:
+                future.exception()
+            os.close(fd)
+
+    return outer.hexdigest()
 
 
-def zip_dropbox_hash(z_file, zip_name, name, verbose=False):
-    hash_list = []
+@timed('hash', failed=hash_failed)
+def zip_dropbox_hash(z_file, zip_name, name, verbose=False, budget=None):
+    hasher = DropboxHasher(budget=budget)
 
     try:
         with z_file.open(name, 'r') as f:
-            while True:
-                chunk = f.read(HASH_BLOCK_SIZE)
-                if len(chunk) == 0:
-                    break
-
-                hash_list.append(sha256(chunk).digest())
+            hasher.update_file_object(f)
 
     except:
         if verbose:
@@ -59,23 +452,18 @@ def zip_dropbox_hash(z_file, zip_name, name, verbose=False):
             print(f"\nException: {e}", file=sys.stderr)
             print(f"Zip Archive File Name: {zip_name}", file=sys.stderr)
             print(f"File Name: {name}", file=sys.stderr)
-            print(f"Hash List Length: {len(hash_list)}\n", file=sys.stderr)
+            print(f"Hash List Length: {hasher.blocks}\n", file=sys.stderr)
         return ''
- 
-    hash = sha256(b"".join(hash_list))
-    return  hash.hexdigest()
 
-def tar_dropbox_hash(tar, tarinfo, tar_file_name, file_name, verbose=False):
-    hash_list = []
+    return hasher.hexdigest()
+
+@timed('hash', failed=hash_failed)
+def tar_dropbox_hash(tar, tarinfo, tar_file_name, file_name, verbose=False, budget=None):
+    hasher = DropboxHasher(budget=budget)
 
     try:
         fd = tar.extractfile(tarinfo)
-        while True:
-            chunk = fd.read(HASH_BLOCK_SIZE)
-            if len(chunk) == 0:
-                break
-
-            hash_list.append(sha256(chunk).digest())
+        hasher.update_file_object(fd)
 
     except:
         if verbose:
@@ -83,520 +471,4222 @@ def tar_dropbox_hash(tar, tarinfo, tar_file_name, file_name, verbose=False):
             print(f"\nException: {e}", file=sys.stderr)
             print(f"Tar Archive File Name: {tar_file_name}", file=sys.stderr)
             print(f"File Name: {file_name}", file=sys.stderr)
-            print(f"Hash List Length: {len(hash_list)}\n", file=sys.stderr)
+            print(f"Hash List Length: {hasher.blocks}\n", file=sys.stderr)
         return ''
- 
-    hash = sha256(b"".join(hash_list))
-    return  hash.hexdigest()
-
-def convert_datetime_to_utc(dt):
-    return pytz.utc.localize(dt)
 
-ZIP_FILE_SUFFIXES = [
-    '.zip',
-]
-
-def is_zip_file(file_name):
-    return any(file_name.lower().endswith(suffix) for suffix in ZIP_FILE_SUFFIXES)
+    return hasher.hexdigest()
 
-TAR_FILE_SUFFIXES = [
-    '.tar', '.tgz', '.tar.bz2', 'tar.gz',
-]
+def budgeted_hash(hash_function, size, hash_timeout=None, hash_max_bytes=None):
+    """
+    (dropbox_hash, hash_status) of an archive member hashed by hash_function(budget), the
+    archive member counterpart of HashJob.run().  Members larger than hash_max_bytes, going by
+    their header, aren't read at all.
+    """
+    if hash_max_bytes is not None and size > hash_max_bytes:
+        return '', 'skipped'
+    budget = None
+    if hash_timeout or hash_max_bytes is not None:
+        budget = HashBudget(hash_timeout, hash_max_bytes)
+    digest = hash_function(budget)
+    if budget is not None and budget.status:
+        return '', budget.status
+    return digest, ''
 
-def is_tar_file(file_name):
-    return any(file_name.lower().endswith(suffix) for suffix in TAR_FILE_SUFFIXES)
+# Linux FIEMAP ioctl - _IOWR('f', 11, struct fiemap)
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = struct.Struct('=QQLLLL')
+FIEMAP_EXTENT = struct.Struct('=QQQQQLLLL')
 
+def physical_offset(path):
+    """
+    Physical byte offset of the first extent of a file on its device using the Linux FIEMAP
+    ioctl.  None when not available - not Linux, file system without FIEMAP, empty file, etc.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return None
 
-class Publish():
-    def __init__(self, output_format, output_fd):
-        self.fd = output_fd
-        self.record_count = 0
-        self.header = None
-        self.body = None
-        self.footer = None
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+    # fm_start, fm_length, fm_flags, fm_mapped_extents, fm_extent_count, fm_reserved
+    FIEMAP_HEADER.pack_into(request, 0, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            fcntl.ioctl(fd, FS_IOC_FIEMAP, request, True)
+        finally:
+            os.close(fd)
+    except OSError:
+        return None
 
-        if output_format == 'txt':
-            self.header = self.txt_header
-            self.body = self.txt_body
-            self.footer = self.txt_footer
-        elif output_format == 'json':
-            self.header = self.json_header
-            self.body = self.json_body
-            self.footer = self.json_footer
-        elif output_format == 'csv':
-            self.header = self.csv_header
-            self.body = self.csv_body
-            self.footer = self.csv_footer
-        else:
-            raise ValueError(f"Not a valid output format: {output_format}")
-    
-    def txt_header(self, record):
-        first_key = True
-        s = ''
-        k_list = list(record)
-        k_list.sort()
-        for k in k_list:
-            if not first_key:
-                s += "\t"
-            else:
-                first_key = False
-            s += k
-        print(s, file=self.fd)
-        self.txt_body(record)
-    
-    def txt_body(self, record):
-        first_key = True
-        s = ''
-        k_list = list(record)
-        k_list.sort()
-        for k in k_list:
-            if not first_key:
-                s += "\t"
-            else:
-                first_key = False
-            s += str(record[k])
-        print(s, file=self.fd)
-        self.record_count = self.record_count + 1
+    mapped_extents = FIEMAP_HEADER.unpack_from(request, 0)[3]
+    if not mapped_extents:
+        return None
+    # fe_logical, fe_physical, ...
+    return FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)[1]
 
-    def txt_footer(self):
-        print(f"Records: {self.record_count}", file=self.fd)
 
-    def json_header(self, record):
-        print('[', file=self.fd)
-        self.json_body(record)
+IO_ORDERS = ['discovery', 'inode', 'extent', ]
+IO_WINDOW = 256
 
-    def json_body(self, record):
-        print(json.dumps(record, sort_keys=True) + ',', file=self.fd)
-        self.record_count = self.record_count + 1
+def io_order_key(io_order, job):
+    """
+    Sort key putting hash jobs in on-disk order.  Records without a job go first.
+    """
+    if job is None:
+        return (-1, 0, )
+    if io_order == 'extent':
+        offset = physical_offset(job.path)
+        if offset is not None:
+            return (job.device, offset, )
+    return (job.device, job.inode, )
 
-    def json_footer(self):
-        print(']', file=self.fd)
 
-    def csv_header(self, record):
-        k_list = list(record)
-        k_list.sort()
-        self.csvwriter = csv.writer(self.fd, dialect='excel', delimiter='|')
-        self.csvwriter.writerow(k_list)
-        self.csv_body(record)
+HASH_CACHE_COMMIT_INTERVAL = 1000
 
-    def csv_body(self, record):
-        k_list = list(record)
-        k_list.sort()
-        r_list = [record[k] for k in k_list]
-        self.csvwriter.writerow(r_list)
+class HashCache():
+    """
+    Persistent SQLite cache of dropbox_hash values so rescans skip reading unchanged files.
 
-    def csv_footer(self):
-        pass
+    File system entries are keyed by (device, inode, size, mtime_ns).  Archive members are keyed
+    by the archive file's (device, inode, size, mtime_ns) plus the member name.  When max_entries
+    is set, the least recently used entries are evicted once the cache grows past that size.
 
-    def close(self):
-        self.fd.close()
+    Safe to share between HashPool threads.  With deferred, used by parallel_main_loop() worker
+    processes, the cache file is only read.  Hits and new entries are collected for drain() and
+    written by the coordinating process with apply(), so there is only ever one writer.
+    """
+    def __init__(self, path, max_entries=None, deferred=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.deferred = deferred
+        self.touched = []
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+        # timeout - parallel_main_loop() worker processes share the cache file
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        # readers don't wait for the writer
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                member TEXT NOT NULL,
+                dropbox_hash TEXT NOT NULL,
+                used INTEGER NOT NULL,
+                PRIMARY KEY (device, inode, member, size, mtime_ns)
+            ) WITHOUT ROWID
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS hashes_used ON hashes (used)")
+        self.db.commit()
+        # logical clock for least recently used eviction
+        self.clock = self.db.execute("SELECT COALESCE(MAX(used), 0) FROM hashes").fetchone()[0]
+        self.uncommitted = 0
 
+    @staticmethod
+    def key(st, member=''):
+        """
+        Cache key for a file's os.stat_result or, with member, for a member of an archive file.
+        None when the file system doesn't provide inode numbers.
+        """
+        if not st.st_ino:
+            return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, member, )
 
-class Crawler():
-    def __init__(self, base_path=None, volume=None, verbose=False, search_archives=False, hash=True):
-        self.current_working_directory = Path.cwd()
-        self.volume = volume
-        self.verbose = verbose
-        self.hostname = socket.gethostname()
-        if not base_path:
-            raise ValueError('base_path must be a valid path')
-        self.base_path = self.base_to_absolute_path(base_path)
-        self.hash = hash
-        self.mode = 'Crawler'
-        self.zip_crawler = None
-        self.tar_crawler = None
-        self.archive_name = None
-        self.search_archives = search_archives
-        self.archive_record = None
+    def get(self, key, size=0):
+        if key is None:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                """SELECT dropbox_hash FROM hashes
+                WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ? AND member = ?""",
+                key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_saved += size
+            if self.deferred:
+                self.touched.append(key)
+                return row[0]
+            self.clock += 1
+            self.db.execute(
+                """UPDATE hashes SET used = ?
+                WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ? AND member = ?""",
+                (self.clock, ) + key
+            )
+            self.written()
+            return row[0]
 
-    def base_to_absolute_path(self, base_path):
-        if base_path is None:
-            absolute_base_path = self.current_working_directory
-        elif base_path[0] == '/' or base_path[0] == '\\' or ( len(base_path) > 1 and base_path[1] == ':'):
-            absolute_base_path = Path(base_path)
-            if not absolute_base_path.is_absolute():
-                # assume same drive letter (if any) as current_working_directory
-                # if this box is not Windows, Path.drive returns ''
-                absolute_base_path = Path(self.current_working_directory.drive + base_path)
-        else:
-            # assume path relative to current working directory
-            absolute_base_path = self.current_working_directory / base_path
-                
-        # remove '/../' and parent dir with resolve()
-        return absolute_base_path.resolve()
+    def put(self, key, digest):
+        if key is None or not digest:
+            return
+        device, inode, size, mtime_ns, member = key
+        with self.lock:
+            if self.deferred:
+                self.pending.append((key, digest, ))
+                return
+            self.clock += 1
+            # an older version of the same file is never going to match again
+            self.db.execute(
+                "DELETE FROM hashes WHERE device = ? AND inode = ? AND member = ?",
+                (device, inode, member, )
+            )
+            self.db.execute(
+                "INSERT INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                key + (digest, self.clock, )
+            )
+            self.written()
 
-    def path_crawler(self, base_path):
-        self.base_path = self.base_to_absolute_path(base_path)
-        return self
+    def drain(self):
+        """
+        Return and forget the (touched keys, pending (key, digest) pairs) collected in deferred mode.
+        """
+        with self.lock:
+            touched, pending = self.touched, self.pending
+            self.touched, self.pending = [], []
+        return touched, pending
 
-    def __iter__(self):
-        self.path_iterator = self.base_path.glob('**/*')
-        self.path_iterator.__init__()
-        return self
-    
-    def __next__(self):
-        if self.mode == 'Crawler':
-            record = self.next_crawler()
-            self.archive_record = None
-            if self.search_archives and is_tar_file(record['file_name']):
-                self.mode = 'TarCrawler'
-                self.archive_record = record
-            elif self.search_archives and is_zip_file(record['file_name']):
-                self.mode = 'ZipCrawler'
-                self.archive_record = record
-            return record
-        elif self.mode == 'TarCrawler':
-            if not self.tar_crawler:
-                self.tar_crawler = TarCrawler(
-                    self.archive_record['full_path'],
-                    volume=self.volume, verbose=self.verbose, hash=self.hash
-                )
-                self.tar_crawler = self.tar_crawler.__iter__()
-            try:
-                record = self.tar_crawler.__next__()
-                if record is None:
-                    raise StopIteration()
-                return record
-            except StopIteration:
-                self.mode = 'Crawler'
-                self.tar_crawler = None
-                self.archive_record = None
-                return self.__next__()
-        elif self.mode == 'ZipCrawler':
-            if not self.zip_crawler:
-                self.zip_crawler = ZipCrawler(
-                    self.archive_record['full_path'],
-                    volume=self.volume, verbose=self.verbose, hash=self.hash
+    def apply(self, touched, pending):
+        """
+        Write the results of another HashCache's drain().
+        """
+        for key, digest in pending:
+            self.put(key, digest)
+        with self.lock:
+            for key in touched:
+                self.clock += 1
+                self.db.execute(
+                    """UPDATE hashes SET used = ?
+                    WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ? AND member = ?""",
+                    (self.clock, ) + tuple(key)
                 )
-                self.zip_crawler = self.zip_crawler.__iter__()
-            try:
-                record = self.zip_crawler.__next__()
-                if record is None:
-                    raise StopIteration()
-                return record
-            except StopIteration:
-                self.mode = 'Crawler'
-                self.zip_crawler = None
-                self.archive_record = None
-                return self.__next__()
-        raise StopIteration()
+                self.written()
 
-    def next_crawler(self):
-        p = None
-        failures = 0
-        is_file = False
-        while not (p and is_file):
-            if p:
-                try:
-                    is_file = p.is_file()
-                except PermissionError as e:
-                    is_file = False
-                    if self.verbose:
-                        print(f"\nException: {e}", file=sys.stderr)
-                        print(f"Crawler.next_crawler(): Permission Problem At: {self.base_path}\n",
-                            file=sys.stderr)
-            if p and is_file:
-                break
-            try:
-                p = self.path_iterator.__next__()
-                failures = 0
-            except (OSError, FileNotFoundError) as e:
-                failures += 1
-                if self.verbose:
-                    print(f"\nException: {e}", file=sys.stderr)
-                    print(
-                        f"Crawler.__next__() {failures} iterator failures at {self.base_path}\n",
-                        file=sys.stderr)
-                if failures > 10:
-                    # This might be overkill.
-                    # Generally when these exceptions occur, the iterator is done and won't restart on the first try.
-                    raise StopIteration()
+    def written(self):
+        # called with self.lock held
+        self.uncommitted += 1
+        if self.uncommitted >= HASH_CACHE_COMMIT_INTERVAL:
+            self.db.commit()
+            self.uncommitted = 0
 
-        created = (convert_datetime_to_utc(datetime.fromtimestamp(p.stat().st_ctime))).isoformat()
-        modified = (convert_datetime_to_utc(datetime.fromtimestamp(p.stat().st_mtime))).isoformat()
-
-        record = {
-            'hostname': self.hostname,
-            'volume': self.volume,
-            'file_name': self.get_file_name(p),
-            'relative_path': str(p.relative_to(self.base_path)),
-            'full_path': str(self.base_path / p),
-            'size': int(p.stat().st_size),
-            'dropbox_hash': '',
-            'created': created,
-            'modified': modified,
-            'suffix': p.suffix,
-            'mime_type': None,
-            'mime_encoding': None,
-            'is_archive': False,
-        }
+    def invalidate(self, path):
+        """
+        Remove the entries for path, including members when path is an archive file.
+        """
+        st = os.stat(path)
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM hashes WHERE device = ? AND inode = ?",
+                (st.st_dev, st.st_ino, )
+            )
+            self.db.commit()
 
-        record['mime_type'], record['mime_encoding'] = mimetypes.guess_type(p, strict=False)
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM hashes")
+            self.db.commit()
 
-        if self.verbose:
-            print(f"{record['full_path']}, {record['size']}", file=sys.stderr)
+    def evict(self):
+        """
+        Drop least recently used entries until the cache holds at most max_entries entries.
+        """
+        if not self.max_entries:
+            return 0
+        with self.lock:
+            count = self.db.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+            excess = count - self.max_entries
+            if excess <= 0:
+                return 0
+            self.db.execute(
+                """DELETE FROM hashes WHERE (device, inode, member, size, mtime_ns) IN (
+                    SELECT device, inode, member, size, mtime_ns FROM hashes ORDER BY used LIMIT ?
+                )""",
+                (excess, )
+            )
+            self.db.commit()
+            return excess
 
-        if self.hash and record['size'] > 0:
-            record['dropbox_hash'] = dropbox_hash(p, verbose=self.verbose)
+    def compact(self):
+        """
+        Evict down to max_entries and give the free space back to the file system.
+        """
+        self.evict()
+        with self.lock:
+            self.db.commit()
+            self.db.execute("VACUUM")
 
-        if not (created and modified) and self.verbose:
-            print('\ncreated or modified is None\n', record, '\n', file=sys.stderr)
+    def statistics(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytes_saved': self.bytes_saved,
+        }
 
-        return record
-    
-    def get_file_name(self, name):
-        name = str(name)
-        if '/' in name:
-            parts = name.split('/')
-            return parts[-1]
-        elif '\\' in name:
-            parts = name.split('\\')
-            return parts[-1]
-        return name
+    def close(self):
+        if not self.deferred:
+            self.evict()
+        with self.lock:
+            self.db.commit()
+            self.db.close()
 
-    def file_system_search(self, base_path):
-        for record in self.path_crawler(base_path):
-            self.output(record)
 
-    def output(self, record):
-        print(record)
+class ArchiveCache():
+    """
+    Persistent SQLite cache of the member records of zip and tar archives so rescans with
+    --search_archives don't reopen and decompress unchanged archives.
 
+    Listings are keyed by the archive file's (device, inode, size, mtime_ns) and the archive
+    nesting depth searched, and replayed in archive order.  A listing made without hashing only
+    serves crawls that don't hash.  When max_entries is set, the least recently used archives
+    are evicted once the cache holds more than max_entries member records.
 
-class ZipCrawler():
-    def __init__(self, zipfile, volume, verbose=False, hash=True):
-        self.file = zipfile
-        self.current_working_directory = Path.cwd()
+    With deferred, used by parallel_main_loop() worker processes, the cache file is only read.
+    Hits and new listings are collected for drain() and written by the coordinating process
+    with apply().
+    """
+    def __init__(self, path, max_entries=None, deferred=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.deferred = deferred
+        self.touched = []
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+        self.members_replayed = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+        # timeout - parallel_main_loop() worker processes share the cache file
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS archives (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                hashed INTEGER NOT NULL,
+                members INTEGER NOT NULL,
+                used INTEGER NOT NULL,
+                PRIMARY KEY (device, inode)
+            ) WITHOUT ROWID
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS members (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                file_name TEXT,
+                relative_path TEXT,
+                member_path TEXT,
+                size INTEGER,
+                created TEXT,
+                modified TEXT,
+                suffix TEXT,
+                dropbox_hash TEXT,
+                PRIMARY KEY (device, inode, seq)
+            ) WITHOUT ROWID
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS archives_used ON archives (used)")
+        self.db.commit()
+        # logical clock for least recently used eviction
+        self.clock = self.db.execute("SELECT COALESCE(MAX(used), 0) FROM archives").fetchone()[0]
+
+    @staticmethod
+    def key(st, depth=1):
+        """
+        Cache key for an archive file's os.stat_result searched depth levels deep, None without
+        inode numbers.
+        """
+        if not st.st_ino:
+            return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, depth, )
+
+    @staticmethod
+    def row(record, archive_path):
+        """
+        Cache row for a member record, taken before its timestamps are converted.
+        """
+        return (
+            record.file_name, record.relative_path, record.full_path[len(archive_path):],
+            record.size, json.dumps(record.created_value), json.dumps(record.modified_value),
+            record.suffix, record.dropbox_hash_value,
+        )
+
+    @staticmethod
+    def records(rows, constants, archive_path, hash=True):
+        """
+        Replay member records for the archive now at archive_path.
+        """
+        for file_name, relative_path, member_path, size, created, modified, suffix, digest in rows:
+            created = json.loads(created)
+            modified = json.loads(modified)
+            yield FileRecord(
+                constants, file_name, relative_path, archive_path + member_path, size,
+                tuple(created) if isinstance(created, list) else created,
+                tuple(modified) if isinstance(modified, list) else modified,
+                suffix, is_archive=True, dropbox_hash=digest if hash else ''
+            )
+
+    def get(self, key, hashed=True):
+        """
+        Member rows of the archive, None when not cached or cached without hashes that are needed.
+        """
+        if key is None:
+            return None
+        with self.lock:
+            found = self.db.execute(
+                """SELECT 1 FROM archives
+                WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ? AND depth = ?
+                AND hashed >= ?""",
+                key + (int(hashed), )
+            ).fetchone()
+            if found is None:
+                self.misses += 1
+                return None
+            rows = self.db.execute(
+                """SELECT file_name, relative_path, member_path, size, created, modified, suffix,
+                dropbox_hash FROM members WHERE device = ? AND inode = ? ORDER BY seq""",
+                key[:2]
+            ).fetchall()
+            self.hits += 1
+            self.members_replayed += len(rows)
+            self.bytes_saved += sum(row[3] or 0 for row in rows)
+            if self.deferred:
+                self.touched.append(key)
+                return rows
+            self.clock += 1
+            self.db.execute(
+                "UPDATE archives SET used = ? WHERE device = ? AND inode = ?",
+                (self.clock, ) + key[:2]
+            )
+            self.db.commit()
+            return rows
+
+    def put(self, key, hashed, rows):
+        if key is None:
+            return
+        device, inode, size, mtime_ns, depth = key
+        with self.lock:
+            if self.deferred:
+                self.pending.append((key, hashed, rows, ))
+                return
+            self.clock += 1
+            # an older version of the same archive is never going to match again
+            self.db.execute("DELETE FROM members WHERE device = ? AND inode = ?", (device, inode, ))
+            self.db.execute(
+                "INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (int(hashed), len(rows), self.clock, )
+            )
+            self.db.executemany(
+                "INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((device, inode, seq, ) + tuple(row) for seq, row in enumerate(rows))
+            )
+            self.db.commit()
+
+    def drain(self):
+        """
+        Return and forget the (touched keys, pending (key, hashed, rows)) collected in deferred mode.
+        """
+        with self.lock:
+            touched, pending = self.touched, self.pending
+            self.touched, self.pending = [], []
+        return touched, pending
+
+    def apply(self, touched, pending):
+        """
+        Write the results of another ArchiveCache's drain().
+        """
+        for key, hashed, rows in pending:
+            self.put(tuple(key), hashed, rows)
+        with self.lock:
+            for key in touched:
+                self.clock += 1
+                self.db.execute(
+                    "UPDATE archives SET used = ? WHERE device = ? AND inode = ?",
+                    (self.clock, key[0], key[1], )
+                )
+            self.db.commit()
+
+    def invalidate(self, path):
+        st = os.stat(path)
+        with self.lock:
+            self.db.execute("DELETE FROM members WHERE device = ? AND inode = ?", (st.st_dev, st.st_ino, ))
+            self.db.execute("DELETE FROM archives WHERE device = ? AND inode = ?", (st.st_dev, st.st_ino, ))
+            self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM members")
+            self.db.execute("DELETE FROM archives")
+            self.db.commit()
+
+    def evict(self):
+        """
+        Drop least recently used archives until at most max_entries member records are cached.
+        Returns the number of archives dropped.
+        """
+        if not self.max_entries:
+            return 0
+        evicted = 0
+        with self.lock:
+            total = self.db.execute("SELECT COALESCE(SUM(members), 0) FROM archives").fetchone()[0]
+            oldest = self.db.execute(
+                "SELECT device, inode, members FROM archives ORDER BY used"
+            ).fetchall()
+            for device, inode, members in oldest:
+                if total <= self.max_entries:
+                    break
+                self.db.execute("DELETE FROM members WHERE device = ? AND inode = ?", (device, inode, ))
+                self.db.execute("DELETE FROM archives WHERE device = ? AND inode = ?", (device, inode, ))
+                total -= members
+                evicted += 1
+            self.db.commit()
+        return evicted
+
+    def statistics(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'members_replayed': self.members_replayed,
+            'bytes_saved': self.bytes_saved,
+        }
+
+    def close(self):
+        if not self.deferred:
+            self.evict()
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+def json_records(fd):
+    for line in fd:
+        line = line.strip()
+        if line in ('', '[', ']', ):
+            continue
+        yield json.loads(line.rstrip(','))
+
+
+# fields that can be None, which the txt format writes as 'None'
+TXT_NONE_FIELDS = ('volume', 'suffix', 'mime_type', 'mime_encoding', )
+
+def delimited_records(fd, delimiter):
+    """
+    Records of a csv ('|' delimited, quoted) or txt (tab delimited, written as is) output file.
+    """
+    txt = delimiter == '\t'
+    if txt:
+        reader = csv.reader(fd, dialect='excel', delimiter=delimiter, quoting=csv.QUOTE_NONE)
+    else:
+        reader = csv.reader(fd, dialect='excel', delimiter=delimiter)
+    header = None
+    for row in reader:
+        if header is None:
+            header = row
+            continue
+        if len(row) != len(header):
+            # txt footer 'Records: N'
+            continue
+        record = dict(zip(header, row))
+        if txt:
+            for key in TXT_NONE_FIELDS:
+                if record.get(key) == 'None':
+                    record[key] = None
+        if 'size' in record:
+            record['size'] = int(record['size'])
+        if 'is_archive' in record:
+            record['is_archive'] = record['is_archive'] == 'True'
+        yield record
+
+
+def sqlite_records(path):
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    try:
+        for row in db.execute("SELECT * FROM files"):
+            yield dict(row)
+    finally:
+        db.close()
+
+
+def read_inventory(inventory_file):
+    """
+    Yield the records of a json, jsonl, csv, txt or sqlite output file written by Publish as dicts.
+    """
+    with open(inventory_file, mode='rb') as fd:
+        is_sqlite = fd.read(16) == b'SQLite format 3\0'
+    if is_sqlite:
+        yield from sqlite_records(inventory_file)
+        return
+
+    with open(inventory_file, mode='r', newline='') as fd:
+        first_line = fd.readline()
+        fd.seek(0)
+        if first_line.lstrip().startswith(('[', '{', )):
+            yield from json_records(fd)
+        elif '\t' in first_line:
+            yield from delimited_records(fd, delimiter='\t')
+        else:
+            yield from delimited_records(fd, delimiter='|')
+
+
+MANIFEST_COMMIT_INTERVAL = 10000
+
+class Manifest():
+    """
+    On-disk (SQLite) inventory used by incremental searches.  Records whose full_path, size and
+    modified timestamp match the manifest are unchanged and are neither hashed nor output.
+    Other records are tagged with a 'change' field of 'added' or 'modified'.  Manifest entries
+    that were not seen during the search are output at the end tagged 'deleted'.
+
+    path is a manifest file maintained across runs with store().  When path is None, a temporary
+    file is used, typically filled from a previous inventory with load().  Memory use stays
+    bounded no matter how large the inventory is.
+    """
+    def __init__(self, path=None):
+        self.persistent = path is not None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='file_system_searcher_', suffix='.db')
+            os.close(fd)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA cache_size = -65536")
+        if not self.persistent:
+            self.db.execute("PRAGMA journal_mode = OFF")
+            self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS inventory (
+                full_path TEXT NOT NULL UNIQUE,
+                size INTEGER,
+                modified TEXT,
+                record TEXT NOT NULL,
+                seen INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.db.commit()
+        # entries seen during this run are marked with the run number
+        self.run = self.db.execute("SELECT COALESCE(MAX(seen), 0) FROM inventory").fetchone()[0] + 1
+        self.uncommitted = 0
+
+    def written(self, count=1):
+        self.uncommitted += count
+        if self.uncommitted >= MANIFEST_COMMIT_INTERVAL:
+            self.db.commit()
+            self.uncommitted = 0
+
+    def load(self, inventory_file):
+        """
+        Add the records from an output file written by Publish, see read_inventory().
+        """
+        batch = []
+        for record in read_inventory(inventory_file):
+            record.pop('change', None)
+            batch.append((
+                record['full_path'], record['size'], record['modified'], json.dumps(record),
+            ))
+            if len(batch) >= MANIFEST_COMMIT_INTERVAL:
+                self.insert(batch)
+                batch = []
+        self.insert(batch)
+        self.db.commit()
+
+    def insert(self, batch):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO inventory (full_path, size, modified, record) VALUES (?, ?, ?, ?)",
+            batch
+        )
+
+    def compare(self, record):
+        """
+        Return 'added', 'modified' or None when record is unchanged.  Marks the entry as seen.
+        """
+        row = self.db.execute(
+            "SELECT size, modified FROM inventory WHERE full_path = ?",
+            (record['full_path'], )
+        ).fetchone()
+        if row is None:
+            return 'added'
+        self.db.execute(
+            "UPDATE inventory SET seen = ? WHERE full_path = ?",
+            (self.run, record['full_path'], )
+        )
+        self.written()
+        if row[0] == record['size'] and row[1] == record['modified']:
+            return None
+        return 'modified'
+
+    def mark_seen(self, prefix):
+        """
+        Mark every entry whose full_path starts with prefix as seen.
+        Used for the members of an unchanged archive file.
+        """
+        cursor = self.db.execute(
+            "UPDATE inventory SET seen = ? WHERE substr(full_path, 1, ?) = ?",
+            (self.run, len(prefix), prefix, )
+        )
+        self.written(cursor.rowcount)
+
+    def store(self, record):
+        """
+        Save the current version of an output record in a persistent manifest.
+        """
+        values = dict(record)
+        values.pop('change', None)
+        # full_path, size and modified can be read even when not among the output fields
+        self.db.execute(
+            "INSERT OR REPLACE INTO inventory (full_path, size, modified, record, seen) VALUES (?, ?, ?, ?, ?)",
+            (record['full_path'], record['size'], record['modified'], json.dumps(values), self.run, )
+        )
+        self.written()
+
+    def deleted(self, prefix):
+        """
+        Yield the entries under prefix that were not seen during this run tagged 'deleted',
+        then remove them from the manifest.
+        """
+        self.db.commit()
+        last_rowid = 0
+        while True:
+            rows = self.db.execute(
+                """SELECT rowid, record FROM inventory
+                WHERE rowid > ? AND seen != ? AND substr(full_path, 1, ?) = ?
+                ORDER BY rowid LIMIT 1000""",
+                (last_rowid, self.run, len(prefix), prefix, )
+            ).fetchall()
+            if not rows:
+                break
+            for rowid, record in rows:
+                last_rowid = rowid
+                record = json.loads(record)
+                record['change'] = 'deleted'
+                yield record
+        self.db.execute(
+            "DELETE FROM inventory WHERE seen != ? AND substr(full_path, 1, ?) = ?",
+            (self.run, len(prefix), prefix, )
+        )
+        self.db.commit()
+
+    def removed(self, path):
+        """
+        Yield the entry for path and, for a directory or an archive, every entry under it tagged
+        'deleted', then remove them from the manifest.  Used when path no longer exists.
+        """
+        self.db.commit()
+        prefix = os.path.join(path, '')
+        last_rowid = 0
+        while True:
+            rows = self.db.execute(
+                """SELECT rowid, record FROM inventory
+                WHERE rowid > ? AND (full_path = ? OR substr(full_path, 1, ?) = ?)
+                ORDER BY rowid LIMIT 1000""",
+                (last_rowid, path, len(prefix), prefix, )
+            ).fetchall()
+            if not rows:
+                break
+            for rowid, record in rows:
+                last_rowid = rowid
+                record = json.loads(record)
+                record['change'] = 'deleted'
+                yield record
+        self.db.execute(
+            "DELETE FROM inventory WHERE full_path = ? OR substr(full_path, 1, ?) = ?",
+            (path, len(prefix), prefix, )
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+        if not self.persistent:
+            os.remove(self.path)
+
+
+class HashJob():
+    """
+    A deferred dropbox_hash() call for one file system record.
+    Lets the Crawler decide where and when the file contents are read.
+    """
+    def __init__(self, path, size, verbose=False, block_executor=None, block_workers=0,
+                large_file_threshold=LARGE_FILE_THRESHOLD, hash_cache=None, cache_key=None,
+                use_mmap=False, use_fadvise=False, st=None, hash_timeout=None, hash_max_bytes=None):
+        self.path = path
+        self.size = size
+        self.verbose = verbose
+        self.block_executor = block_executor
+        self.block_workers = block_workers
+        self.large_file_threshold = large_file_threshold
+        self.hash_cache = hash_cache
+        self.cache_key = cache_key
+        self.use_mmap = use_mmap
+        self.use_fadvise = use_fadvise
+        # used for physical order I/O scheduling
+        self.device = st.st_dev if st else 0
+        self.inode = st.st_ino if st else 0
+        self.mode = st.st_mode if st else None
+        self.hash_timeout = hash_timeout
+        self.hash_max_bytes = hash_max_bytes
+        # hash_status of the record, see HashBudget
+        self.status = ''
+
+    def run(self):
+        # device files, FIFOs and sockets can block reads forever
+        if self.mode is not None and not stat.S_ISREG(self.mode):
+            self.status = 'skipped'
+            return ''
+        if self.hash_max_bytes is not None and self.size > self.hash_max_bytes:
+            self.status = 'skipped'
+            return ''
+        budget = None
+        if self.hash_timeout or self.hash_max_bytes is not None:
+            budget = HashBudget(self.hash_timeout, self.hash_max_bytes)
+
+        if self.block_executor and self.size >= self.large_file_threshold:
+            digest = parallel_dropbox_hash(
+                self.path, self.block_executor, self.block_workers, verbose=self.verbose,
+                use_fadvise=self.use_fadvise, budget=budget
+            )
+        else:
+            digest = dropbox_hash(
+                self.path, verbose=self.verbose, use_mmap=self.use_mmap, use_fadvise=self.use_fadvise,
+                budget=budget
+            )
+        if budget is not None and budget.status:
+            self.status = budget.status
+            return ''
+        if self.hash_cache:
+            self.hash_cache.put(self.cache_key, digest)
+        return digest
+
+
+HASH_QUEUE_FILES = 1024
+HASH_QUEUE_BYTES = 256 * 1024 * 1024
+
+class HashPool():
+    """
+    Runs HashJob's on a bounded pool of worker threads.  hashlib.sha256 releases the GIL on
+    large buffers so hashing runs in parallel with directory traversal.
+
+    Pending work is bounded by both file count (max_files) and the total size of the files
+    waiting to be hashed (max_bytes).  A single file larger than max_bytes is still accepted
+    when nothing else is pending.
+
+    Records are handed back in submission order when ordered is True,
+    otherwise as soon as their hash is complete.
+    """
+    def __init__(self, workers, ordered=True, max_files=HASH_QUEUE_FILES, max_bytes=HASH_QUEUE_BYTES):
+        if workers < 1:
+            raise ValueError('workers must be 1 or more')
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.ordered = ordered
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.pending_bytes = 0
+        # ordered: deque of (record, future or None, HashJob or None)
+        self.queue = deque()
+        # unordered: records ready for output and {future: (record, HashJob)}
+        self.ready = deque()
+        self.futures = {}
+
+    def __len__(self):
+        return len(self.queue) + len(self.ready) + len(self.futures)
+
+    def full(self):
+        if not len(self):
+            return False
+        return len(self) >= self.max_files or self.pending_bytes >= self.max_bytes
+
+    def submit(self, record, job):
+        if job is None:
+            if self.ordered:
+                self.queue.append((record, None, None, ))
+            else:
+                self.ready.append(record)
+            return
+
+        future = self.executor.submit(job.run)
+        self.pending_bytes += job.size
+        if self.ordered:
+            self.queue.append((record, future, job, ))
+        else:
+            self.futures[future] = (record, job, )
+
+    def next_ready(self):
+        """
+        Return the next finished record, waiting for hashes as needed.  None when empty.
+        """
+        if self.ordered:
+            if not self.queue:
+                return None
+            record, future, job = self.queue.popleft()
+            if future is not None:
+                record['dropbox_hash'] = future.result()
+                record['hash_status'] = job.status
+                self.pending_bytes -= job.size
+            return record
+
+        if not self.ready:
+            if not self.futures:
+                return None
+            done, not_done = wait(list(self.futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                record, job = self.futures.pop(future)
+                record['dropbox_hash'] = future.result()
+                record['hash_status'] = job.status
+                self.pending_bytes -= job.size
+                self.ready.append(record)
+        return self.ready.popleft()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+
+def fingerprint_hash(path, size, verbose=False):
+    """
+    Cheap content fingerprint - sha256 of the first and last FINGERPRINT_BLOCK_SIZE bytes.
+    Files with different fingerprints can't have the same dropbox_hash.
+    """
+    try:
+        with open(path, 'rb', 0) as fd:
+            fingerprint = sha256(fd.read(FINGERPRINT_BLOCK_SIZE))
+            if size > FINGERPRINT_BLOCK_SIZE:
+                fd.seek(max(size - FINGERPRINT_BLOCK_SIZE, FINGERPRINT_BLOCK_SIZE))
+                fingerprint.update(fd.read(FINGERPRINT_BLOCK_SIZE))
+
+    except:
+        if verbose:
+            e = sys.exc_info()[0]
+            print(f"\nException: {e}", file=sys.stderr)
+            print(f"File Name: {path}\n", file=sys.stderr)
+        return ''
+
+    return fingerprint.hexdigest()
+
+
+class DuplicateFinder():
+    """
+    Find files with the same contents while reading as few bytes as possible.
+
+    Files are first grouped by size.  Only sizes shared by more than one file get a
+    fingerprint_hash() and only files whose size and fingerprint both match get a full
+    dropbox_hash().  Small files, where a fingerprint would read most of the file anyway,
+    go straight to dropbox_hash().  Hard links and symbolic links to the same file are
+    counted once.
+    """
+    def __init__(self, hostname=None, volume=None, verbose=False):
+        self.hostname = hostname or socket.gethostname()
         self.volume = volume
         self.verbose = verbose
-        self.hostname = socket.gethostname()
-        self.base_path = zipfile
-        self.stop_iterator = False
-        self.hash = hash
+        self.sizes = {}
+        self.inodes = set()
+        self.files = 0
+        self.bytes_total = 0
+        # bytes of distinct files read, a fingerprinted file's edges aren't counted again
+        self.bytes_read = 0
+        self.fingerprinted = set()
+        self.duplicate_groups = 0
+        self.duplicate_files = 0
+        self.bytes_reclaimable = 0
+
+    def add(self, full_path, size, st=None):
+        if size == 0:
+            return
+        if st is not None and st.st_ino:
+            inode = (st.st_dev, st.st_ino, )
+            if inode in self.inodes:
+                return
+            self.inodes.add(inode)
+        self.files += 1
+        self.bytes_total += size
+        self.sizes.setdefault(size, []).append(full_path)
+
+    def group_by(self, paths, size, hash_function):
+        groups = {}
+        for path in paths:
+            digest = hash_function(path, size)
+            if digest:
+                groups.setdefault(digest, []).append(path)
+        return [(digest, group, ) for digest, group in groups.items() if len(group) > 1]
+
+    def fingerprint(self, path, size):
+        self.bytes_read += min(size, 2 * FINGERPRINT_BLOCK_SIZE)
+        self.fingerprinted.add(path)
+        return fingerprint_hash(path, size, verbose=self.verbose)
+
+    def full_hash(self, path, size):
+        if path in self.fingerprinted:
+            self.bytes_read += size - min(size, 2 * FINGERPRINT_BLOCK_SIZE)
+        else:
+            self.bytes_read += size
+        return dropbox_hash(path, verbose=self.verbose)
+
+    def duplicates(self):
+        """
+        Return a list of (dropbox_hash, size, [full_path, ...]) duplicate groups,
+        largest reclaimable space first.
+        """
+        results = []
+        for size, paths in self.sizes.items():
+            if len(paths) < 2:
+                continue
+            if size <= 2 * FINGERPRINT_BLOCK_SIZE:
+                candidates = [paths, ]
+            else:
+                candidates = [group for fingerprint, group in self.group_by(paths, size, self.fingerprint)]
+            for candidate in candidates:
+                for digest, group in self.group_by(candidate, size, self.full_hash):
+                    results.append((digest, size, group, ))
+
+        results.sort(key=lambda result: result[1] * (len(result[2]) - 1), reverse=True)
+        self.duplicate_groups = len(results)
+        self.duplicate_files = sum(len(group) for digest, size, group in results)
+        self.bytes_reclaimable = sum(size * (len(group) - 1) for digest, size, group in results)
+        return results
+
+    def __iter__(self):
+        """
+        Yield one output record per file in each duplicate group.
+        """
+        for digest, size, group in self.duplicates():
+            for full_path in group:
+                yield {
+                    'hostname': self.hostname,
+                    'volume': self.volume,
+                    'dropbox_hash': digest,
+                    'size': size,
+                    'duplicates': len(group),
+                    'reclaimable': size * (len(group) - 1),
+                    'full_path': full_path,
+                }
+
+    def statistics(self):
+        return {
+            'files': self.files,
+            'bytes_total': self.bytes_total,
+            'bytes_read': self.bytes_read,
+            'duplicate_groups': self.duplicate_groups,
+            'duplicate_files': self.duplicate_files,
+            'bytes_reclaimable': self.bytes_reclaimable,
+        }
+
+
+def convert_datetime_to_utc(dt):
+    return pytz.utc.localize(dt)
+
+def iso_timestamp(value):
+    """
+    ISO 8601 string for a POSIX timestamp or a (year, month, day, hour, minute, second) tuple.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    try:
+        if isinstance(value, tuple):
+            dt = datetime(*value)
+        else:
+            dt = datetime.fromtimestamp(value)
+    except (ValueError, OverflowError, OSError):
+        # some file system and archive date records have out-of-bound values
+        # out-of-bounds value will show up as 0001-01-01
+        dt = datetime(MINYEAR, 1, 1)
+    return convert_datetime_to_utc(dt).isoformat()
+
+
+FILE_RECORD_KEYS = (
+    'hostname', 'volume', 'file_name', 'relative_path', 'full_path', 'size', 'dropbox_hash',
+    'created', 'modified', 'suffix', 'mime_type', 'mime_encoding', 'is_archive',
+)
+
+# only output when asked for
+OPTIONAL_RECORD_KEYS = (
+    'hash_status',
+)
+
+def check_fields(fields):
+    """
+    Return fields as a tuple in FILE_RECORD_KEYS order, all of FILE_RECORD_KEYS when fields is None.
+    """
+    if fields is None:
+        return FILE_RECORD_KEYS
+    valid = FILE_RECORD_KEYS + OPTIONAL_RECORD_KEYS
+    unknown = [field for field in fields if field not in valid]
+    if unknown:
+        raise ValueError(f"Not a valid field: {', '.join(unknown)}.  Valid fields: {', '.join(valid)}")
+    return tuple(key for key in valid if key in fields)
+
+
+class RecordConstants():
+    """
+    Values shared by every FileRecord from one crawl.  keys are the fields records output.
+    """
+    __slots__ = ('hostname', 'volume', 'keys', 'listed', )
+
+    def __init__(self, hostname, volume, keys=FILE_RECORD_KEYS):
+        self.hostname = hostname
+        self.volume = volume
+        self.keys = keys
+        self.listed = frozenset(keys)
+
+class FileRecord(MutableMapping):
+    """
+    Compact output record behaving like the dict records used before.
+
+    hostname and volume live in a RecordConstants instance shared by the whole crawl.
+    created and modified are kept as raw timestamps and the MIME type isn't guessed until
+    first read.  With a hash_job, dropbox_hash and hash_status are computed when first read.
+    Keys other than FILE_RECORD_KEYS, e.g. 'change', are kept in a small dict.
+
+    Only the fields in constants.keys plus keys added later are listed, and so output, the
+    other FILE_RECORD_KEYS can still be read by key.  copy() and pickle give a plain dict, use
+    dict(record) or json.dumps(record, default=dict) where a real dict is needed.
+    """
+    __slots__ = (
+        'constants', 'file_name', 'relative_path', 'full_path', 'size', 'dropbox_hash_value',
+        'created_value', 'modified_value', 'suffix', 'mime', 'is_archive', 'hash_job', 'hash_status',
+        'extra',
+    )
+
+    def __init__(self, constants, file_name, relative_path, full_path, size, created, modified,
+                suffix, is_archive=False, dropbox_hash=''):
+        self.constants = constants
+        self.file_name = file_name
+        self.relative_path = relative_path
+        self.full_path = full_path
+        self.size = size
+        self.dropbox_hash_value = dropbox_hash
+        # timestamps, (y, m, d, H, M, S) tuples or ISO strings
+        self.created_value = created
+        self.modified_value = modified
+        self.suffix = suffix
+        self.is_archive = is_archive
+        self.mime = None
+        self.hash_job = None
+        self.hash_status = ''
+        self.extra = None
+
+    def get_mime(self):
+        if self.mime is None:
+            # archive members aren't file system paths, guess from the name alone
+            self.mime = mimetypes.guess_type(
+                self.file_name if self.is_archive else self.full_path, strict=False
+            )
+        return self.mime
+
+    def __getitem__(self, key):
+        if key == 'hostname':
+            return self.constants.hostname
+        if key == 'volume':
+            return self.constants.volume
+        if key == 'dropbox_hash' or key == 'hash_status':
+            if self.hash_job is not None:
+                job = self.hash_job
+                self.hash_job = None
+                self.dropbox_hash_value = job.run()
+                self.hash_status = job.status
+            return self.dropbox_hash_value if key == 'dropbox_hash' else self.hash_status
+        if key == 'created':
+            self.created_value = iso_timestamp(self.created_value)
+            return self.created_value
+        if key == 'modified':
+            self.modified_value = iso_timestamp(self.modified_value)
+            return self.modified_value
+        if key == 'mime_type':
+            return self.get_mime()[0]
+        if key == 'mime_encoding':
+            return self.get_mime()[1]
+        if key in ('file_name', 'relative_path', 'full_path', 'size', 'suffix', 'is_archive', ):
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'hostname' or key == 'volume':
+            # don't change the value for every record sharing the constants
+            self.constants = RecordConstants(
+                self.constants.hostname, self.constants.volume, self.constants.keys
+            )
+            setattr(self.constants, key, value)
+        elif key == 'dropbox_hash':
+            self.hash_job = None
+            self.dropbox_hash_value = value
+        elif key == 'created':
+            self.created_value = value
+        elif key == 'modified':
+            self.modified_value = value
+        elif key == 'mime_type':
+            self.mime = (value, self.get_mime()[1], )
+        elif key == 'mime_encoding':
+            self.mime = (self.get_mime()[0], value, )
+        elif key in ('file_name', 'relative_path', 'full_path', 'size', 'suffix', 'is_archive',
+                    'hash_status', ):
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if self.extra is None or key not in self.extra:
+            raise KeyError(key)
+        del self.extra[key]
 
     def __iter__(self):
+        yield from self.constants.keys
+        if self.extra:
+            yield from list(self.extra)
+
+    def __len__(self):
+        return len(self.constants.keys) + (len(self.extra) if self.extra else 0)
+
+    def __contains__(self, key):
+        return key in self.constants.listed or (self.extra is not None and key in self.extra)
+
+    def clear(self):
+        self.extra = None
+
+    def copy(self):
+        return dict(self)
+
+    def __reduce__(self):
+        return (dict, (dict(self), ))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+ZIP_FILE_SUFFIXES = [
+    '.zip',
+]
+
+def is_zip_file(file_name):
+    return any(file_name.lower().endswith(suffix) for suffix in ZIP_FILE_SUFFIXES)
+
+TAR_FILE_SUFFIXES = [
+    '.tar', '.tgz', '.tar.bz2', 'tar.gz',
+]
+
+def is_tar_file(file_name):
+    return any(file_name.lower().endswith(suffix) for suffix in TAR_FILE_SUFFIXES)
+
+# archives searched inside archives, 1 searches only archives found in the file system
+ARCHIVE_DEPTH = 1
+ARCHIVE_SPOOL_MEMORY = 64 * 1024 * 1024
+ARCHIVE_SPOOL_DISK = 4 * 1024 * 1024 * 1024
+
+class ArchiveSpool():
+    """
+    Memory and temporary disk budget for inner archives copied out of the archives holding them.
+
+    An inner archive is copied into an io.BytesIO while it fits in what is left of max_memory,
+    otherwise into a TemporaryFile while it fits in what is left of max_disk.  Before Python 3.11
+    a SpooledTemporaryFile has no seekable(), which zipfile needs.  Space is given back when the
+    inner archive has been searched.  Inner archives that don't fit are output as ordinary
+    members and not searched.
+    """
+    def __init__(self, max_memory=ARCHIVE_SPOOL_MEMORY, max_disk=ARCHIVE_SPOOL_DISK):
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.memory = 0
+        self.disk = 0
+        # inner archives not searched for lack of space
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def open(self, size):
+        """
+        (seekable file object, reservation) for an inner archive of size bytes, None when over budget.
+        """
+        with self.lock:
+            if size <= self.max_memory - self.memory:
+                self.memory += size
+                reservation = ('memory', size, )
+            elif size <= self.max_disk - self.disk:
+                self.disk += size
+                reservation = ('disk', size, )
+            else:
+                self.skipped += 1
+                return None
+        if reservation[0] == 'memory':
+            return io.BytesIO(), reservation
+        return tempfile.TemporaryFile(prefix='file_system_searcher_'), reservation
+
+    def close(self, spool, reservation):
+        spool.close()
+        where, size = reservation
+        with self.lock:
+            if where == 'memory':
+                self.memory -= size
+            else:
+                self.disk -= size
+
+
+def nested_archive(crawler, record, member, open_member):
+    """
+    Copy the archive member record, itself a zip or tar archive, out of crawler's archive through
+    crawler.spool, hashing it on the way through crawler.cached_hash() when crawler.hash.
+    Returns (dropbox_hash, hash_status, iterator over the inner archive's records), the iterator
+    is None when the member couldn't be copied.  None when the member doesn't fit in the spool
+    budget and should be hashed as usual.
+    """
+    opened = crawler.spool.open(record.size)
+    if opened is None:
+        if crawler.verbose:
+            print(f"\nInner archive over the spool budget, not searched: {record.full_path}\n", file=sys.stderr)
+        return None
+    spool, reservation = opened
+
+    def copied_blocks(fd):
+        copied = 0
+        for block in read_blocks(fd):
+            copied += len(block)
+            if copied > record.size:
+                # don't let a bad member header grow the spool past its reservation
+                raise ValueError(f"member larger than its {record.size} byte header size")
+            spool.write(block)
+            yield block
+
+    def hash_blocks(blocks, budget):
+        hasher = DropboxHasher(budget=budget)
         try:
-            self.z_file = zipfile.ZipFile(self.base_path)
-            self.z_name_iter = iter(self.z_file.namelist())
+            for block in blocks:
+                hasher.update_block(block)
+        except HashBudgetExceeded:
+            return ''
+        return hasher.hexdigest()
 
-        except:
-            # Zip file may be damaged and/or otherwise unreadable.
-            self.stop_iterator = True
-            if self.verbose:
-                e = sys.exc_info()[0]
-                print(f"\nException: {e}", file=sys.stderr)
-                print(f"Tar Archive File: {self.base_path}\n", file=sys.stderr)
+    digest, status = '', ''
+    try:
+        with open_member() as fd:
+            blocks = copied_blocks(fd)
+            if crawler.hash:
+                digest, status = crawler.cached_hash(
+                    member, record.size, lambda budget: hash_blocks(blocks, budget)
+                )
+            # copy whatever the hash didn't read - a cached or over budget hash reads nothing
+            for block in blocks:
+                pass
+        spool.seek(0)
+
+    except:
+        crawler.spool.close(spool, reservation)
+        if crawler.verbose:
+            e = sys.exc_info()[0]
+            print(f"\nException: {e}", file=sys.stderr)
+            print(f"Inner Archive File Name: {record.full_path}\n", file=sys.stderr)
+        return '', '', None
+
+    archive_crawler_class = ZipCrawler if is_zip_file(record.file_name) else TarCrawler
+    inner = archive_crawler_class(
+        record.full_path, volume=crawler.volume, verbose=crawler.verbose, hash=crawler.hash,
+        fields=crawler.fields, depth=crawler.depth - 1, spool=crawler.spool, fileobj=spool,
+        hash_timeout=crawler.hash_timeout, hash_max_bytes=crawler.hash_max_bytes
+    )
+
+    def records():
+        try:
+            yield from inner
+        finally:
+            crawler.spool.close(spool, reservation)
+
+    return digest, status, records()
+
+def get_suffix(file_name):
+    # same rules as pathlib.PurePath.suffix
+    i = file_name.rfind('.')
+    if 0 < i < len(file_name) - 1:
+        return file_name[i:]
+    return ''
+
+WALKERS = ['glob', 'scandir', ]
+
+class PathFilter():
+    """
+    --exclude, --prune and --one_file_system rules, applied while a directory is listed so that
+    skipped sub-directories are never listed and skipped files are never stat'ed.
+
+    A rule is a glob or, when it starts with 're:', a regular expression.  Globs without a '/'
+    match file and directory names, globs with a '/' match whole paths.  Regular expressions are
+    searched for in whole paths.  exclude rules skip files and directories, prune rules only
+    directories.  The rules of each kind are compiled into one name and one path expression.
+    With one_file_system, directories on another device than base_path aren't descended into.
+    """
+    def __init__(self, exclude=None, prune=None, one_file_system=False):
+        exclude = list(exclude or [])
+        self.exclude = self.compile(exclude)
+        self.prune = self.compile(exclude + list(prune or []))
+        self.one_file_system = one_file_system
+        self.device = None
 
+    @staticmethod
+    def compile(rules):
+        """
+        (name expression, path expression) matching any of rules, None in place of no rules.
+        """
+        names = []
+        paths = []
+        for rule in rules:
+            if rule.startswith('re:'):
+                paths.append(f"(?:{rule[3:]})")
+            elif '/' in rule:
+                paths.append(r'\A' + fnmatch.translate(rule))
+            else:
+                names.append(fnmatch.translate(rule))
+        return (
+            re.compile('|'.join(names)) if names else None,
+            re.compile('|'.join(paths)) if paths else None,
+        )
+
+    @staticmethod
+    def matches(compiled, path, name):
+        name_expression, path_expression = compiled
+        if name_expression is not None and name_expression.match(name):
+            return True
+        return path_expression is not None and path_expression.search(path) is not None
+
+    def set_base(self, base_path):
+        if self.one_file_system:
+            try:
+                self.device = os.stat(base_path).st_dev
+            except OSError:
+                self.device = None
+
+    def skip_file(self, entry):
+        return self.matches(self.exclude, entry.path, entry.name)
+
+    def skip_directory(self, entry):
+        if self.matches(self.prune, entry.path, entry.name):
+            return True
+        if self.one_file_system and self.device is not None:
+            try:
+                # mount points are the only directories with another st_dev
+                return entry.stat(follow_symlinks=False).st_dev != self.device
+            except OSError:
+                return True
+        return False
+
+
+def scandir_walk(base_path, verbose=False, path_filter=None):
+    """
+    Walk the directory tree under base_path with os.scandir() and yield (DirEntry, stat_result)
+    for every file found.  Each file is stat'ed exactly once.  Like Path.glob('**/*'), symbolic
+    links to files are followed and symbolic links to directories are not descended into.
+    With a PathFilter, skipped files and directories are left out while directories are listed.
+    """
+    stack = [str(base_path), ]
+    while stack:
+        directory = stack.pop()
+        sub_directories = []
+        yield from scan_directory(directory, sub_directories, verbose=verbose, path_filter=path_filter)
+        # reversed so that sub-directories are visited in listing order
+        stack.extend(reversed(sub_directories))
+
+
+class ScandirWalk():
+    """
+    scandir_walk() as an iterator that can pause between directories, used for checkpoints.
+
+    After pause(), iteration stops at the end of the directory being listed and stays stopped
+    until iter() is called again, as Crawler.crawl_entries() does, which carries on with the
+    next directory.  stack holds the directories not listed yet, a new ScandirWalk started
+    from a saved stack continues where the saved one paused.
+    """
+    def __init__(self, base_path, verbose=False, path_filter=None, stack=None):
+        self.verbose = verbose
+        self.path_filter = path_filter
+        self.stack = list(stack) if stack is not None else [str(base_path), ]
+        self.entries = None
+        self.sub_directories = None
+        self.pausing = False
+        # directories listed completely
+        self.directories = 0
+
+    def __iter__(self):
+        self.pausing = False
         return self
-    
+
     def __next__(self):
-        if self.stop_iterator:
-            raise StopIteration()
-        try:
-            # name is really a path within the archive
-            name = self.z_name_iter.__next__()
-            info = self.z_file.getinfo(name)
-
-            # skip directories
-            while info.is_dir():
-                name = self.z_name_iter.__next__()
-                info = self.z_file.getinfo(name)
-            
-            file_name = self.get_file_name(name)
+        while True:
+            if self.entries is not None:
+                try:
+                    return self.entries.__next__()
+                except StopIteration:
+                    self.entries = None
+                    # reversed so that sub-directories are visited in listing order
+                    self.stack.extend(reversed(self.sub_directories))
+                    self.directories += 1
+            if self.pausing:
+                # a Crawler's io_order window keeps pulling after the first StopIteration
+                raise StopIteration()
+            if not self.stack:
+                raise StopIteration()
+            directory = self.stack.pop()
+            self.sub_directories = []
+            self.entries = scan_directory(
+                directory, self.sub_directories, verbose=self.verbose, path_filter=self.path_filter
+            )
+
+    def pause(self):
+        self.pausing = True
+
+    def exhausted(self):
+        return self.entries is None and not self.stack
+
+
+def list_directory(directory, verbose=False, path_filter=None):
+    """
+    List one directory with os.scandir().  Returns a list of the DirEntry of each file and a
+    list of sub-directory paths, leaving out those path_filter skips.  Files aren't stat'ed.
+    """
+    files = []
+    sub_directories = []
+    try:
+        if telemetry is None:
+            dir_iterator = os.scandir(directory)
+        else:
+            dir_iterator = telemetry.call('list', os.scandir, (directory, ))
+            telemetry.count('directories')
+    except OSError as e:
+        if verbose:
+            print(f"\nException: {e}", file=sys.stderr)
+            print(f"list_directory(): Problem Listing Directory: {directory}\n", file=sys.stderr)
+        return files, sub_directories
 
+    with dir_iterator:
+        failures = 0
+        while True:
             try:
-                utc_dt = (convert_datetime_to_utc(datetime(
-                        info.date_time[0],
-                        info.date_time[1],
-                        info.date_time[2],
-                        hour=info.date_time[3],
-                        minute=info.date_time[4],
-                        second=info.date_time[5]
-                    ))).isoformat()
-            except ValueError as e:
-                # some zip file date records have out-of-bound values
-                # out-of-bounds value will show up as 0001-01-01
-                utc_dt = (convert_datetime_to_utc(datetime(MINYEAR, 1, 1))).isoformat()
+                if telemetry is None:
+                    entry = next(dir_iterator)
+                else:
+                    entry = telemetry.call('list', next, (dir_iterator, ))
+                failures = 0
+            except StopIteration:
+                break
+            except OSError as e:
+                failures += 1
+                if verbose:
+                    print(f"\nException: {e}", file=sys.stderr)
+                    print(f"list_directory(): {failures} iterator failures at {directory}\n", file=sys.stderr)
+                if failures > 10:
+                    break
+                continue
 
-            full_path = self.file + os.path.sep + name
-            if os.path.sep == "\\":
-                full_path = full_path.replace('/', "\\")
-            record = {
-                    'hostname': self.hostname,
-                    'volume': self.volume,
-                    'file_name': file_name,
-                    'relative_path': name,
-                    'full_path': full_path,
-                    'size': info.file_size,
-                    'dropbox_hash': '',
-                    'created': utc_dt,
-                    'modified': utc_dt,
-                    'suffix': self.get_suffix(file_name),
-                    'mime_type': None,
-                    'mime_encoding': None,
-                    'is_archive': True,
-                }
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if path_filter is None or not path_filter.skip_directory(entry):
+                        sub_directories.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+                if path_filter is not None and path_filter.skip_file(entry):
+                    continue
+            except OSError as e:
+                if verbose:
+                    print(f"\nException: {e}", file=sys.stderr)
+                    print(f"list_directory(): Problem At: {entry.path}\n", file=sys.stderr)
+                continue
+            files.append(entry)
 
-            record['mime_type'], record['mime_encoding'] = mimetypes.guess_type(file_name, strict=False)
+    return files, sub_directories
 
-            if self.verbose:
-                print(f"{record['full_path']}, {record['size']}, {record['is_archive']}", file=sys.stderr)
 
-            if hash and record['size'] > 0:
-                record['dropbox_hash'] = zip_dropbox_hash(self.z_file, self.file, name)
+def stat_entry(entry, verbose=False):
+    """
+    stat_result of a DirEntry from list_directory(), None when it can't be stat'ed.
+    """
+    try:
+        return entry.stat() if telemetry is None else telemetry.call('stat', entry.stat)
+    except OSError as e:
+        if verbose:
+            print(f"\nException: {e}", file=sys.stderr)
+            print(f"stat_entry(): Problem At: {entry.path}\n", file=sys.stderr)
+        return None
+
 
-        except (OSError, zipfile.BadZipFile) as e:
-            if self.verbose:
-                print(f"\nException: {e}", file=sys.stderr)
-                print(f"ZipCrawler.__next__(): Zip File Name {self.base_path}\n", file=sys.stderr)
-            raise StopIteration()
+def scan_directory(directory, sub_directories, verbose=False, path_filter=None):
+    """
+    list_directory() and stat_entry() for each file.  Yields (DirEntry, stat_result) for each
+    file and appends the paths of sub-directories to sub_directories.
+    """
+    files, listed = list_directory(directory, verbose=verbose, path_filter=path_filter)
+    sub_directories.extend(listed)
+    for entry in files:
+        st = stat_entry(entry, verbose=verbose)
+        if st is not None:
+            yield entry, st
+
+
+class FileEntry():
+    """
+    Stand-in for os.DirEntry when only a path is known, e.g. after crossing a process boundary.
+    """
+    __slots__ = ('path', 'name', )
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+
+    def stat(self, follow_symlinks=True):
+        return os.stat(self.path, follow_symlinks=follow_symlinks)
+
+
+def stat_entries(paths, verbose=False):
+    """
+    Yield (FileEntry, stat_result) for each path that can still be stat'ed.
+    """
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            if verbose:
+                print(f"\nException: {e}", file=sys.stderr)
+                print(f"stat_entries(): Problem At: {path}\n", file=sys.stderr)
+            continue
+        yield FileEntry(path), st
+
+
+PUBLISH_BUFFER_SIZE = 1024 * 1024
+PUBLISH_QUEUE_BUFFERS = 16
+OUTPUT_FORMATS = ['txt', 'csv', 'json', 'jsonl', 'sqlite', ]
+SQLITE_BATCH_RECORDS = 10000
+# indexes built once loading is done, only for columns present in the output
+SQLITE_INDEXES = {
+    'files_dropbox_hash': ('dropbox_hash', ),
+    'files_size': ('size', ),
+    'files_suffix': ('suffix', ),
+    'files_volume_full_path': ('volume', 'full_path', ),
+}
+
+class Publish():
+    """
+    Writes output records.  The column order is computed once from the first record.
+    Records are serialized into large buffers that a background thread writes to output_fd
+    through a bounded queue, so crawling doesn't wait on output I/O.  Set threaded to False
+    to write buffers from the calling thread.
+
+    'json' writes one record per line between '[' and ']' lines, each record followed by a
+    comma (kept for compatibility).  'jsonl' writes JSON Lines - one record per line.
+
+    'sqlite' appends records to the 'files' table of the SQLite database file named by
+    output_fd using large executemany() transactions and builds query indexes at the end.
+    """
+    def __init__(self, output_format, output_fd, threaded=True, buffer_size=PUBLISH_BUFFER_SIZE):
+        self.fd = output_fd
+        self.record_count = 0
+        self.header = None
+        self.body = None
+        self.footer = None
+        self.columns = None
+        self.buffer = []
+        self.buffered = 0
+        self.buffer_size = buffer_size
+        self.writer = None
+        self.writer_error = None
+        self.write_data = self.write_text
+        self.output_format = output_format
+
+        if output_format == 'txt':
+            self.header = self.txt_header
+            self.body = self.txt_body
+            self.footer = self.txt_footer
+        elif output_format == 'json':
+            self.header = self.json_header
+            self.body = self.json_body
+            self.footer = self.json_footer
+        elif output_format == 'jsonl':
+            self.header = self.jsonl_header
+            self.body = self.jsonl_body
+            self.footer = self.jsonl_footer
+        elif output_format == 'csv':
+            self.header = self.csv_header
+            self.body = self.csv_body
+            self.footer = self.csv_footer
+        elif output_format == 'sqlite':
+            self.header = self.sqlite_header
+            self.body = self.sqlite_body
+            self.footer = self.sqlite_footer
+            self.write_data = self.write_rows
+            self.fd = self.sqlite_connect(output_fd)
+        else:
+            raise ValueError(f"Not a valid output format: {output_format}")
+
+        if threaded:
+            self.queue = queue.Queue(maxsize=PUBLISH_QUEUE_BUFFERS)
+            self.writer = threading.Thread(target=self.write_buffers, name='Publish', daemon=True)
+            self.writer.start()
+
+    def write_buffers(self):
+        while True:
+            data = self.queue.get()
+            try:
+                if data is None:
+                    break
+                if not self.writer_error:
+                    self.write_data(data)
+            except Exception as e:
+                self.writer_error = e
+            finally:
+                self.queue.task_done()
+
+    def write_text(self, data):
+        self.fd.write(data)
+
+    def write(self, line):
+        self.buffer.append(line)
+        self.buffered += len(line)
+        if self.buffered >= self.buffer_size:
+            self.send()
+
+    def send(self):
+        if not self.buffer:
+            return
+        if self.output_format != 'sqlite':
+            data = ''.join(self.buffer)
+        else:
+            data = self.buffer
+        self.buffer = []
+        self.buffered = 0
+        if self.writer_error:
+            raise self.writer_error
+        if self.writer:
+            self.queue.put(data)
+        else:
+            self.write_data(data)
+
+    def flush(self):
+        """
+        Wait until everything published so far has been handed to output_fd and flush it.
+        """
+        if self.output_format == 'csv' and self.columns is not None:
+            self.csv_send()
+        self.send()
+        if self.writer:
+            self.queue.join()
+        if self.writer_error:
+            raise self.writer_error
+        if self.output_format != 'sqlite':
+            # sqlite rows are committed as they are written
+            self.fd.flush()
+
+    def position(self):
+        """
+        Write out everything published so far and return where the output ends - the file
+        offset, or the last rowid of the sqlite 'files' table.  Used for checkpoints.
+        """
+        if self.output_format == 'csv' and self.columns is not None:
+            self.csv_send()
+        self.send()
+        if self.writer:
+            self.queue.join()
+        if self.writer_error:
+            raise self.writer_error
+        if self.output_format == 'sqlite':
+            try:
+                return self.fd.execute("SELECT COALESCE(MAX(rowid), 0) FROM files").fetchone()[0]
+            except sqlite3.OperationalError:
+                # no files table yet
+                return 0
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+        return self.fd.tell()
+
+    def restore(self, columns, record_count, position):
+        """
+        Continue output saved with position().  Anything written after position is dropped and
+        records published from now on follow the records already written.
+        """
+        if self.output_format == 'sqlite':
+            try:
+                self.fd.execute("DELETE FROM files WHERE rowid > ?", (position, ))
+                self.fd.commit()
+            except sqlite3.OperationalError:
+                pass
+        else:
+            self.fd.seek(position)
+            self.fd.truncate()
+        self.record_count = record_count
+        if columns is None:
+            return
+        self.columns = list(columns)
+        if self.output_format == 'csv':
+            self.csv_start()
+        elif self.output_format == 'sqlite':
+            self.sqlite_start()
+
+    def set_columns(self, record):
+        self.columns = list(record)
+        self.columns.sort()
+
+    def txt_header(self, record):
+        self.set_columns(record)
+        self.write("\t".join(self.columns) + "\n")
+        self.txt_body(record)
+
+    def txt_body(self, record):
+        self.write("\t".join([str(record[k]) for k in self.columns]) + "\n")
+        self.record_count = self.record_count + 1
+
+    def txt_footer(self):
+        self.write(f"Records: {self.record_count}\n")
+        self.flush()
+
+    def json_header(self, record):
+        self.set_columns(record)
+        self.write('[\n')
+        self.json_body(record)
+
+    def json_body(self, record):
+        # columns are sorted, same as json.dumps(record, sort_keys=True)
+        self.write(json.dumps({k: record[k] for k in self.columns}) + ',\n')
+        self.record_count = self.record_count + 1
+
+    def json_footer(self):
+        self.write(']\n')
+        self.flush()
+
+    def jsonl_header(self, record):
+        self.set_columns(record)
+        self.jsonl_body(record)
+
+    def jsonl_body(self, record):
+        self.write(json.dumps({k: record[k] for k in self.columns}) + '\n')
+        self.record_count = self.record_count + 1
+
+    def jsonl_footer(self):
+        self.flush()
+
+    def csv_header(self, record):
+        self.set_columns(record)
+        self.csv_start()
+        self.csvwriter.writerow(self.columns)
+        self.csv_body(record)
+
+    def csv_start(self):
+        self.csv_buffer = io.StringIO()
+        self.csvwriter = csv.writer(self.csv_buffer, dialect='excel', delimiter='|')
+
+    def csv_body(self, record):
+        self.csvwriter.writerow([record[k] for k in self.columns])
+        if self.csv_buffer.tell() >= self.buffer_size:
+            self.csv_send()
+
+    def csv_send(self):
+        self.write(self.csv_buffer.getvalue())
+        self.csv_buffer.seek(0)
+        self.csv_buffer.truncate()
+
+    def csv_footer(self):
+        if self.columns is not None:
+            self.csv_send()
+        self.flush()
+
+    def sqlite_connect(self, path):
+        if not isinstance(path, str):
+            raise ValueError('sqlite output needs an output file name')
+        # the writer thread does the inserts
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("PRAGMA cache_size = -262144")
+        db.execute("PRAGMA temp_store = MEMORY")
+        return db
+
+    def sqlite_header(self, record):
+        self.set_columns(record)
+
+        def column_type(value):
+            if isinstance(value, (bool, int, )):
+                return 'INTEGER'
+            if isinstance(value, float):
+                return 'REAL'
+            return 'TEXT'
+
+        self.fd.execute(
+            "CREATE TABLE IF NOT EXISTS files (" +
+            ", ".join(f'"{k}" {column_type(record[k])}' for k in self.columns) +
+            ")"
+        )
+        # appending to an existing database, possibly written with other columns
+        existing = [row[1] for row in self.fd.execute("PRAGMA table_info(files)")]
+        for k in self.columns:
+            if k not in existing:
+                self.fd.execute(f'ALTER TABLE files ADD COLUMN "{k}" {column_type(record[k])}')
+        self.fd.commit()
+        self.sqlite_start()
+        self.sqlite_body(record)
+
+    def sqlite_start(self):
+        self.buffer_size = SQLITE_BATCH_RECORDS
+        self.sqlite_insert = (
+            "INSERT INTO files (" + ", ".join(f'"{k}"' for k in self.columns) + ") VALUES (" +
+            ", ".join("?" for k in self.columns) + ")"
+        )
+
+    def sqlite_body(self, record):
+        self.buffer.append(tuple([record[k] for k in self.columns]))
+        self.buffered += 1
+        self.record_count = self.record_count + 1
+        if self.buffered >= self.buffer_size:
+            self.send()
+
+    def write_rows(self, rows):
+        with self.fd:
+            self.fd.executemany(self.sqlite_insert, rows)
+
+    def sqlite_footer(self):
+        self.send()
+        if self.writer:
+            self.queue.join()
+        if self.writer_error:
+            raise self.writer_error
+        if self.columns is None:
+            return
+        for name, columns in SQLITE_INDEXES.items():
+            if all(k in self.columns for k in columns):
+                self.fd.execute(
+                    f"CREATE INDEX IF NOT EXISTS {name} ON files (" +
+                    ", ".join(f'"{k}"' for k in columns) + ")"
+                )
+        self.fd.commit()
+
+    def close(self):
+        self.send()
+        if self.writer:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        self.fd.close()
+        if self.writer_error:
+            raise self.writer_error
+
+
+class Crawler():
+    def __init__(self, base_path=None, volume=None, verbose=False, search_archives=False, hash=True,
+                walker='glob', hash_workers=0, unordered=False,
+                hash_queue_files=HASH_QUEUE_FILES, hash_queue_bytes=HASH_QUEUE_BYTES,
+                block_workers=0, large_file_threshold=LARGE_FILE_THRESHOLD, hash_cache=None,
+                manifest=None, use_mmap=False, io_order='discovery', io_window=IO_WINDOW,
+                use_fadvise=False, fields=None, archive_workers=0, archive_cache=None,
+                archive_depth=ARCHIVE_DEPTH, archive_spool_memory=ARCHIVE_SPOOL_MEMORY,
+                archive_spool_disk=ARCHIVE_SPOOL_DISK, exclude=None, prune=None,
+                one_file_system=False, hash_timeout=None, hash_max_bytes=None):
+        self.current_working_directory = Path.cwd()
+        self.volume = volume
+        self.verbose = verbose
+        self.hostname = socket.gethostname()
+        if fields is None and (hash_timeout or hash_max_bytes is not None):
+            fields = FILE_RECORD_KEYS + ('hash_status', )
+        self.fields = check_fields(fields)
+        self.record_constants = RecordConstants(self.hostname, volume, self.fields)
+        if not base_path:
+            raise ValueError('base_path must be a valid path')
+        self.base_path = self.base_to_absolute_path(base_path)
+        # --no_hash is a special case of leaving dropbox_hash out of fields
+        self.hash = hash and 'dropbox_hash' in self.fields
+        self.mode = 'Crawler'
+        self.zip_crawler = None
+        self.tar_crawler = None
+        self.archive_name = None
+        self.search_archives = search_archives
+        self.archive_workers = archive_workers
+        self.archive_depth = archive_depth
+        self.archive_spool = None
+        if archive_depth > 1:
+            # shared by every archive this crawler searches, caps memory and disk for inner archives
+            self.archive_spool = ArchiveSpool(archive_spool_memory, archive_spool_disk)
+        self.archive_record = None
+        self.archive_stat = None
+        self.hash_cache = hash_cache
+        self.archive_cache = archive_cache
+        self.manifest = manifest
+        self.deleted_iterator = None
+        self.use_mmap = use_mmap
+        self.hash_timeout = hash_timeout
+        self.hash_max_bytes = hash_max_bytes
+        if io_order not in IO_ORDERS:
+            raise ValueError(f"Not a valid io_order: {io_order}")
+        self.io_order = io_order
+        self.io_window = io_window
+        self.io_scheduled = deque()
+        self.use_fadvise = use_fadvise
+        if walker not in WALKERS:
+            raise ValueError(f"Not a valid walker: {walker}")
+        self.walker = walker
+        self.path_filter = None
+        if exclude or prune or one_file_system:
+            # rules are applied by scan_directory(), pathlib's glob can't skip subtrees
+            self.path_filter = PathFilter(exclude, prune, one_file_system)
+            self.path_filter.set_base(self.base_path)
+            self.walker = 'scandir'
+        self.hash_workers = hash_workers
+        self.unordered = unordered
+        self.hash_queue_files = hash_queue_files
+        self.hash_queue_bytes = hash_queue_bytes
+        self.hash_pool = None
+        self.block_workers = block_workers
+        self.large_file_threshold = large_file_threshold
+        self.block_executor = None
+        if block_workers > 0:
+            # shared by all large files, including those hashed on HashPool threads
+            self.block_executor = ThreadPoolExecutor(max_workers=block_workers)
+
+    def base_to_absolute_path(self, base_path):
+        if base_path is None:
+            absolute_base_path = self.current_working_directory
+        elif base_path[0] == '/' or base_path[0] == '\\' or ( len(base_path) > 1 and base_path[1] == ':'):
+            absolute_base_path = Path(base_path)
+            if not absolute_base_path.is_absolute():
+                # assume same drive letter (if any) as current_working_directory
+                # if this box is not Windows, Path.drive returns ''
+                absolute_base_path = Path(self.current_working_directory.drive + base_path)
+        else:
+            # assume path relative to current working directory
+            absolute_base_path = self.current_working_directory / base_path
+                
+        # remove '/../' and parent dir with resolve()
+        return absolute_base_path.resolve()
+
+    def path_crawler(self, base_path):
+        self.base_path = self.base_to_absolute_path(base_path)
+        if self.path_filter:
+            self.path_filter.set_base(self.base_path)
+        return self
+
+    def __iter__(self):
+        if self.walker == 'scandir':
+            return self.start(
+                scandir_walk(self.base_path, verbose=self.verbose, path_filter=self.path_filter)
+            )
+        path_iterator = self.base_path.glob('**/*')
+        path_iterator.__init__()
+        if telemetry is not None:
+            # the glob walker's directories are counted by next_glob_path(), except base_path
+            telemetry.count('directories')
+        return self.start(path_iterator)
+
+    def crawl_entries(self, entries, deleted_prefix=None):
+        """
+        Generate records for an iterable of (os.DirEntry or FileEntry, stat_result) pairs
+        instead of walking base_path.  Entries must be under base_path.  Requires walker='scandir'.
+        Used by worker processes in parallel_main_loop().
+
+        With a manifest, only entries under deleted_prefix that weren't seen are output as
+        'deleted' at the end, none when deleted_prefix is None.
+        """
+        self.start(iter(entries))
+        self.deleted_prefix = deleted_prefix
+        while True:
+            try:
+                yield self.__next__()
+            except StopIteration:
+                return
+
+    def start(self, path_iterator):
+        self.path_iterator = path_iterator
+        self.mode = 'Crawler'
+        self.io_scheduled = deque()
+        self.path_prefix = os.path.join(str(self.base_path), '')
+        self.deleted_prefix = self.path_prefix
+        if self.hash_workers > 0:
+            if self.hash_pool:
+                self.hash_pool.close()
+            self.hash_pool = HashPool(
+                self.hash_workers,
+                ordered=(not self.unordered),
+                max_files=self.hash_queue_files,
+                max_bytes=self.hash_queue_bytes
+            )
+            self.source_exhausted = False
+        return self
+
+    def __next__(self):
+        if self.hash_pool:
+            return self.next_pooled()
+
+        record, job = self.next_job()
+        if job:
+            # computed when the consumer first reads record['dropbox_hash']
+            record.hash_job = job
+        return record
+
+    def next_pooled(self):
+        # keep traversal going while the hash pool has room
+        while not self.source_exhausted and not self.hash_pool.full():
+            try:
+                record, job = self.next_job()
+            except StopIteration:
+                self.source_exhausted = True
+                break
+            self.hash_pool.submit(record, job)
+
+        record = self.hash_pool.next_ready()
+        if record is None:
+            self.hash_pool.close()
+            self.hash_pool = None
+            raise StopIteration()
+        return record
+
+    def next_job(self):
+        if self.io_order == 'discovery':
+            return self.next_record_job()
+        return self.next_scheduled_job()
+
+    def next_scheduled_job(self):
+        """
+        Collect a window of io_window (record, job) pairs and hand them out sorted by
+        inode number or physical extent so that a disk's read head sweeps in one direction.
+        """
+        if not self.io_scheduled:
+            window = []
+            while len(window) < self.io_window:
+                try:
+                    window.append(self.next_record_job())
+                except StopIteration:
+                    break
+            if not window:
+                raise StopIteration()
+            window.sort(key=lambda pair: io_order_key(self.io_order, pair[1]))
+            self.io_scheduled.extend(window)
+        return self.io_scheduled.popleft()
+
+    def next_record_job(self):
+        """
+        Return the next (record, job) pair.  job is a HashJob when the record's
+        dropbox_hash still needs to be computed, otherwise None.
+        """
+        if self.mode == 'Crawler':
+            try:
+                record, job = self.next_crawler_job()
+            except StopIteration:
+                if not self.manifest or self.deleted_prefix is None:
+                    raise
+                self.mode = 'Deleted'
+                self.deleted_iterator = self.manifest.deleted(self.deleted_prefix)
+                return self.next_record_job()
+            self.archive_record = None
+            if self.search_archives and is_tar_file(record['file_name']):
+                self.mode = 'TarCrawler'
+                self.archive_record = record
+                self.archive_stat = self.last_stat
+            elif self.search_archives and is_zip_file(record['file_name']):
+                self.mode = 'ZipCrawler'
+                self.archive_record = record
+                self.archive_stat = self.last_stat
+            return record, job
+        elif self.mode == 'TarCrawler':
+            if not self.tar_crawler:
+                self.tar_crawler = self.archive_records(TarCrawler(
+                    self.archive_record['full_path'],
+                    volume=self.volume, verbose=self.verbose, hash=self.hash,
+                    hash_cache=self.hash_cache, archive_stat=self.archive_stat,
+                    fields=self.fields, depth=self.archive_depth, spool=self.archive_spool,
+                    hash_timeout=self.hash_timeout, hash_max_bytes=self.hash_max_bytes
+                ))
+            try:
+                record = self.tar_crawler.__next__()
+                while record is not None and not self.track_change(record):
+                    record = self.tar_crawler.__next__()
+                if record is None:
+                    raise StopIteration()
+                return record, None
+            except StopIteration:
+                self.mode = 'Crawler'
+                self.tar_crawler = None
+                self.archive_record = None
+                return self.next_record_job()
+        elif self.mode == 'ZipCrawler':
+            if not self.zip_crawler:
+                self.zip_crawler = self.archive_records(ZipCrawler(
+                    self.archive_record['full_path'],
+                    volume=self.volume, verbose=self.verbose, hash=self.hash,
+                    hash_cache=self.hash_cache, archive_stat=self.archive_stat,
+                    fields=self.fields, workers=self.archive_workers,
+                    depth=self.archive_depth, spool=self.archive_spool,
+                    hash_timeout=self.hash_timeout, hash_max_bytes=self.hash_max_bytes
+                ))
+            try:
+                record = self.zip_crawler.__next__()
+                while record is not None and not self.track_change(record):
+                    record = self.zip_crawler.__next__()
+                if record is None:
+                    raise StopIteration()
+                return record, None
+            except StopIteration:
+                self.mode = 'Crawler'
+                self.zip_crawler = None
+                self.archive_record = None
+                return self.next_record_job()
+        elif self.mode == 'Deleted':
+            return self.deleted_iterator.__next__(), None
+        raise StopIteration()
+
+    def archive_records(self, archive_crawler):
+        """
+        Member records of the current archive from a ZipCrawler or TarCrawler.  With an
+        archive_cache, an unchanged archive's records are replayed without opening it and
+        the complete listing of a changed or new archive is saved.
+        """
+        archive_path = self.archive_record['full_path']
+        key = None
+        if self.archive_cache and self.archive_stat:
+            key = ArchiveCache.key(self.archive_stat, depth=self.archive_depth)
+        if key:
+            rows = self.archive_cache.get(key, hashed=self.hash)
+            if rows is not None:
+                yield from ArchiveCache.records(rows, self.record_constants, archive_path, hash=self.hash)
+                return
+
+        rows = []
+        cacheable = key is not None
+        skipped = self.archive_spool.skipped if self.archive_spool else 0
+        for record in archive_crawler:
+            if cacheable:
+                # don't keep a member that failed to hash
+                if self.hash and record.size > 0 and not record.dropbox_hash_value:
+                    cacheable = False
+                rows.append(ArchiveCache.row(record, archive_path))
+            yield record
+        if self.archive_spool and self.archive_spool.skipped != skipped:
+            # a larger spool budget would list more
+            cacheable = False
+        if cacheable and archive_crawler.complete:
+            self.archive_cache.put(key, self.hash, rows)
+
+    def track_change(self, record):
+        """
+        With a manifest, tag record with its 'change' and return False when it is unchanged.
+        """
+        if not self.manifest:
+            return True
+        change = self.manifest.compare(record)
+        if change is None:
+            return False
+        record['change'] = change
+        return True
+
+    @timed('crawl')
+    def next_crawler_job(self):
+        record, st = self.next_file_record()
+        while not self.track_change(record):
+            if self.search_archives and (is_tar_file(record['file_name']) or is_zip_file(record['file_name'])):
+                # unchanged archive, members are unchanged too
+                self.manifest.mark_seen(record['full_path'] + os.path.sep)
+            record, st = self.next_file_record()
+
+        return record, self.hash_job(record, st)
+
+    def hash_job(self, record, st):
+        """
+        HashJob computing record's dropbox_hash, None when it is cached or not needed.
+        """
+        job = None
+        if self.hash and record['size'] > 0:
+            cache_key = None
+            if self.hash_cache:
+                cache_key = HashCache.key(st)
+                record['dropbox_hash'] = self.hash_cache.get(cache_key, size=record['size']) or ''
+            if not record['dropbox_hash']:
+                job = HashJob(
+                    record['full_path'], record['size'], verbose=self.verbose,
+                    block_executor=self.block_executor, block_workers=self.block_workers,
+                    large_file_threshold=self.large_file_threshold,
+                    hash_cache=self.hash_cache, cache_key=cache_key,
+                    use_mmap=self.use_mmap, use_fadvise=self.use_fadvise, st=st,
+                    hash_timeout=self.hash_timeout, hash_max_bytes=self.hash_max_bytes
+                )
+        return job
+
+    def next_file_record(self):
+        if self.walker == 'scandir':
+            entry, st = self.next_scandir_entry()
+            full_path = entry.path
+            file_name = entry.name
+            relative_path = full_path[len(self.path_prefix):]
+            suffix = get_suffix(file_name)
+        else:
+            p = self.next_glob_path()
+            st = p.stat()
+            full_path = str(self.base_path / p)
+            file_name = self.get_file_name(p)
+            relative_path = str(p.relative_to(self.base_path))
+            suffix = p.suffix
+        self.last_stat = st
+
+        record = FileRecord(
+            self.record_constants, file_name, relative_path, full_path, int(st.st_size),
+            st.st_ctime, st.st_mtime, suffix
+        )
+
+        if self.verbose:
+            print(f"{record['full_path']}, {record['size']}", file=sys.stderr)
+
+        return record, st
+
+    def next_scandir_entry(self):
+        # scandir_walk() already skips directories and deals with permission and listing errors
+        return self.path_iterator.__next__()
+
+    def next_glob_path(self):
+        p = None
+        failures = 0
+        is_file = False
+        while not (p and is_file):
+            if p:
+                try:
+                    is_file = p.is_file()
+                    if not is_file and telemetry is not None and p.is_dir():
+                        telemetry.count('directories')
+                except PermissionError as e:
+                    is_file = False
+                    if self.verbose:
+                        print(f"\nException: {e}", file=sys.stderr)
+                        print(f"Crawler.next_glob_path(): Permission Problem At: {self.base_path}\n",
+                            file=sys.stderr)
+            if p and is_file:
+                break
+            try:
+                p = self.path_iterator.__next__()
+                failures = 0
+            except (OSError, FileNotFoundError) as e:
+                failures += 1
+                if self.verbose:
+                    print(f"\nException: {e}", file=sys.stderr)
+                    print(
+                        f"Crawler.__next__() {failures} iterator failures at {self.base_path}\n",
+                        file=sys.stderr)
+                if failures > 10:
+                    # This might be overkill.
+                    # Generally when these exceptions occur, the iterator is done and won't restart on the first try.
+                    raise StopIteration()
+        return p
+
+    def get_file_name(self, name):
+        name = str(name)
+        if '/' in name:
+            parts = name.split('/')
+            return parts[-1]
+        elif '\\' in name:
+            parts = name.split('\\')
+            return parts[-1]
+        return name
+
+    def file_system_search(self, base_path):
+        for record in self.path_crawler(base_path):
+            self.output(record)
+
+    def output(self, record):
+        print(record)
+
+
+class ZipCrawler():
+    """
+    Records for the files in a zip archive.  With workers > 0, up to workers members are hashed
+    concurrently, each thread reading through its own ZipFile handle so decompression isn't
+    serialized on one file position.  Records are still returned in archive order.
+
+    With depth > 1, zip and tar archives inside the archive are searched too, down to depth
+    levels of nesting, with inner archives copied through spool.  fileobj is an already open
+    archive, e.g. an inner archive's spool.
+    """
+    def __init__(self, zipfile, volume, verbose=False, hash=True, hash_cache=None, archive_stat=None,
+                fields=None, workers=0, depth=ARCHIVE_DEPTH, spool=None, fileobj=None,
+                hash_timeout=None, hash_max_bytes=None):
+        self.file = zipfile
+        self.current_working_directory = Path.cwd()
+        self.volume = volume
+        self.verbose = verbose
+        self.hostname = socket.gethostname()
+        self.fields = check_fields(fields)
+        self.record_constants = RecordConstants(self.hostname, volume, self.fields)
+        self.base_path = zipfile
+        self.stop_iterator = False
+        self.hash = hash and 'dropbox_hash' in self.fields
+        self.hash_cache = hash_cache
+        self.archive_stat = archive_stat
+        # per member budgets, see budgeted_hash()
+        self.hash_timeout = hash_timeout
+        self.hash_max_bytes = hash_max_bytes
+        self.workers = workers
+        self.depth = depth
+        self.spool = spool
+        self.fileobj = fileobj
+        self.nested = None
+        # True once every member was listed, i.e. the archive wasn't damaged
+        self.complete = False
+        self.executor = None
+        self.handles = []
+        self.handles_lock = threading.Lock()
+        self.local = threading.local()
+        self.pending = deque()
+
+    def __iter__(self):
+        try:
+            self.z_file = zipfile.ZipFile(self.fileobj or self.base_path)
+            self.z_info_iter = iter(self.z_file.infolist())
+            # a spool can't be opened again by other threads
+            if self.hash and self.workers > 0 and self.fileobj is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        except:
+            # Zip file may be damaged and/or otherwise unreadable.
+            self.stop_iterator = True
+            if self.verbose:
+                e = sys.exc_info()[0]
+                print(f"\nException: {e}", file=sys.stderr)
+                print(f"Tar Archive File: {self.base_path}\n", file=sys.stderr)
+
+        return self
+    
+    @timed('archive')
+    def __next__(self):
+        if self.stop_iterator:
+            raise StopIteration()
+        if self.nested is not None:
+            try:
+                return self.nested.__next__()
+            except StopIteration:
+                self.nested = None
+        try:
+            if self.executor:
+                # keep the next few members hashing while this one is returned
+                while len(self.pending) < 2 * self.workers and self.submit_next():
+                    pass
+                if not self.pending:
+                    raise StopIteration()
+                info, key, digest = self.pending.popleft()
+            else:
+                info = self.next_info()
+                key, digest = None, None
+
+            name = info.filename
+            file_name = self.get_file_name(name)
+
+            full_path = self.file + os.path.sep + name
+            if os.path.sep == "\\":
+                full_path = full_path.replace('/', "\\")
+            # zip date_time is converted by iso_timestamp() when first read
+            record = FileRecord(
+                self.record_constants, file_name, name, full_path, info.file_size,
+                tuple(info.date_time), tuple(info.date_time), self.get_suffix(file_name),
+                is_archive=True
+            )
+
+            if self.verbose:
+                print(f"{record['full_path']}, {record['size']}, {record['is_archive']}", file=sys.stderr)
+
+            nested = None
+            if self.nests(file_name, info.file_size):
+                nested = nested_archive(self, record, name, lambda: self.z_file.open(info))
+            if nested is not None:
+                record['dropbox_hash'], status, self.nested = nested
+                if status:
+                    record['hash_status'] = status
+            elif self.executor and digest is not None:
+                status = ''
+                if not isinstance(digest, str):
+                    digest, status = digest.result()
+                    if self.hash_cache:
+                        self.hash_cache.put(key, digest)
+                record['dropbox_hash'] = digest
+                if status:
+                    record['hash_status'] = status
+            elif self.hash and record['size'] > 0:
+                record['dropbox_hash'], status = self.cached_hash(
+                    name, record['size'],
+                    lambda budget: zip_dropbox_hash(self.z_file, self.file, name, budget=budget)
+                )
+                if status:
+                    record['hash_status'] = status
+
+        except StopIteration:
+            self.complete = True
+            self.close()
+            raise
+        except (OSError, zipfile.BadZipFile) as e:
+            if self.verbose:
+                print(f"\nException: {e}", file=sys.stderr)
+                print(f"ZipCrawler.__next__(): Zip File Name {self.base_path}\n", file=sys.stderr)
+            self.close()
+            raise StopIteration()
+
+        return record
+
+    def next_info(self):
+        # name is really a path within the archive, skip directories
+        info = self.z_info_iter.__next__()
+        while info.is_dir():
+            info = self.z_info_iter.__next__()
+        return info
+
+    def submit_next(self):
+        """
+        Start hashing the next member, False at the end of the archive.  pending holds
+        (info, cache key, digest) with digest a str for cache hits, None when not hashed and
+        otherwise a Future.
+        """
+        try:
+            info = self.next_info()
+        except StopIteration:
+            return False
+        key, digest = None, None
+        # inner archives are hashed while they are copied out
+        if info.file_size > 0 and not self.nests(self.get_file_name(info.filename), info.file_size):
+            if self.hash_cache and self.archive_stat:
+                key = HashCache.key(self.archive_stat, member=info.filename)
+                digest = self.hash_cache.get(key, size=info.file_size)
+            if not digest:
+                digest = self.executor.submit(self.hash_member, info.filename, info.file_size)
+        self.pending.append((info, key, digest, ))
+        return True
+
+    def nests(self, file_name, size):
+        return (
+            self.depth > 1 and self.spool is not None and size > 0
+            and (is_zip_file(file_name) or is_tar_file(file_name))
+        )
+
+    def hash_member(self, name, size):
+        """
+        (dropbox_hash, hash_status) of member name, on an executor thread.
+        """
+        return budgeted_hash(
+            lambda budget: self.hash_member_file(name, budget), size,
+            hash_timeout=self.hash_timeout, hash_max_bytes=self.hash_max_bytes
+        )
+
+    def hash_member_file(self, name, budget):
+        # ZipFile handles share one file position, so each thread opens its own
+        z_file = getattr(self.local, 'z_file', None)
+        if z_file is None:
+            try:
+                z_file = self.local.z_file = zipfile.ZipFile(self.base_path)
+            except:
+                if self.verbose:
+                    e = sys.exc_info()[0]
+                    print(f"\nException: {e}", file=sys.stderr)
+                    print(f"Zip Archive File Name: {self.base_path}\n", file=sys.stderr)
+                return ''
+            with self.handles_lock:
+                self.handles.append(z_file)
+        return zip_dropbox_hash(z_file, self.file, name, verbose=self.verbose, budget=budget)
+
+    def close(self):
+        if self.executor:
+            # shutdown(cancel_futures=True) needs Python 3.9
+            for info, key, digest in self.pending:
+                if digest is not None and not isinstance(digest, str):
+                    digest.cancel()
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.pending.clear()
+        if self.nested is not None:
+            self.nested.close()
+            self.nested = None
+        with self.handles_lock:
+            for z_file in self.handles:
+                z_file.close()
+            self.handles = []
+        z_file = getattr(self, 'z_file', None)
+        if z_file:
+            z_file.close()
+            self.z_file = None
+
+    def cached_hash(self, member, size, hash_function):
+        """
+        (dropbox_hash, hash_status) of member, from the hash cache or budgeted_hash(hash_function).
+        """
+        key = None
+        if self.hash_cache and self.archive_stat:
+            key = HashCache.key(self.archive_stat, member=member)
+            digest = self.hash_cache.get(key, size=size)
+            if digest:
+                return digest, ''
+        digest, status = budgeted_hash(
+            hash_function, size, hash_timeout=self.hash_timeout, hash_max_bytes=self.hash_max_bytes
+        )
+        if key is not None:
+            self.hash_cache.put(key, digest)
+        return digest, status
+
+    def get_suffix(self, file_name):
+        if "." not in file_name:
+            return None
+        parts = file_name.split('.')
+        if len(parts[-1]) > 15:
+            return None
+        return parts[-1]
+
+    def get_file_name(self, name):
+        name = str(name)
+        if "/" not in name:
+            return name
+        parts = name.split('/')
+        return parts[-1]
+
+class TarCrawler():
+    """
+    Records for the files in a tar archive.  The archive is read as a stream ('r|*'), each
+    member is hashed as it flows past so compressed archives are decompressed exactly once.
+
+    depth, spool and fileobj are the same as for ZipCrawler.  Inner archives are copied out
+    while they flow past.
+    """
+    def __init__(self, tar_file_path, volume, verbose=False, hash=True, hash_cache=None, archive_stat=None,
+                fields=None, depth=ARCHIVE_DEPTH, spool=None, fileobj=None,
+                hash_timeout=None, hash_max_bytes=None):
+        self.file = tar_file_path
+        self.current_working_directory = Path.cwd()
+        self.volume = volume
+        self.verbose = verbose
+        self.hostname = socket.gethostname()
+        self.fields = check_fields(fields)
+        self.record_constants = RecordConstants(self.hostname, volume, self.fields)
+        self.base_path = tar_file_path
+        self.stop_iterator = False
+        self.hash = hash and 'dropbox_hash' in self.fields
+        self.hash_cache = hash_cache
+        self.archive_stat = archive_stat
+        # per member budgets, see budgeted_hash()
+        self.hash_timeout = hash_timeout
+        self.hash_max_bytes = hash_max_bytes
+        self.depth = depth
+        self.spool = spool
+        self.fileobj = fileobj
+        self.nested = None
+        # True once every member was listed, i.e. the archive wasn't damaged
+        self.complete = False
+
+    def __iter__(self):
+        try:
+            # open archive as a stream, members can only be read in archive order
+            if self.fileobj is not None:
+                self.tar = tarfile.open(fileobj=self.fileobj, mode='r|*')
+            else:
+                self.tar = tarfile.open(self.base_path, mode='r|*')
+
+        except:
+            # Zip file is damaged and/or otherwise unreadable.
+            self.stop_iterator = True
+            if self.verbose:
+                e = sys.exc_info()[0]
+                print(f"\n__iter__(): Exception: {e}", file=sys.stderr)
+                print(f"Tar Archive File Name: {self.file}", file=sys.stderr)
+
+        return self
+    
+    @timed('archive')
+    def __next__(self):
+        if self.stop_iterator:
+            raise StopIteration()
+        if self.nested is not None:
+            try:
+                return self.nested.__next__()
+            except StopIteration:
+                self.nested = None
+        try:
+            # name is really a path within the archive, skip directories
+            tarinfo = self.next_tarinfo()
+            while not tarinfo.isfile():
+                tarinfo = self.next_tarinfo()
+            
+            file_name = self.get_file_name(tarinfo.name)
+
+            full_path = self.file + os.path.sep + file_name
+            if os.path.sep == "\\":
+                full_path = full_path.replace('/', "\\")
+            # tar mtime is converted by iso_timestamp() when first read
+            record = FileRecord(
+                self.record_constants, file_name, file_name, full_path, tarinfo.size,
+                tarinfo.mtime, tarinfo.mtime, self.get_suffix(file_name),
+                is_archive=True
+            )
+
+            if self.verbose:
+                print(f"{record['full_path']}, {record['size']}, {record['is_archive']}", file=sys.stderr)
+
+            nested = None
+            if self.nests(file_name, tarinfo.size):
+                # copied out now, the stream can't come back to this member
+                nested = nested_archive(self, record, tarinfo.name, lambda: self.tar.extractfile(tarinfo))
+            if nested is not None:
+                record['dropbox_hash'], status, self.nested = nested
+                if status:
+                    record['hash_status'] = status
+            elif self.hash and record['size'] > 0:
+                record['dropbox_hash'], status = self.cached_hash(
+                    tarinfo.name, record['size'],
+                    lambda budget: tar_dropbox_hash(
+                        self.tar, tarinfo, self.file, tarinfo.name, verbose=self.verbose, budget=budget
+                    )
+                )
+                if status:
+                    record['hash_status'] = status
+
+        except StopIteration:
+            self.complete = True
+            self.tar.close()
+            raise StopIteration()
+        except:
+            if self.verbose:
+                e = sys.exc_info()[0]
+                print(f"\n__next__() {e}", file=sys.stderr)
+                print(f"TarCrawler.__next__(): tar_file: {self.base_path}\n", file=sys.stderr)
+            self.tar.close()
+            raise StopIteration()
+
+        return record
+
+    def nests(self, file_name, size):
+        return (
+            self.depth > 1 and self.spool is not None and size > 0
+            and (is_zip_file(file_name) or is_tar_file(file_name))
+        )
+
+    def next_tarinfo(self):
+        tarinfo = self.tar.next()
+        if tarinfo is None:
+            raise StopIteration()
+        # a stream can't seek back to earlier members, don't keep their TarInfo
+        self.tar.members = []
+        return tarinfo
+
+    def cached_hash(self, member, size, hash_function):
+        """
+        (dropbox_hash, hash_status) of member, from the hash cache or budgeted_hash(hash_function).
+        """
+        key = None
+        if self.hash_cache and self.archive_stat:
+            key = HashCache.key(self.archive_stat, member=member)
+            digest = self.hash_cache.get(key, size=size)
+            if digest:
+                return digest, ''
+        digest, status = budgeted_hash(
+            hash_function, size, hash_timeout=self.hash_timeout, hash_max_bytes=self.hash_max_bytes
+        )
+        if key is not None:
+            self.hash_cache.put(key, digest)
+        return digest, status
+
+    def get_suffix(self, file_name):
+        if "." not in file_name:
+            return None
+        parts = file_name.split('.')
+        if len(parts[-1]) > 15:
+            return None
+        return parts[-1]
+
+    def get_file_name(self, name):
+        name = str(name)
+        if "/" not in name:
+            return name
+        parts = name.split('/')
+        return parts[-1]
+
+
+ASYNC_CONCURRENCY = 64
+# threads hashing files and archive members, each keeps a HASH_BLOCK_SIZE buffer
+ASYNC_HASH_CONCURRENCY = 4
+ASYNC_ARCHIVE_BATCH = 256
+
+class AsyncCrawler(Crawler):
+    """
+    Crawler for file systems where every directory listing and stat() is a network round trip,
+    e.g. NFS and SMB mounts.  Iterated with async for, records are the same as Crawler's.
+
+    concurrency coroutines share the work, each waiting on a thread of an executor for one
+    directory listing, stat() or file hash at a time, so up to concurrency round trips are
+    in flight instead of one.  Files are taken before directories, so the listed files waiting
+    for their stat() don't pile up.  Records come out in completion order.  Archives are
+    searched one at a time, their members in batches of ASYNC_ARCHIVE_BATCH.
+
+    Hashing runs on a separate executor of at most hash_concurrency threads, so memory for
+    hash buffers doesn't grow with concurrency.
+
+    Takes Crawler's arguments, the walker is always 'scandir'.  hash_workers, io_order and
+    unordered don't apply, concurrency takes their place.
+    """
+    def __init__(self, base_path=None, concurrency=ASYNC_CONCURRENCY,
+                hash_concurrency=ASYNC_HASH_CONCURRENCY, **kwargs):
+        super().__init__(base_path=base_path, **kwargs)
+        if concurrency < 1:
+            raise ValueError(f"Not a valid concurrency: {concurrency}")
+        if hash_concurrency < 1:
+            raise ValueError(f"Not a valid hash_concurrency: {hash_concurrency}")
+        self.concurrency = concurrency
+        self.hash_concurrency = min(hash_concurrency, concurrency)
+        self.walker = 'scandir'
+        self.hash_workers = 0
+
+    def __aiter__(self):
+        return self.crawl()
+
+    async def crawl(self):
+        self.path_prefix = os.path.join(str(self.base_path), '')
+        self.deleted_prefix = self.path_prefix
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.hash_executor = ThreadPoolExecutor(max_workers=self.hash_concurrency)
+        self.work = asyncio.Condition()
+        self.files = deque()
+        self.directories = [str(self.base_path), ]
+        self.busy = 0
+        self.archive_lock = asyncio.Lock()
+        records = asyncio.Queue(maxsize=self.concurrency * 4)
+
+        tasks = [asyncio.ensure_future(self.crawl_worker(records)) for i in range(self.concurrency)]
+        stopped = False
+
+        async def crawl_workers():
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                if not stopped:
+                    # wakes up the loop below, also when a worker failed
+                    await records.put(None)
+
+        workers = asyncio.ensure_future(crawl_workers())
+        try:
+            while True:
+                record = await records.get()
+                if record is None:
+                    break
+                yield record
+            # raises what stopped a worker
+            await workers
+            if self.manifest and self.deleted_prefix is not None:
+                for record in self.manifest.deleted(self.deleted_prefix):
+                    yield record
+        finally:
+            # the consumer stopped early, a worker failed or all is done
+            stopped = True
+            for task in tasks + [workers, ]:
+                task.cancel()
+            await asyncio.gather(*tasks, workers, return_exceptions=True)
+            # at most concurrency calls are left, shutdown(cancel_futures=True) needs Python 3.9
+            self.executor.shutdown(wait=False)
+            self.hash_executor.shutdown(wait=False)
+
+    async def run(self, function, *args, executor=None):
+        # the running loop, asyncio.get_running_loop() needs Python 3.7
+        return await asyncio.get_event_loop().run_in_executor(executor or self.executor, function, *args)
+
+    async def crawl_worker(self, records):
+        while True:
+            async with self.work:
+                await self.work.wait_for(lambda: self.files or self.directories or not self.busy)
+                if not self.files and not self.directories:
+                    # nothing left and nothing being listed that could add more
+                    self.work.notify_all()
+                    return
+                self.busy += 1
+                if self.files:
+                    entry = self.files.popleft()
+                    directory = None
+                else:
+                    entry = None
+                    directory = self.directories.pop()
+            try:
+                if directory is not None:
+                    files, sub_directories = await self.run(
+                        list_directory, directory, self.verbose, self.path_filter
+                    )
+                    self.files.extend(files)
+                    # reversed so that sub-directories are visited in listing order
+                    self.directories.extend(reversed(sub_directories))
+                else:
+                    await self.crawl_file(entry, records)
+            finally:
+                async with self.work:
+                    self.busy -= 1
+                    self.work.notify_all()
+
+    async def crawl_file(self, entry, records):
+        st = await self.run(stat_entry, entry, self.verbose)
+        if st is None:
+            return
+        full_path = entry.path
+        record = FileRecord(
+            self.record_constants, entry.name, full_path[len(self.path_prefix):], full_path,
+            int(st.st_size), st.st_ctime, st.st_mtime, get_suffix(entry.name)
+        )
+        if self.verbose:
+            print(f"{record['full_path']}, {record['size']}", file=sys.stderr)
+
+        archive = self.search_archives and (is_tar_file(record['file_name']) or is_zip_file(record['file_name']))
+        if not self.track_change(record):
+            if archive:
+                # unchanged archive, members are unchanged too
+                self.manifest.mark_seen(record['full_path'] + os.path.sep)
+            return
+
+        record.hash_job = self.hash_job(record, st)
+        if record.hash_job:
+            # reading dropbox_hash runs the job
+            await self.run(record.__getitem__, 'dropbox_hash', executor=self.hash_executor)
+        await records.put(record)
+
+        if archive:
+            async with self.archive_lock:
+                await self.crawl_archive(record, st, records)
+
+    async def crawl_archive(self, record, st, records):
+        self.archive_record = record
+        self.archive_stat = st
+        if is_tar_file(record['file_name']):
+            archive_crawler = TarCrawler(
+                record['full_path'],
+                volume=self.volume, verbose=self.verbose, hash=self.hash,
+                hash_cache=self.hash_cache, archive_stat=st,
+                fields=self.fields, depth=self.archive_depth, spool=self.archive_spool,
+                hash_timeout=self.hash_timeout, hash_max_bytes=self.hash_max_bytes
+            )
+        else:
+            archive_crawler = ZipCrawler(
+                record['full_path'],
+                volume=self.volume, verbose=self.verbose, hash=self.hash,
+                hash_cache=self.hash_cache, archive_stat=st,
+                fields=self.fields, workers=self.archive_workers,
+                depth=self.archive_depth, spool=self.archive_spool,
+                hash_timeout=self.hash_timeout, hash_max_bytes=self.hash_max_bytes
+            )
+        members = self.archive_records(archive_crawler)
+        try:
+            while True:
+                batch = await self.run(self.archive_batch, members, executor=self.hash_executor)
+                for member in batch:
+                    if self.track_change(member):
+                        await records.put(member)
+                if len(batch) < ASYNC_ARCHIVE_BATCH:
+                    break
+        finally:
+            members.close()
+            self.archive_record = None
+
+    @staticmethod
+    def archive_batch(members):
+        batch = []
+        for member in itertools.islice(members, ASYNC_ARCHIVE_BATCH):
+            if member is None:
+                break
+            # hash on the executor thread, not when published
+            member['dropbox_hash']
+            batch.append(member)
+        return batch
+
+
+def crawler_arguments(args, base_path):
+    """
+    Crawler keyword arguments for one base_path from the command line arguments.
+    """
+    return {
+        'base_path': base_path,
+        'volume': args['volume'],
+        'verbose': args['verbose'],
+        'hash': (not args['no_hash']),
+        'search_archives': args['search_archives'],
+        'walker': args['walker'],
+        'hash_workers': args['hash_workers'],
+        'unordered': args['unordered'],
+        'hash_queue_files': args['hash_queue_files'],
+        'hash_queue_bytes': args['hash_queue_bytes'],
+        'block_workers': args['block_workers'],
+        'large_file_threshold': args['large_file_threshold'],
+        'use_mmap': args['mmap'],
+        'io_order': args['io_order'],
+        'io_window': args['io_window'],
+        'use_fadvise': args['fadvise'],
+        'fields': args['fields'],
+        'archive_workers': args['archive_workers'],
+        'archive_depth': args['archive_depth'],
+        'archive_spool_memory': args['archive_spool_memory'],
+        'archive_spool_disk': args['archive_spool_disk'],
+        'exclude': args['exclude'],
+        'prune': args['prune'],
+        'one_file_system': args['one_file_system'],
+        'hash_timeout': args['hash_timeout'],
+        'hash_max_bytes': args['hash_max_bytes'],
+    }
+
+
+def main_loop(args, publish, hash_cache=None, manifest=None, archive_cache=None):
+
+    first_time = True
+    for base_path in args['base_paths']:
+        crawler = Crawler(
+                        hash_cache=hash_cache,
+                        archive_cache=archive_cache,
+                        manifest=manifest,
+                        **crawler_arguments(args, base_path)
+                    )
+
+        for record in crawler:
+            if manifest and manifest.persistent and record['change'] != 'deleted':
+                manifest.store(record)
+            if first_time:
+                first_time = False
+                publish.header(record)
+            else:
+                publish.body(record)
+
+    publish.footer()
+
+
+def async_main_loop(args, publish, hash_cache=None, manifest=None, archive_cache=None):
+    """
+    main_loop() with an AsyncCrawler for each base path.
+    """
+    async def crawl():
+        first_time = True
+        for base_path in args['base_paths']:
+            crawler = AsyncCrawler(
+                            hash_cache=hash_cache,
+                            archive_cache=archive_cache,
+                            manifest=manifest,
+                            concurrency=args['async_concurrency'],
+                            **crawler_arguments(args, base_path)
+                        )
+
+            async for record in crawler:
+                if manifest and manifest.persistent and record['change'] != 'deleted':
+                    manifest.store(record)
+                if first_time:
+                    first_time = False
+                    publish.header(record)
+                else:
+                    publish.body(record)
+
+        publish.footer()
+
+    # asyncio.run() needs Python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(crawl())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+    finally:
+        loop.close()
+
+
+CHECKPOINT_INTERVAL = 300
+
+class Checkpoint():
+    """
+    Crawl progress saved to a JSON file so that an interrupted crawl can be resumed.
+
+    A checkpoint holds the base path being crawled, the directories not listed yet, the output
+    columns, record count and position.  Every directory listed before the checkpoint has had
+    all of its records written.  The file is replaced atomically, a crash while saving leaves
+    the previous checkpoint in place.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """
+        Saved state, None when there is no checkpoint file.
+        """
+        try:
+            with open(self.path, 'r') as fd:
+                return json.load(fd)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as fd:
+            json.dump(state, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def checkpoint_main_loop(args, publish, checkpoint, state=None, hash_cache=None, archive_cache=None):
+    """
+    main_loop() saving a Checkpoint every args['checkpoint_interval'] seconds and, with a
+    loaded state, continuing from it.
+
+    At each checkpoint the walk pauses at the end of a directory and the Crawler is run dry -
+    hash workers and the io_order window empty - so every file listed so far has been written
+    and only the stack of directories not listed yet needs saving.  Files already written are
+    neither hashed nor written again after a resume.
+    """
+    base_index = 0
+    stack = None
+    directories = 0
+    if state:
+        base_index = state['base_index']
+        stack = state['stack']
+        directories = state['directories']
+        publish.restore(state['columns'], state['record_count'], state['position'])
+
+    interval = args['checkpoint_interval']
+    for index in range(base_index, len(args['base_paths'])):
+        arguments = crawler_arguments(args, args['base_paths'][index])
+        # entries come from the ScandirWalk below
+        arguments['walker'] = 'scandir'
+        crawler = Crawler(hash_cache=hash_cache, archive_cache=archive_cache, **arguments)
+        walker = ScandirWalk(
+            crawler.base_path, verbose=crawler.verbose, path_filter=crawler.path_filter,
+            stack=stack if index == base_index else None
+        )
+
+        next_checkpoint = time.monotonic() + interval
+        while True:
+            for record in crawler.crawl_entries(walker):
+                if publish.columns is None:
+                    publish.header(record)
+                else:
+                    publish.body(record)
+                if time.monotonic() >= next_checkpoint:
+                    walker.pause()
+                    next_checkpoint = float('inf')
+
+            if walker.exhausted():
+                break
+            checkpoint.save({
+                'base_paths': args['base_paths'],
+                'base_index': index,
+                'stack': walker.stack,
+                'directories': directories + walker.directories,
+                'output_format': args['output_format'],
+                'columns': publish.columns,
+                'record_count': publish.record_count,
+                'position': publish.position(),
+            })
+            next_checkpoint = time.monotonic() + interval
+
+        directories += walker.directories
+
+    publish.footer()
+    checkpoint.remove()
+
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+class Inotify():
+    """
+    Minimal Linux inotify(7) binding through ctypes.  Raises OSError where inotify isn't available.
+    """
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.libc = libc
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32, ]
+        self.libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int, ]
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path, mask):
+        """
+        Returns the watch descriptor.  OSError ENOSPC means the inotify watch limit is reached.
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def remove_watch(self, wd):
+        # fails harmlessly when the kernel already dropped the watch
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """
+        Returns the pending (wd, mask, cookie, name) events, name is '' for the watched
+        directory itself.
+        """
+        events = []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, cookie, name, ))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+    IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW
+)
+WATCH_DELAY = 1.0
+WATCH_RESCAN_INTERVAL = 300
+
+class Watcher():
+    """
+    Collects the changes under the watched base paths from inotify events.
+
+    Events are coalesced into three sets of (base_index, path): files to re-stat, directory
+    trees to rescan - new or moved in directories - and paths that were removed.  Directories
+    that can't be watched, e.g. once the inotify watch limit is reached, are kept in unwatched
+    for periodic rescans.  Without inotify every base path is unwatched.
+    """
+    def __init__(self, path_filters, verbose=False):
+        self.path_filters = path_filters
+        self.verbose = verbose
+        try:
+            self.inotify = Inotify()
+        except OSError as e:
+            self.inotify = None
+            print(f"\nException: {e}", file=sys.stderr)
+            print("Watcher(): inotify not available, rescanning periodically\n", file=sys.stderr)
+        self.watches = {}
+        self.unwatched = set()
+        self.files = set()
+        self.trees = set()
+        self.removed = set()
+
+    def fileno(self):
+        return self.inotify.fd
+
+    def pending(self):
+        return bool(self.files or self.trees or self.removed)
+
+    def take(self):
+        """
+        Returns and clears the (removed, trees, files) collected so far.  Trees inside other
+        trees and files inside trees are left out, they are rescanned with the tree.
+        """
+        trees = set()
+        for base_index, path in sorted(self.trees, key=lambda tree: tree[1]):
+            if not any(path.startswith(os.path.join(tree, '')) or path == tree for i, tree in trees):
+                trees.add((base_index, path, ))
+        prefixes = tuple(os.path.join(tree, '') for i, tree in trees)
+        files = {(i, path, ) for i, path in self.files if not path.startswith(prefixes)}
+        removed = self.removed
+        self.files, self.trees, self.removed = set(), set(), set()
+        return removed, trees, files
+
+    def add_tree(self, base_index, path):
+        """
+        Watch directory path and every directory below it that the base path's PathFilter keeps.
+        """
+        path_filter = self.path_filters[base_index]
+        if self.inotify is None:
+            self.unwatched.add((base_index, path, ))
+            return
+        stack = [path, ]
+        while stack:
+            directory = stack.pop()
+            try:
+                wd = self.inotify.add_watch(directory, WATCH_MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    # out of watches, the whole subtree is rescanned periodically instead
+                    self.unwatched.add((base_index, directory, ))
+                elif self.verbose:
+                    print(f"\nException: {e}", file=sys.stderr)
+                    print(f"Watcher.add_tree(): Problem Watching: {directory}\n", file=sys.stderr)
+                continue
+            self.watches[wd] = (base_index, directory, )
+            self.unwatched.discard((base_index, directory, ))
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                        if path_filter is not None and path_filter.skip_directory(entry):
+                            continue
+                        stack.append(entry.path)
+            except OSError as e:
+                if self.verbose:
+                    print(f"\nException: {e}", file=sys.stderr)
+                    print(f"Watcher.add_tree(): Problem Listing Directory: {directory}\n", file=sys.stderr)
+
+    def remove_tree(self, path):
+        """
+        Stop watching path and the directories below it, e.g. after path was moved away.
+        """
+        prefix = os.path.join(path, '')
+        for wd, (base_index, directory) in list(self.watches.items()):
+            if directory == path or directory.startswith(prefix):
+                self.inotify.remove_watch(wd)
+                del self.watches[wd]
+
+    def read(self):
+        """
+        Read the pending inotify events into files, trees and removed.
+        """
+        for wd, mask, cookie, name in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, rescan everything that is watched
+                for base_index, directory in self.watches.values():
+                    self.trees.add((base_index, directory, ))
+                continue
+            if wd not in self.watches:
+                continue
+            base_index, directory = self.watches[wd]
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                continue
+            if not name:
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    self.remove_tree(directory)
+                    self.removed.add((base_index, directory, ))
+                continue
+
+            path = os.path.join(directory, name)
+            path_filter = self.path_filters[base_index]
+            if mask & IN_ISDIR:
+                if mask & (IN_MOVED_FROM | IN_DELETE):
+                    self.remove_tree(path)
+                    self.removed.add((base_index, path, ))
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    if path_filter is None or not path_filter.skip_directory(FileEntry(path)):
+                        self.trees.add((base_index, path, ))
+                continue
+            if path_filter is not None and path_filter.skip_file(FileEntry(path)):
+                continue
+            # re-stat'ed when the batch is processed, missing files are removed then
+            self.files.add((base_index, path, ))
+
+
+def watch_main_loop(args, publish, manifest, hash_cache=None, archive_cache=None):
+    """
+    Crawl all base_paths, then keep the output up to date with inotify until interrupted.
+
+    The initial crawl compares against manifest, so every record is tagged with a 'change'.
+    After it, bursts of inotify events are coalesced until nothing happened for
+    args['watch_delay'] seconds.  Touched files are re-stat'ed and, when changed, re-hashed and
+    output tagged 'added' or 'modified'.  Removed files and directories are output from the
+    manifest tagged 'deleted'.  Directories that can't be watched are rescanned every
+    args['watch_rescan_interval'] seconds.
+    """
+    crawlers = []
+    for base_path in args['base_paths']:
+        arguments = crawler_arguments(args, base_path)
+        arguments['walker'] = 'scandir'
+        crawlers.append(Crawler(
+            hash_cache=hash_cache, archive_cache=archive_cache, manifest=manifest, **arguments
+        ))
+    watcher = Watcher([crawler.path_filter for crawler in crawlers], verbose=args['verbose'])
+
+    def output(records):
+        for record in records:
+            if record.get('change') != 'deleted':
+                manifest.store(record)
+            if publish.columns is None:
+                publish.header(record)
+            else:
+                publish.body(record)
+
+    def process(removed, trees, files):
+        # entries seen from here on belong to this batch, see Manifest.deleted()
+        manifest.run += 1
+        for base_index, path in sorted(removed):
+            output(manifest.removed(path))
+        for base_index, path in sorted(trees):
+            crawler = crawlers[base_index]
+            watcher.add_tree(base_index, path)
+            output(crawler.crawl_entries(
+                scandir_walk(path, verbose=crawler.verbose, path_filter=crawler.path_filter),
+                deleted_prefix=os.path.join(path, '')
+            ))
+        for base_index, path in sorted(files):
+            crawler = crawlers[base_index]
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is None or not stat.S_ISREG(st.st_mode):
+                if st is not None and stat.S_ISDIR(st.st_mode):
+                    continue
+                output(manifest.removed(path))
+                continue
+            output(crawler.crawl_entries([(FileEntry(path), st, ), ]))
+            if crawler.search_archives and (is_tar_file(path) or is_zip_file(path)):
+                # members no longer in a changed archive
+                output(manifest.deleted(os.path.join(path, '')))
+        manifest.db.commit()
+        publish.flush()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        # watches first, so nothing changing during the initial crawl is missed
+        process(set(), {(i, str(crawler.base_path), ) for i, crawler in enumerate(crawlers)}, set())
+
+        delay = args['watch_delay']
+        interval = args['watch_rescan_interval']
+        next_rescan = time.monotonic() + interval
+        first_event = None
+        last_event = None
+        while True:
+            now = time.monotonic()
+            if first_event is not None:
+                # a steady stream of events is processed at least every 10 delays
+                timeout = min(last_event + delay, first_event + 10 * delay) - now
+            elif watcher.unwatched:
+                timeout = next_rescan - now
+            else:
+                timeout = None
+            if timeout is not None:
+                timeout = max(timeout, 0)
+
+            if watcher.inotify is None:
+                time.sleep(timeout)
+            elif select.select([watcher, ], [], [], timeout)[0]:
+                watcher.read()
+                now = time.monotonic()
+                if watcher.pending():
+                    last_event = now
+                    if first_event is None:
+                        first_event = now
+
+            now = time.monotonic()
+            if first_event is not None and (now >= last_event + delay or now >= first_event + 10 * delay):
+                process(*watcher.take())
+                first_event = None
+                last_event = None
+            if watcher.unwatched and now >= next_rescan:
+                process(set(), set(watcher.unwatched), set())
+                next_rescan = time.monotonic() + interval
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if watcher.inotify:
+            watcher.inotify.close()
+
+    publish.footer()
+
+
+WORK_CHUNK_FILES = 1000
+RESULT_BATCH_RECORDS = 1000
+
+def crawl_worker(task_queue, result_queue, crawler_argument_list, hash_cache_arguments,
+                archive_cache_arguments=None, telemetry_enabled=False):
+    """
+    Worker process for parallel_main_loop().
+
+    Tasks are ('directory', base_index, path) or ('files', base_index, [path, ...]).
+    A directory task lists one directory.  Sub-directories, and files beyond the first
+    WORK_CHUNK_FILES of a large directory, are handed back to the coordinator as new tasks so
+    that idle workers can pick them up.  Records are sent back in batches as ('records', [...]),
+    each task ends with exactly one ('done', ([new tasks], hash cache updates, archive cache
+    updates)) message.  The final ('exit', ...) message carries cache statistics and, with
+    telemetry_enabled, this worker's Telemetry report.
+    """
+    global telemetry
+    # a forked worker starts counting from zero, its report is merged on exit
+    telemetry = Telemetry() if telemetry_enabled else None
+
+    hash_cache = None
+    if hash_cache_arguments:
+        hash_cache = HashCache(deferred=True, **hash_cache_arguments)
+    archive_cache = None
+    if archive_cache_arguments:
+        archive_cache = ArchiveCache(deferred=True, **archive_cache_arguments)
+
+    crawlers = {}
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        kind, base_index, target = task
+        new_tasks = []
+        try:
+            if base_index not in crawlers:
+                crawlers[base_index] = Crawler(
+                    hash_cache=hash_cache, archive_cache=archive_cache,
+                    **crawler_argument_list[base_index]
+                )
+            crawler = crawlers[base_index]
+
+            if kind == 'directory':
+                sub_directories = []
+                entries = list(scan_directory(
+                    target, sub_directories, verbose=crawler.verbose, path_filter=crawler.path_filter
+                ))
+                new_tasks.extend(('directory', base_index, path, ) for path in sub_directories)
+                for i in range(WORK_CHUNK_FILES, len(entries), WORK_CHUNK_FILES):
+                    paths = [entry.path for entry, st in entries[i:i + WORK_CHUNK_FILES]]
+                    new_tasks.append(('files', base_index, paths, ))
+                entries = entries[:WORK_CHUNK_FILES]
+            else:
+                entries = stat_entries(target, verbose=crawler.verbose)
+
+            records = []
+            for record in crawler.crawl_entries(entries):
+                # computes any lazy fields, including dropbox_hash, in this worker
+                records.append(dict(record))
+                if len(records) >= RESULT_BATCH_RECORDS:
+                    result_queue.put(('records', records, ))
+                    records = []
+            if records:
+                result_queue.put(('records', records, ))
+
+        except Exception as e:
+            print(f"\nException: {e}", file=sys.stderr)
+            print(f"crawl_worker(): Problem At: {target}\n", file=sys.stderr)
+
+        cache_updates = None
+        if hash_cache:
+            cache_updates = hash_cache.drain()
+        archive_cache_updates = None
+        if archive_cache:
+            archive_cache_updates = archive_cache.drain()
+        result_queue.put(('done', (new_tasks, cache_updates, archive_cache_updates, ), ))
+
+    statistics = None
+    if hash_cache:
+        statistics = hash_cache.statistics()
+        hash_cache.close()
+    archive_statistics = None
+    if archive_cache:
+        archive_statistics = archive_cache.statistics()
+        archive_cache.close()
+    telemetry_statistics = telemetry.report() if telemetry else None
+    result_queue.put(('exit', (statistics, archive_statistics, telemetry_statistics, ), ))
+
+
+def parallel_main_loop(args, publish, hash_cache=None, archive_cache=None):
+    """
+    Crawl all base_paths with args['workers'] worker processes.
+
+    The coordinator (this process) owns a shared task queue of directory subtrees.  Workers
+    pull tasks from it as they become idle, so one huge subtree is spread across all workers.
+    Every directory is queued exactly once and each task is acknowledged, so no file is
+    output twice or lost.  All records are written by the one Publish instance.
+    """
+    crawler_argument_list = []
+    for base_path in args['base_paths']:
+        arguments = crawler_arguments(args, base_path)
+        # worker processes may not share this process' working directory semantics
+        arguments['base_path'] = str(Crawler(base_path=base_path).base_path)
+        arguments['walker'] = 'scandir'
+        crawler_argument_list.append(arguments)
+
+    hash_cache_arguments = None
+    if hash_cache:
+        # make sure workers see the result of --hash_cache_clear
+        hash_cache.db.commit()
+        hash_cache_arguments = {'path': hash_cache.path, }
+    archive_cache_arguments = None
+    if archive_cache:
+        archive_cache.db.commit()
+        archive_cache_arguments = {'path': archive_cache.path, }
+
+    task_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue(maxsize=4 * args['workers'])
+    workers = [
+        multiprocessing.Process(
+            target=crawl_worker,
+            args=(
+                task_queue, result_queue, crawler_argument_list, hash_cache_arguments,
+                archive_cache_arguments, telemetry is not None,
+            ),
+            daemon=True
+        )
+        for i in range(args['workers'])
+    ]
+    for worker in workers:
+        worker.start()
+
+    outstanding = 0
+    for base_index, arguments in enumerate(crawler_argument_list):
+        task_queue.put(('directory', base_index, arguments['base_path'], ))
+        outstanding += 1
+
+    first_time = True
+    while outstanding > 0:
+        try:
+            message = result_queue.get(timeout=1)
+        except queue.Empty:
+            if not all(worker.is_alive() for worker in workers):
+                raise RuntimeError('parallel_main_loop(): crawl worker process died')
+            continue
+
+        kind, payload = message
+        if kind == 'done':
+            outstanding -= 1
+            new_tasks, cache_updates, archive_cache_updates = payload
+            for task in new_tasks:
+                task_queue.put(task)
+                outstanding += 1
+            if hash_cache and cache_updates:
+                hash_cache.apply(*cache_updates)
+            if archive_cache and archive_cache_updates:
+                archive_cache.apply(*archive_cache_updates)
+            continue
+
+        for record in payload:
+            if first_time:
+                first_time = False
+                publish.header(record)
+            else:
+                publish.body(record)
+
+    for worker in workers:
+        task_queue.put(None)
+    exited = 0
+    while exited < len(workers):
+        kind, payload = result_queue.get()
+        if kind == 'exit':
+            exited += 1
+            statistics, archive_statistics, telemetry_statistics = payload
+            if hash_cache and statistics:
+                hash_cache.hits += statistics['hits']
+                hash_cache.misses += statistics['misses']
+                hash_cache.bytes_saved += statistics['bytes_saved']
+            if archive_cache and archive_statistics:
+                archive_cache.hits += archive_statistics['hits']
+                archive_cache.misses += archive_statistics['misses']
+                archive_cache.members_replayed += archive_statistics['members_replayed']
+                archive_cache.bytes_saved += archive_statistics['bytes_saved']
+            if telemetry and telemetry_statistics:
+                telemetry.merge(telemetry_statistics)
+    for worker in workers:
+        worker.join()
+
+    publish.footer()
+
+
+def find_duplicates_loop(args, publish):
+    finder = DuplicateFinder(volume=args['volume'], verbose=args['verbose'])
+    for base_path in args['base_paths']:
+        crawler = Crawler(
+                        base_path=base_path,
+                        volume=args['volume'],
+                        verbose=args['verbose'],
+                        hash=False,
+                        walker=args['walker'],
+                        exclude=args['exclude'],
+                        prune=args['prune'],
+                        one_file_system=args['one_file_system']
+                    )
+        for record in crawler:
+            finder.add(record['full_path'], record['size'], st=crawler.last_stat)
+
+    first_time = True
+    for record in finder:
+        if first_time:
+            first_time = False
+            publish.header(record)
+        else:
+            publish.body(record)
+
+    publish.footer()
+
+    statistics = finder.statistics()
+    print(
+        f"Duplicates: {statistics['duplicate_groups']} groups, {statistics['duplicate_files']} files, "
+        f"{statistics['bytes_reclaimable']} bytes reclaimable, "
+        f"{statistics['bytes_read']} of {statistics['bytes_total']} bytes read",
+        file=sys.stderr
+    )
+
+
+def open_output(parser, args, mode='w'):
+    """
+    The output_fd for Publish from --output_file and --output_format.
+    """
+    if args['output_format'] == 'sqlite':
+        if not isinstance(args['output_file'], str):
+            parser.error('--output_format sqlite needs --output_file')
+        return args['output_file']
+    if isinstance(args['output_file'], str):
+        if args['output_format'] == 'csv':
+            return open(args['output_file'], mode=mode, newline='')
+        return open(args['output_file'], mode=mode)
+    return args['output_file']
+
+
+MERGE_MEMORY = 256 * 1024 * 1024
+MERGE_FAN_IN = 64
+# rough memory used by a sort item besides its strings
+MERGE_ITEM_OVERHEAD = 200
+MERGE_REPORTS = ['duplicates', 'unique', 'volumes', ]
+
+class ExternalSort():
+    """
+    Sorts more tuples than fit in memory.
+
+    Items are kept in memory until their estimated size reaches max_memory, then sorted and
+    written to a run file in directory (default: the system temp directory).  sorted() merges
+    the runs, MERGE_FAN_IN files at a time, so memory use stays bounded however many items
+    there are.  Items are written with marshal, so they must be tuples of str, int and the like.
+    """
+    def __init__(self, max_memory=MERGE_MEMORY, directory=None):
+        self.max_memory = max_memory
+        self.directory = directory
+        self.items = []
+        self.memory = 0
+        self.runs = []
+        self.count = 0
+        self.spilled = 0
+
+    def add(self, item, size):
+        self.items.append(item)
+        self.memory += size
+        self.count += 1
+        if self.memory >= self.max_memory:
+            self.spill()
+
+    def spill(self):
+        self.items.sort()
+        self.runs.append(self.write_run(self.items))
+        self.spilled += 1
+        self.items = []
+        self.memory = 0
+
+    def write_run(self, items):
+        fd, path = tempfile.mkstemp(prefix='file_system_searcher_', suffix='.run', dir=self.directory)
+        with open(fd, 'wb', buffering=PUBLISH_BUFFER_SIZE) as run:
+            for item in items:
+                marshal.dump(item, run)
+        return path
+
+    @staticmethod
+    def read_run(path):
+        with open(path, 'rb', buffering=PUBLISH_BUFFER_SIZE) as run:
+            while True:
+                try:
+                    yield marshal.load(run)
+                except EOFError:
+                    return
+
+    def sorted(self):
+        """
+        Yield every item added, in sorted order.
+        """
+        if not self.runs:
+            self.items.sort()
+            yield from self.items
+            return
+        if self.items:
+            self.spill()
+        while len(self.runs) > MERGE_FAN_IN:
+            # merge the oldest runs into one until all runs can be open at once
+            runs = self.runs[:MERGE_FAN_IN]
+            self.runs = self.runs[MERGE_FAN_IN:]
+            self.runs.append(self.write_run(heapq.merge(*[self.read_run(run) for run in runs])))
+            for run in runs:
+                os.remove(run)
+        yield from heapq.merge(*[self.read_run(run) for run in self.runs])
+
+    def close(self):
+        for run in self.runs:
+            try:
+                os.remove(run)
+            except FileNotFoundError:
+                pass
+        self.runs = []
+        self.items = []
+
+
+class InventoryMerge():
+    """
+    Compares file contents across many inventories, e.g. one per USB drive searched with
+    --volume, using an ExternalSort on (dropbox_hash, size) so memory use stays within
+    max_memory however many records there are.
+
+    A record's volume is its 'volume' field, or the inventory's file name when it has none.
+    Records without a dropbox_hash, e.g. empty files or inventories made with --no_hash, can't
+    be compared and are only counted.
+    """
+    def __init__(self, max_memory=MERGE_MEMORY, directory=None):
+        self.sort = ExternalSort(max_memory=max_memory, directory=directory)
+        self.volumes = []
+        self.volume_index = {}
+        self.totals = []
+        self.records = 0
+        self.groups = 0
+        self.cross_volume_groups = 0
+        self.unique_files = 0
+
+    def volume(self, name):
+        if name not in self.volume_index:
+            self.volume_index[name] = len(self.volumes)
+            self.volumes.append(name)
+            self.totals.append({
+                'volume': name, 'files': 0, 'bytes': 0, 'shared_files': 0, 'shared_bytes': 0,
+                'unique_files': 0, 'unique_bytes': 0, 'unhashed_files': 0,
+            })
+        return self.volume_index[name]
+
+    def add_inventory(self, inventory_file):
+        default_volume = os.path.basename(inventory_file)
+        for record in read_inventory(inventory_file):
+            self.records += 1
+            index = self.volume(record.get('volume') or default_volume)
+            digest = record.get('dropbox_hash')
+            size = int(record.get('size') or 0)
+            full_path = record.get('full_path') or ''
+            totals = self.totals[index]
+            totals['files'] += 1
+            totals['bytes'] += size
+            if not digest:
+                totals['unhashed_files'] += 1
+                continue
+            self.sort.add((digest, size, index, full_path, ), len(digest) + len(full_path) + MERGE_ITEM_OVERHEAD)
+
+    def groups_by_content(self):
+        """
+        Yield (dropbox_hash, size, [(volume index, full_path), ...]) for each distinct content,
+        updating the per volume totals.
+        """
+        key = None
+        group = []
+        for digest, size, index, full_path in self.sort.sorted():
+            if (digest, size, ) != key:
+                if group:
+                    yield self.count_group(key, group)
+                key = (digest, size, )
+                group = []
+            group.append((index, full_path, ))
+        if group:
+            yield self.count_group(key, group)
+
+    def count_group(self, key, group):
+        digest, size = key
+        shared = len({index for index, full_path in group}) > 1
+        self.groups += 1
+        if shared:
+            self.cross_volume_groups += 1
+        else:
+            self.unique_files += len(group)
+        for index, full_path in group:
+            totals = self.totals[index]
+            if shared:
+                totals['shared_files'] += 1
+                totals['shared_bytes'] += size
+            else:
+                totals['unique_files'] += 1
+                totals['unique_bytes'] += size
+        return digest, size, group
+
+    def report(self, kind):
+        """
+        Yield output records.  'duplicates': one record per file whose contents are on more
+        than one volume.  'unique': one record per file whose contents are only on its own
+        volume.  'volumes': per volume totals of files and bytes that are also on another
+        volume (shared) or only on that volume (unique).
+        """
+        for digest, size, group in self.groups_by_content():
+            volumes = len({index for index, full_path in group})
+            if kind == 'duplicates' and volumes > 1:
+                for index, full_path in group:
+                    yield {
+                        'dropbox_hash': digest, 'size': size, 'volumes': volumes, 'copies': len(group),
+                        'volume': self.volumes[index], 'full_path': full_path,
+                    }
+            elif kind == 'unique' and volumes == 1:
+                for index, full_path in group:
+                    yield {
+                        'dropbox_hash': digest, 'size': size, 'copies': len(group),
+                        'volume': self.volumes[index], 'full_path': full_path,
+                    }
+        if kind == 'volumes':
+            yield from self.totals
+
+    def statistics(self):
+        return {
+            'records': self.records,
+            'volumes': len(self.volumes),
+            'runs': self.sort.spilled,
+            'groups': self.groups,
+            'cross_volume_groups': self.cross_volume_groups,
+            'unique_files': self.unique_files,
+        }
+
+    def close(self):
+        self.sort.close()
+
+
+def merge_main(argv):
+    """
+    The 'merge' sub-command, see InventoryMerge.
+    """
+    parser = ArgumentParser(
+            prog="file_system_searcher.py merge",
+            description="Find file contents shared across inventories, e.g. one per USB drive."
+        )
+    parser.add_argument(
+            "inventories",
+            nargs='+',
+            metavar="inventory",
+            help="json, jsonl, csv, txt or sqlite output file written by file_system_searcher."
+        )
+    parser.add_argument("--output_file", help="Output file name.", default=sys.stdout)
+    parser.add_argument("--output_format", help="Output format", choices=OUTPUT_FORMATS, default="json")
+    parser.add_argument(
+            "--report",
+            help="""duplicates: files whose contents are on more than one volume.  unique: files whose
+            contents are only on one volume.  volumes: per volume totals. Default: duplicates""",
+            choices=MERGE_REPORTS,
+            default='duplicates'
+        )
+    parser.add_argument(
+            "--merge_memory",
+            help=f"Bytes of records sorted in memory before spilling to disk. Default: {MERGE_MEMORY}",
+            type=int,
+            default=MERGE_MEMORY
+        )
+    parser.add_argument(
+            "--spill_directory",
+            help="Directory for sorted runs spilled to disk. Default: system temp directory",
+            default=None
+        )
+    args = vars(parser.parse_args(argv))
+
+    publish = Publish(args['output_format'], open_output(parser, args))
+    merge = InventoryMerge(max_memory=args['merge_memory'], directory=args['spill_directory'])
+    try:
+        for inventory_file in args['inventories']:
+            merge.add_inventory(inventory_file)
+
+        first_time = True
+        for record in merge.report(args['report']):
+            if first_time:
+                first_time = False
+                publish.header(record)
+            else:
+                publish.body(record)
+        publish.footer()
+    finally:
+        merge.close()
+    publish.close()
 
-        return record
+    statistics = merge.statistics()
+    print(
+        f"Merge: {statistics['records']} records on {statistics['volumes']} volumes, "
+        f"{statistics['cross_volume_groups']} of {statistics['groups']} contents on more than one volume, "
+        f"{statistics['unique_files']} files on one volume only, {statistics['runs']} sorted runs",
+        file=sys.stderr
+    )
 
-    def get_suffix(self, file_name):
-        if "." not in file_name:
-            return None
-        parts = file_name.split('.')
-        if len(parts[-1]) > 15:
-            return None
-        return parts[-1]
 
-    def get_file_name(self, name):
-        name = str(name)
-        if "/" not in name:
-            return name
-        parts = name.split('/')
-        return parts[-1]
+SEARCH_INDEX_BATCH = 10000
+SEARCH_INDEX_MMAP_SIZE = 1024 * 1024 * 1024
+SEARCH_INDEX_COLUMNS = (
+    'volume', 'hostname', 'full_path', 'file_name', 'relative_path', 'size', 'modified', 'suffix',
+    'dropbox_hash',
+)
 
-class TarCrawler():
-    def __init__(self, tar_file_path, volume, verbose=False, hash=True):
-        self.file = tar_file_path
-        self.current_working_directory = Path.cwd()
-        self.volume = volume
-        self.verbose = verbose
-        self.hostname = socket.gethostname()
-        self.base_path = tar_file_path
-        self.stop_iterator = False
-        self.hash = hash
+class SearchIndex():
+    """
+    SQLite file name index over the records of any number of searches and volumes.
 
-    def __iter__(self):
-        try:
-            # open archive and prepare to iterate
-            self.tar = tarfile.open(self.base_path)
-            self.tar_iter = iter(self.tar)
+    file_name and relative_path are indexed by an FTS5 trigram table, so substring and glob
+    queries don't scan every name, and size, modified and suffix by ordinary indexes.  Where
+    SQLite lacks the FTS5 trigram tokenizer, names are scanned instead.  The database is read
+    through mmap, so a search starts fast from a cold process.
 
-        except:
-            # Zip file is damaged and/or otherwise unreadable.
-            self.stop_iterator = True
-            if self.verbose:
-                e = sys.exc_info()[0]
-                print(f"\n__iter__(): Exception: {e}", file=sys.stderr)
-                print(f"Tar Archive File Name: {self.file}", file=sys.stderr)
+    Entries are keyed on (volume, full_path).  Searching a base path again updates its
+    entries, and finish() removes the ones that weren't seen, i.e. files deleted since.
+    """
+    def __init__(self, path, mmap_size=SEARCH_INDEX_MMAP_SIZE):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                volume TEXT NOT NULL,
+                hostname TEXT,
+                full_path TEXT NOT NULL,
+                file_name TEXT,
+                relative_path TEXT,
+                size INTEGER,
+                modified TEXT,
+                suffix TEXT,
+                dropbox_hash TEXT,
+                seen INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (volume, full_path)
+            )
+        """)
+        for column in ('size', 'modified', 'suffix', ):
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS files_{column} ON files ({column})")
+        self.trigrams = self.create_trigrams()
+        self.db.commit()
+        # entries seen during this run are marked with the run number
+        self.run = self.db.execute("SELECT COALESCE(MAX(seen), 0) FROM files").fetchone()[0] + 1
+        self.batch = []
+        self.deleted = []
 
-        return self
-    
-    def __next__(self):
-        if self.stop_iterator:
-            raise StopIteration()
+    def create_trigrams(self):
         try:
-            # name is really a path within the archive
-            tarinfo = self.tar_iter.__next__()
-
-            # skip directories
-            while not tarinfo.isfile():
-                tarinfo = self.tar_iter.__next__()
-            
-            file_name = self.get_file_name(tarinfo.name)
+            self.db.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(
+                    file_name, relative_path, content='files', content_rowid='id', tokenize='trigram'
+                )
+            """)
+        except sqlite3.OperationalError:
+            # no FTS5 or an SQLite older than 3.34
+            return False
+        # keep the trigrams in step with files, size and seen updates leave them alone
+        self.db.execute("""
+            CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+                INSERT INTO names (rowid, file_name, relative_path)
+                VALUES (new.id, new.file_name, new.relative_path);
+            END
+        """)
+        self.db.execute("""
+            CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+                INSERT INTO names (names, rowid, file_name, relative_path)
+                VALUES ('delete', old.id, old.file_name, old.relative_path);
+            END
+        """)
+        self.db.execute("""
+            CREATE TRIGGER IF NOT EXISTS files_update AFTER UPDATE OF file_name, relative_path ON files BEGIN
+                INSERT INTO names (names, rowid, file_name, relative_path)
+                VALUES ('delete', old.id, old.file_name, old.relative_path);
+                INSERT INTO names (rowid, file_name, relative_path)
+                VALUES (new.id, new.file_name, new.relative_path);
+            END
+        """)
+        return True
 
-            try:
-                utc_dt = (convert_datetime_to_utc(datetime.fromtimestamp(tarinfo.mtime))).isoformat()
-            except ValueError as e:
-                # some tar file date records may have out-of-bound values
-                # these should show up as 0001-01-01
-                utc_dt = (convert_datetime_to_utc(datetime(MINYEAR, 1, 1))).isoformat()
-            except:
-                e = sys.exc_info()[0]
-                print(f"\n__next(): Exception: {e}", file=sys.stderr)
-                print(f"Tar Archive File Name: {self.file}", file=sys.stderr)
-                print("tarinfo.mtime:", tarinfo.mtime, file=sys.stderr)
-               
+    def index_publish(self, publish):
+        """
+        Add every record published through publish to the index.
+        """
+        def indexed(function):
+            def wrapper(record):
+                self.add(record)
+                return function(record)
+            return wrapper
 
-            full_path = self.file + os.path.sep + file_name
-            if os.path.sep == "\\":
-                full_path = full_path.replace('/', "\\")
-            record = {
-                    'hostname': self.hostname,
-                    'volume': self.volume,
-                    'file_name': file_name,
-                    'relative_path': file_name,
-                    'full_path': full_path,
-                    'size': tarinfo.size,
-                    'dropbox_hash': '',
-                    'created': utc_dt,
-                    'modified': utc_dt,
-                    'suffix': self.get_suffix(file_name),
-                    'mime_type': None,
-                    'mime_encoding': None,
-                    'is_archive': True,
-                }
+        publish.header = indexed(publish.header)
+        publish.body = indexed(publish.body)
 
-            record['mime_type'], record['mime_encoding'] = mimetypes.guess_type(file_name, strict=False)
+    def add(self, record):
+        """
+        Add or update the entry for an output record, a record tagged 'deleted' removes it.
+        """
+        volume = record.get('volume') or ''
+        if record.get('change') == 'deleted':
+            self.deleted.append((volume, record.get('full_path'), ))
+        else:
+            self.batch.append(
+                (volume, ) + tuple(
+                    self.index_suffix(record.get(k)) if k == 'suffix' else record.get(k)
+                    for k in SEARCH_INDEX_COLUMNS[1:]
+                ) + (self.run, )
+            )
+        if len(self.batch) + len(self.deleted) >= SEARCH_INDEX_BATCH:
+            self.write()
 
-            if self.verbose:
-                print(f"{record['full_path']}, {record['size']}, {record['is_archive']}", file=sys.stderr)
+    @staticmethod
+    def index_suffix(suffix):
+        """
+        suffix with its leading dot, archive members' suffixes come without one or as None.
+        """
+        if not suffix:
+            return ''
+        return suffix if suffix.startswith('.') else '.' + suffix
 
-            if hash and record['size'] > 0:
-                record['dropbox_hash'] = tar_dropbox_hash(self.tar, tarinfo, self.file, tarinfo.name, verbose=self.verbose)
+    def write(self):
+        # INSERT ... ON CONFLICT DO UPDATE needs SQLite 3.24, update existing entries first
+        # and then insert the new ones
+        updated = [k for k in SEARCH_INDEX_COLUMNS if k not in ('volume', 'full_path', )] + ['seen', ]
+        with self.db:
+            self.db.executemany(
+                "UPDATE files SET " + ", ".join(f"{k} = :{k}" for k in updated) +
+                " WHERE volume = :volume AND full_path = :full_path",
+                (dict(zip(SEARCH_INDEX_COLUMNS + ('seen', ), row)) for row in self.batch)
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO files (" + ", ".join(SEARCH_INDEX_COLUMNS) + ", seen) VALUES (" +
+                ", ".join("?" for k in SEARCH_INDEX_COLUMNS) + ", ?)",
+                self.batch
+            )
+            self.db.executemany("DELETE FROM files WHERE volume = ? AND full_path = ?", self.deleted)
+        self.batch = []
+        self.deleted = []
 
-        except StopIteration:
-            raise StopIteration()
-        except:
-            if self.verbose:
-                e = sys.exc_info()[0]
-                print(f"\n__next__() {e}", file=sys.stderr)
-                print(f"TarCrawler.__next__(): tar_file: {self.base_path}\n", file=sys.stderr)
-            raise StopIteration()
+    def finish(self, volume, base_paths):
+        """
+        Remove the entries of volume under base_paths that weren't seen during this run.
+        Only valid after a complete search of base_paths, not an incremental one.
+        """
+        self.write()
+        with self.db:
+            for base_path in base_paths:
+                prefix = os.path.join(str(base_path), '')
+                self.db.execute(
+                    "DELETE FROM files WHERE volume = ? AND seen != ? AND substr(full_path, 1, ?) = ?",
+                    (volume or '', self.run, len(prefix), prefix, )
+                )
 
-        return record
+    @staticmethod
+    def literal(pattern, glob=False):
+        """
+        Longest run of pattern the trigram index can look up with LIKE '%run%'.  Text is taken
+        literally, a glob's wildcards and [...] classes end runs.  Runs never hold LIKE's own
+        % and _ wildcards.
+        """
+        if glob:
+            pattern = re.sub(r'\[[^\]]*\]', '*', pattern)
+        return max(re.split('[*?%_]' if glob else '[%_]', pattern), key=len)
 
-    def get_suffix(self, file_name):
-        if "." not in file_name:
-            return None
-        parts = file_name.split('.')
-        if len(parts[-1]) > 15:
-            return None
-        return parts[-1]
+    def search(self, text=None, glob=None, in_path=False, min_size=None, max_size=None,
+                modified_after=None, modified_before=None, suffix=None, volume=None, limit=None):
+        """
+        Yield the matching entries as dicts.  text is a case insensitive substring and glob a
+        case sensitive pattern of the file_name, or of the relative_path with in_path.
+        modified_after and modified_before are ISO dates or timestamps, compared as UTC.
+        """
+        column = 'relative_path' if in_path else 'file_name'
+        conditions = []
+        parameters = []
+        for pattern, literal, condition in (
+                (text, text and self.literal(text), f"instr(lower(f.{column}), lower(?)) > 0"),
+                (glob, glob and self.literal(glob, glob=True), f"f.{column} GLOB ?"),
+            ):
+            if not pattern:
+                continue
+            if self.trigrams and len(literal) >= 3:
+                conditions.append(f"f.id IN (SELECT rowid FROM names WHERE names.{column} LIKE ?)")
+                parameters.append('%' + literal + '%')
+            conditions.append(condition)
+            parameters.append(pattern)
+        for value, condition in (
+                (min_size, "f.size >= ?"),
+                (max_size, "f.size <= ?"),
+                (modified_after, "f.modified >= ?"),
+                (modified_before, "f.modified < ?"),
+                (suffix, "f.suffix = ?"),
+                (volume, "f.volume = ?"),
+            ):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
 
-    def get_file_name(self, name):
-        name = str(name)
-        if "/" not in name:
-            return name
-        parts = name.split('/')
-        return parts[-1]
+        query = "SELECT " + ", ".join(f"f.{k}" for k in SEARCH_INDEX_COLUMNS) + " FROM files AS f"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        for row in self.db.execute(query, parameters):
+            yield dict(zip(SEARCH_INDEX_COLUMNS, row))
 
+    def close(self):
+        self.write()
+        self.db.commit()
+        self.db.close()
 
-def main_loop(args, publish):
 
-    first_time = True
-    for base_path in args['base_paths']:
-        crawler = Crawler(
-                        base_path=base_path,
-                        volume=args['volume'],
-                        verbose=args['verbose'],
-                        hash=(not args['no_hash']),
-                        search_archives=args['search_archives']
-                    )
+def search_main(argv):
+    """
+    The 'search' sub-command, queries a SearchIndex.
+    """
+    parser = ArgumentParser(
+            prog="file_system_searcher.py search",
+            description="Find files in a --search_index without searching the file system."
+        )
+    parser.add_argument("search_index", help="Index file built with --search_index.")
+    parser.add_argument(
+            "text",
+            nargs='?',
+            default=None,
+            help="Case insensitive text the file name contains."
+        )
+    parser.add_argument("--glob", help="Case sensitive glob pattern the file name matches, e.g. 'IMG_*.jpg'.", default=None)
+    parser.add_argument(
+            "--in_path",
+            help="Match text and --glob against the path relative to the base path instead of the file name.",
+            default=False,
+            action='store_true'
+        )
+    parser.add_argument("--min_size", help="Smallest size in bytes.", type=int, default=None)
+    parser.add_argument("--max_size", help="Largest size in bytes.", type=int, default=None)
+    parser.add_argument(
+            "--modified_after",
+            help="Modified at or after this ISO date or timestamp (UTC), e.g. 2021-06-01.",
+            default=None
+        )
+    parser.add_argument(
+            "--modified_before",
+            help="Modified before this ISO date or timestamp (UTC).",
+            default=None
+        )
+    parser.add_argument("--suffix", help="File name suffix, e.g. .jpg", default=None)
+    parser.add_argument("--volume", help="Only files on this volume.", default=None)
+    parser.add_argument("--limit", help="Most results output.", type=int, default=None)
+    parser.add_argument("--output_file", help="Output file name.", default=sys.stdout)
+    parser.add_argument("--output_format", help="Output format", choices=OUTPUT_FORMATS, default="json")
+    args = vars(parser.parse_args(argv))
 
-        for record in crawler:
-            if first_time:
-                first_time = False
-                publish.header(record)
-            else:
-                publish.body(record)
+    if not os.path.exists(args['search_index']):
+        parser.error(f"no search index {args['search_index']}")
+    suffix = SearchIndex.index_suffix(args['suffix']) or None
 
+    start = time.perf_counter()
+    search_index = SearchIndex(args['search_index'])
+    publish = Publish(args['output_format'], open_output(parser, args))
+    count = 0
+    for record in search_index.search(
+            text=args['text'], glob=args['glob'], in_path=args['in_path'],
+            min_size=args['min_size'], max_size=args['max_size'],
+            modified_after=args['modified_after'], modified_before=args['modified_before'],
+            suffix=suffix, volume=args['volume'], limit=args['limit']
+        ):
+        if count == 0:
+            publish.header(record)
+        else:
+            publish.body(record)
+        count += 1
     publish.footer()
+    publish.close()
+    search_index.close()
+    print(f"Search: {count} files in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        # a base path named merge can be given as ./merge
+        merge_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'search':
+        search_main(sys.argv[2:])
+        return
+
     parser = ArgumentParser(
             description="File System Searcher - Search for files and output records with useful info."
         )
@@ -618,7 +4708,7 @@ def main():
     parser.add_argument(
             "--output_format",
             help="Output format",
-            choices=["txt", "csv", "json", ],
+            choices=OUTPUT_FORMATS,
             default="json"
         )
     parser.add_argument(
@@ -633,21 +4723,423 @@ def main():
             default=False,
             action='store_true'
         )
+    parser.add_argument(
+            "--fields",
+            help=f"""Comma separated list of fields to output.  Fields that aren't output aren't computed,
+            e.g. files aren't read when dropbox_hash isn't listed.  Default: all fields
+            ({','.join(FILE_RECORD_KEYS)}).  Also: {','.join(OPTIONAL_RECORD_KEYS)}""",
+            type=lambda value: [field.strip() for field in value.split(',') if field.strip()],
+            default=None
+        )
+    parser.add_argument(
+            "--exclude",
+            help="""Skip files and directories matching this glob, or regular expression when prefixed
+            with 're:'.  Globs without a '/' match names, others match whole paths.  Repeatable.
+            Implies --walker scandir.""",
+            action='append',
+            default=None
+        )
+    parser.add_argument(
+            "--prune",
+            help="""Don't descend into directories matching this glob, or regular expression when
+            prefixed with 're:'.  Repeatable.  Implies --walker scandir.""",
+            action='append',
+            default=None
+        )
+    parser.add_argument(
+            "--one_file_system",
+            help="Don't descend into directories on other file systems than the base path. Implies --walker scandir.",
+            default=False,
+            action='store_true'
+        )
+    parser.add_argument(
+            "--walker",
+            help="""Directory walk engine.  'scandir' uses os.scandir() and stats each file once.
+            'glob' is the original pathlib.Path.glob('**/*') engine.""",
+            choices=WALKERS,
+            default="glob"
+        )
+    parser.add_argument(
+            "--hash_workers",
+            help="""Number of threads computing dropbox_hash values while the directory walk continues.
+            Default: 0, hash each file inline.""",
+            type=int,
+            default=0
+        )
+    parser.add_argument(
+            "--unordered",
+            help="With --hash_workers, output records as soon as their hash completes instead of in discovery order.",
+            default=False,
+            action='store_true'
+        )
+    parser.add_argument(
+            "--hash_queue_files",
+            help=f"With --hash_workers, maximum number of files waiting to be hashed. Default: {HASH_QUEUE_FILES}",
+            type=int,
+            default=HASH_QUEUE_FILES
+        )
+    parser.add_argument(
+            "--hash_queue_bytes",
+            help=f"With --hash_workers, maximum total size of files waiting to be hashed. Default: {HASH_QUEUE_BYTES}",
+            type=int,
+            default=HASH_QUEUE_BYTES
+        )
+    parser.add_argument(
+            "--block_workers",
+            help="""Number of threads hashing the blocks of a single large file concurrently.
+            Default: 0, large files are hashed sequentially.""",
+            type=int,
+            default=0
+        )
+    parser.add_argument(
+            "--archive_depth",
+            help=f"""With --search_archives, archive nesting levels searched, e.g. 2 also searches zip and
+            tar archives found inside archives.  Default: {ARCHIVE_DEPTH}""",
+            type=int,
+            default=ARCHIVE_DEPTH
+        )
+    parser.add_argument(
+            "--archive_spool_memory",
+            help=f"""With --archive_depth, total memory in bytes for copies of inner archives.
+            Default: {ARCHIVE_SPOOL_MEMORY}""",
+            type=int,
+            default=ARCHIVE_SPOOL_MEMORY
+        )
+    parser.add_argument(
+            "--archive_spool_disk",
+            help=f"""With --archive_depth, total temporary disk space in bytes for copies of inner archives
+            that don't fit in memory. Default: {ARCHIVE_SPOOL_DISK}""",
+            type=int,
+            default=ARCHIVE_SPOOL_DISK
+        )
+    parser.add_argument(
+            "--archive_workers",
+            help="""With --search_archives, number of threads hashing zip archive members concurrently.
+            Default: 0, zip archive members are hashed sequentially.""",
+            type=int,
+            default=0
+        )
+    parser.add_argument(
+            "--large_file_threshold",
+            help=f"With --block_workers, minimum file size in bytes for parallel block hashing. Default: {LARGE_FILE_THRESHOLD}",
+            type=int,
+            default=LARGE_FILE_THRESHOLD
+        )
+    parser.add_argument(
+            "--hash_timeout",
+            help="""Seconds one file may take to hash.  Files taking longer get an empty dropbox_hash
+            and a hash_status of 'timeout'.  Default: unlimited""",
+            type=float,
+            default=None
+        )
+    parser.add_argument(
+            "--hash_max_bytes",
+            help="""Largest file size in bytes that is hashed.  Larger files get an empty dropbox_hash
+            and a hash_status of 'skipped'.  Default: unlimited""",
+            type=int,
+            default=None
+        )
+    parser.add_argument(
+            "--hash_cache",
+            help="""SQLite file caching dropbox_hash values between runs.  Files with unchanged
+            device, inode, size and modification time are not read again.""",
+            default=None
+        )
+    parser.add_argument(
+            "--hash_cache_size",
+            help="Maximum number of --hash_cache entries.  Least recently used entries are evicted. Default: unlimited",
+            type=int,
+            default=None
+        )
+    parser.add_argument(
+            "--hash_cache_clear",
+            help="Remove all --hash_cache entries before searching.",
+            default=False,
+            action='store_true'
+        )
+    parser.add_argument(
+            "--hash_cache_compact",
+            help="Evict and vacuum the --hash_cache file after searching.",
+            default=False,
+            action='store_true'
+        )
+    parser.add_argument(
+            "--archive_cache",
+            help="""SQLite file caching the member records of archives between runs.  With
+            --search_archives, archives with unchanged device, inode, size and modification time
+            are not opened again.""",
+            default=None
+        )
+    parser.add_argument(
+            "--archive_cache_size",
+            help="""Maximum number of member records in --archive_cache.  Least recently used archives
+            are evicted. Default: unlimited""",
+            type=int,
+            default=None
+        )
+    parser.add_argument(
+            "--since",
+            help="""Previous json, csv or txt output file.  Only output records for files added,
+            modified or deleted since then, tagged in the 'change' field.""",
+            default=None
+        )
+    parser.add_argument(
+            "--manifest",
+            help="""SQLite manifest file maintained by this program.  Only output records for files
+            added, modified or deleted since the last run with the same manifest.""",
+            default=None
+        )
+    parser.add_argument(
+            "--mmap",
+            help="Read files through mmap when computing dropbox_hash values.",
+            default=False,
+            action='store_true'
+        )
+    parser.add_argument(
+            "--io_order",
+            help="""Order in which files are read for hashing.  'discovery' reads files in the order
+            they are found.  'inode' and 'extent' sort each --io_window of files by inode number
+            or by physical location on disk (Linux FIEMAP, falls back to inode) to reduce seeking
+            on spinning and USB disks.""",
+            choices=IO_ORDERS,
+            default='discovery'
+        )
+    parser.add_argument(
+            "--io_window",
+            help=f"With --io_order inode or extent, number of files sorted at a time. Default: {IO_WINDOW}",
+            type=int,
+            default=IO_WINDOW
+        )
+    parser.add_argument(
+            "--fadvise",
+            help="""Tell the operating system files are read sequentially and dropped from the page
+            cache once hashed (posix_fadvise), so a crawl doesn't flush the page cache.""",
+            default=False,
+            action='store_true'
+        )
+    parser.add_argument(
+            "--workers",
+            help="""Number of worker processes crawling directory subtrees in parallel.  Implies
+            --walker scandir.  Default: 0, crawl in this process.""",
+            type=int,
+            default=0
+        )
+    parser.add_argument(
+            "--async_concurrency",
+            help=f"""Search with an asyncio AsyncCrawler keeping up to this many directory listings,
+            stats and hash reads in flight, for NFS and SMB mounts where each is a network round
+            trip.  Implies --walker scandir.  e.g. {ASYNC_CONCURRENCY}.  Default: 0, off.""",
+            type=int,
+            default=0
+        )
+    parser.add_argument(
+            "--checkpoint",
+            help="""JSON file where crawl progress is saved every --checkpoint_interval seconds.  Needs
+            --output_file.  Implies --walker scandir.  Removed when the search finishes.""",
+            default=None
+        )
+    parser.add_argument(
+            "--checkpoint_interval",
+            help=f"Seconds between --checkpoint saves. Default: {CHECKPOINT_INTERVAL}",
+            type=float,
+            default=CHECKPOINT_INTERVAL
+        )
+    parser.add_argument(
+            "--resume",
+            help="""Continue an interrupted search from its --checkpoint, appending to the same
+            --output_file.  Use the same options as the interrupted search.""",
+            default=False,
+            action='store_true'
+        )
+    parser.add_argument(
+            "--watch",
+            help="""Linux only.  After searching, keep running and watch the base paths with inotify.
+            Changed files are re-hashed and output tagged 'added' or 'modified', removed files are
+            output tagged 'deleted'.  Stop with Ctrl-C or SIGTERM.  Implies --walker scandir.""",
+            default=False,
+            action='store_true'
+        )
+    parser.add_argument(
+            "--watch_delay",
+            help=f"""Seconds without inotify events before a burst of changes is processed.
+            Default: {WATCH_DELAY}""",
+            type=float,
+            default=WATCH_DELAY
+        )
+    parser.add_argument(
+            "--watch_rescan_interval",
+            help=f"""Seconds between rescans of directories that can't be watched, e.g. once the
+            inotify watch limit is reached. Default: {WATCH_RESCAN_INTERVAL}""",
+            type=float,
+            default=WATCH_RESCAN_INTERVAL
+        )
+    parser.add_argument(
+            "--search_index",
+            help="""SQLite file name index to add the output records to, for the search sub-command.
+            Searching a base path again updates its entries.""",
+            default=None
+        )
+    parser.add_argument(
+            "--progress",
+            help="""Print a progress line - files, directories, bytes hashed and errors - to
+            stderr every --progress_interval seconds.""",
+            default=False,
+            action='store_true'
+        )
+    parser.add_argument(
+            "--progress_interval",
+            help=f"Seconds between --progress lines. Default: {PROGRESS_INTERVAL}",
+            type=float,
+            default=PROGRESS_INTERVAL
+        )
+    parser.add_argument(
+            "--stats",
+            help="""Print per stage times, throughput and error counts to stderr as JSON when
+            the search finishes.  With --stats or --progress, signal SIGUSR1 prints the same
+            JSON at any time.""",
+            default=False,
+            action='store_true'
+        )
+    parser.add_argument(
+            "--find_duplicates",
+            help="""Output groups of files with the same contents instead of every file.
+            Files are grouped by size, then by a first/last block fingerprint and only then
+            by dropbox_hash, so most files are never read.""",
+            default=False,
+            action='store_true'
+        )
     args = vars(parser.parse_args())
 
-    if isinstance(args['output_file'], str):
-        if args['output_format'] == 'csv':
-            output_fd = open(args['output_file'], mode='w', newline='')
-        else:
-            output_fd = open(args['output_file'], mode='w')
+    try:
+        check_fields(args['fields'])
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        PathFilter(args['exclude'], args['prune'])
+    except re.error as e:
+        parser.error(f"Not a valid --exclude or --prune regular expression: {e}")
+
+    if args['workers'] > 0 and (args['since'] or args['manifest'] or args['find_duplicates']):
+        parser.error('--workers can not be combined with --since, --manifest or --find_duplicates')
+
+    if args['async_concurrency'] > 0 and (
+            args['workers'] > 0 or args['hash_workers'] > 0 or args['io_order'] != 'discovery'
+            or args['find_duplicates'] or args['watch'] or args['checkpoint']
+        ):
+        parser.error(
+            '--async_concurrency can not be combined with --workers, --hash_workers, --io_order, '
+            '--find_duplicates, --watch or --checkpoint'
+        )
+
+    if args['search_index'] and args['find_duplicates']:
+        parser.error('--search_index can not be combined with --find_duplicates')
+    if args['watch'] and (args['workers'] > 0 or args['since'] or args['find_duplicates'] or args['checkpoint']):
+        parser.error('--watch can not be combined with --workers, --since, --find_duplicates or --checkpoint')
+
+    checkpoint = None
+    state = None
+    if args['resume'] and not args['checkpoint']:
+        parser.error('--resume needs --checkpoint')
+    if args['checkpoint']:
+        if not isinstance(args['output_file'], str):
+            parser.error('--checkpoint needs --output_file')
+        if args['workers'] > 0 or args['since'] or args['manifest'] or args['find_duplicates']:
+            parser.error('--checkpoint can not be combined with --workers, --since, --manifest or --find_duplicates')
+        checkpoint = Checkpoint(args['checkpoint'])
+        if args['resume']:
+            state = checkpoint.load()
+            if state is None:
+                parser.error(f"no checkpoint to resume from in {args['checkpoint']}")
+            if state['base_paths'] != args['base_paths'] or state['output_format'] != args['output_format']:
+                parser.error('--resume needs the same base paths and --output_format as the interrupted search')
+
+    # resumed output is continued in place, see Publish.restore()
+    publish = Publish(args['output_format'], open_output(parser, args, mode='r+' if state else 'w'))
+
+    search_index = None
+    if args['search_index']:
+        search_index = SearchIndex(args['search_index'])
+        search_index.index_publish(publish)
+
+    global telemetry
+    if args['stats'] or args['progress']:
+        telemetry = Telemetry()
+        telemetry.instrument_publish(publish)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: telemetry.dump())
+        if args['progress']:
+            telemetry.start_progress(args['progress_interval'])
+
+    hash_cache = None
+    if args['hash_cache']:
+        hash_cache = HashCache(args['hash_cache'], max_entries=args['hash_cache_size'])
+        if args['hash_cache_clear']:
+            hash_cache.clear()
+
+    archive_cache = None
+    if args['archive_cache']:
+        archive_cache = ArchiveCache(args['archive_cache'], max_entries=args['archive_cache_size'])
+
+    manifest = None
+    if args['since'] or args['manifest'] or args['watch']:
+        manifest = Manifest(args['manifest'])
+        if args['since']:
+            manifest.load(args['since'])
+
+    if args['find_duplicates']:
+        find_duplicates_loop(args, publish)
+    elif args['workers'] > 0:
+        parallel_main_loop(args, publish, hash_cache=hash_cache, archive_cache=archive_cache)
+    elif args['watch']:
+        watch_main_loop(args, publish, manifest, hash_cache=hash_cache, archive_cache=archive_cache)
+    elif checkpoint:
+        checkpoint_main_loop(
+            args, publish, checkpoint, state=state, hash_cache=hash_cache, archive_cache=archive_cache
+        )
+    elif args['async_concurrency'] > 0:
+        async_main_loop(args, publish, hash_cache=hash_cache, manifest=manifest, archive_cache=archive_cache)
     else:
-        output_fd = args['output_file']
+        main_loop(args, publish, hash_cache=hash_cache, manifest=manifest, archive_cache=archive_cache)
 
-    publish = Publish(args['output_format'], output_fd)
+    if search_index:
+        if not (manifest or state):
+            # a complete search, anything not seen under the base paths is gone
+            search_index.finish(
+                args['volume'], [Crawler(base_path=base_path).base_path for base_path in args['base_paths']]
+            )
+        search_index.close()
 
-    main_loop(args, publish)
+    if manifest:
+        manifest.close()
 
     publish.close()
 
+    if hash_cache:
+        if args['hash_cache_compact']:
+            hash_cache.compact()
+        statistics = hash_cache.statistics()
+        hash_cache.close()
+        print(
+            f"Hash Cache: {statistics['hits']} hits, {statistics['misses']} misses, "
+            f"{statistics['bytes_saved']} bytes not read",
+            file=sys.stderr
+        )
+
+    if archive_cache:
+        statistics = archive_cache.statistics()
+        archive_cache.close()
+        print(
+            f"Archive Cache: {statistics['hits']} hits, {statistics['misses']} misses, "
+            f"{statistics['members_replayed']} members replayed, "
+            f"{statistics['bytes_saved']} bytes not decompressed",
+            file=sys.stderr
+        )
+
+    if telemetry:
+        telemetry.stop_progress()
+        if args['stats']:
+            telemetry.dump()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
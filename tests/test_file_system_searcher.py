@@ -0,0 +1,734 @@
+# tests/test_file_system_searcher.py
+#
+#   python3 -m pytest tests
+#   python3 -m unittest discover tests
+import os
+import sys
+import json
+import io
+import time
+import asyncio
+import threading
+import tarfile
+import zipfile
+import unittest
+import tempfile
+import pickle
+import random
+from unittest import mock
+from collections.abc import MutableMapping
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import file_system_searcher as fss
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fd:
+        fd.write(data)
+    return path
+
+
+def run_main(*argv):
+    with mock.patch.object(sys, 'argv', ['file_system_searcher.py', ] + list(argv)):
+        fss.main()
+
+
+def read_file(path):
+    with open(path, 'rb') as fd:
+        return fd.read()
+
+
+def jsonl_records(path):
+    with open(path) as fd:
+        return [json.loads(line) for line in fd]
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.base_path = os.path.join(self.directory.name, 'tree')
+        for name in ('keep.txt', 'change.txt', 'd/delete.txt', 'd/keep.txt', ):
+            write_file(os.path.join(self.base_path, name), b'x')
+        self.output_file = os.path.join(self.directory.name, 'output.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def search(self, *argv):
+        run_main(self.base_path, '--output_format', 'jsonl', '--output_file', self.output_file, *argv)
+        return {
+            record['relative_path']: record.get('change') for record in jsonl_records(self.output_file)
+        }
+
+    def change_tree(self):
+        os.remove(os.path.join(self.base_path, 'd', 'delete.txt'))
+        path = write_file(os.path.join(self.base_path, 'change.txt'), b'xy')
+        # a modified timestamp that differs even on coarse file systems
+        os.utime(path, (0, 0))
+        write_file(os.path.join(self.base_path, 'd', 'add.txt'), b'x')
+
+    def test_since(self):
+        inventory = os.path.join(self.directory.name, 'inventory.jsonl')
+        run_main(self.base_path, '--output_format', 'jsonl', '--output_file', inventory)
+        self.change_tree()
+        self.assertEqual(self.search('--since', inventory), {
+            'change.txt': 'modified', 'd/add.txt': 'added', 'd/delete.txt': 'deleted',
+        })
+
+    def test_manifest(self):
+        manifest = os.path.join(self.directory.name, 'manifest.db')
+        self.assertEqual(set(self.search('--manifest', manifest).values()), {'added', })
+        self.change_tree()
+        self.assertEqual(self.search('--manifest', manifest), {
+            'change.txt': 'modified', 'd/add.txt': 'added', 'd/delete.txt': 'deleted',
+        })
+        # the manifest is up to date, nothing changed since
+        self.assertEqual(self.search('--manifest', manifest), {})
+
+    def test_deleted_only_under_base_path(self):
+        manifest = os.path.join(self.directory.name, 'manifest.db')
+        self.search('--manifest', manifest)
+        os.remove(os.path.join(self.base_path, 'keep.txt'))
+        os.remove(os.path.join(self.base_path, 'd', 'delete.txt'))
+        self.base_path = os.path.join(self.base_path, 'd')
+        # keep.txt is outside the base path, deleted records are the ones stored
+        self.assertEqual(self.search('--manifest', manifest), {'d/delete.txt': 'deleted', })
+
+
+class DuplicateFinderTest(unittest.TestCase):
+    def test_bytes_read_counts_each_byte_once(self):
+        size = 4 * fss.FINGERPRINT_BLOCK_SIZE
+        with tempfile.TemporaryDirectory() as directory:
+            finder = fss.DuplicateFinder()
+            for name in ('a', 'b', ):
+                path = write_file(os.path.join(directory, name), b'x' * size)
+                finder.add(path, size, os.stat(path))
+            duplicates = finder.duplicates()
+            statistics = finder.statistics()
+
+        self.assertEqual(len(duplicates), 1)
+        self.assertEqual(statistics['bytes_total'], 2 * size)
+        # fingerprints matched so both files were read completely, but only once
+        self.assertEqual(statistics['bytes_read'], 2 * size)
+
+
+class FileRecordTest(unittest.TestCase):
+    def setUp(self):
+        constants = fss.RecordConstants('host', 'usb1')
+        self.record = fss.FileRecord(
+            constants, 'a.txt', 'd/a.txt', '/base/d/a.txt', 3, 1577836800.0, 1577836800.0, '.txt'
+        )
+        self.record['change'] = 'added'
+
+    def test_is_a_mapping(self):
+        self.assertIsInstance(self.record, MutableMapping)
+        self.assertEqual(len(self.record), len(fss.FILE_RECORD_KEYS) + 1)
+        self.assertEqual(list(self.record), list(fss.FILE_RECORD_KEYS) + ['change', ])
+        self.assertIn('change', self.record)
+        self.assertEqual(self.record.get('modified'), '2020-01-01T00:00:00+00:00')
+        self.assertEqual(self.record, dict(self.record))
+        # values live in slots, not in a dict of their own
+        self.assertLess(sys.getsizeof(self.record), sys.getsizeof(dict(self.record)))
+
+    def test_json_dumps(self):
+        record = json.loads(json.dumps(self.record, default=dict))
+        self.assertEqual(record['volume'], 'usb1')
+        self.assertEqual(record['created'], '2020-01-01T00:00:00+00:00')
+        self.assertEqual(record['mime_type'], 'text/plain')
+        self.assertEqual(record['change'], 'added')
+        self.assertEqual(record, dict(self.record))
+
+    def test_copy(self):
+        copied = self.record.copy()
+        self.assertIs(type(copied), dict)
+        self.assertEqual(copied, self.record)
+        copied['size'] = 4
+        self.assertEqual(self.record['size'], 3)
+
+    def test_pickle(self):
+        copied = pickle.loads(pickle.dumps(self.record))
+        self.assertIs(type(copied), dict)
+        self.assertEqual(copied, self.record)
+
+    def test_update(self):
+        self.record.update({'volume': 'usb2', 'note': 'x'})
+        self.assertEqual(self.record['volume'], 'usb2')
+        self.assertEqual(self.record['note'], 'x')
+        self.assertEqual(json.loads(json.dumps(self.record, default=dict))['volume'], 'usb2')
+
+    def test_unlisted_fields(self):
+        constants = fss.RecordConstants('host', None, fss.check_fields(['file_name', 'size']))
+        record = fss.FileRecord(constants, 'a.txt', 'a.txt', '/a.txt', 3, 0.0, 0.0, '.txt')
+        self.assertEqual(dict(record), {'file_name': 'a.txt', 'size': 3})
+        # still readable by key
+        self.assertEqual(record['suffix'], '.txt')
+
+
+
+class PathFilterTest(unittest.TestCase):
+    PATHS = (
+        'keep.txt', 'skip.tmp', 'cache/a.txt', 'src/cache/b.txt', 'src/c.txt', 'src/build/d.txt',
+        'logs/e.log', 'logs/old/f.log',
+    )
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.base_path = os.path.join(self.directory.name, 'tree')
+        for path in self.PATHS:
+            write_file(os.path.join(self.base_path, path), b'x')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def crawl(self, **arguments):
+        listed = []
+        scandir = os.scandir
+
+        def recording_scandir(path):
+            listed.append(os.path.relpath(path, self.base_path))
+            return scandir(path)
+
+        with mock.patch.object(fss.os, 'scandir', recording_scandir):
+            records = fss.Crawler(base_path=self.base_path, walker='scandir', hash=False, **arguments)
+            found = sorted(record['relative_path'] for record in records)
+        return found, listed
+
+    def test_exclude_and_prune(self):
+        found, listed = self.crawl(
+            exclude=['*.tmp', 're:/logs/old$'], prune=['cache', os.path.join(self.base_path, 'src', 'build')]
+        )
+        self.assertEqual(found, ['keep.txt', 'logs/e.log', 'src/c.txt'])
+        # pruned directories are never listed
+        self.assertEqual(sorted(listed), ['.', 'logs', 'src'])
+
+    def test_prune_only_skips_directories(self):
+        write_file(os.path.join(self.base_path, 'logs', 'cache'), b'x')
+        found, listed = self.crawl(prune=['cache'])
+        self.assertIn('logs/cache', found)
+        self.assertNotIn('cache/a.txt', found)
+
+    def test_one_file_system(self):
+        found, listed = self.crawl(one_file_system=True)
+        self.assertEqual(found, sorted(self.PATHS))
+
+        path_filter = fss.PathFilter(one_file_system=True)
+        path_filter.set_base(self.base_path)
+        device = os.stat(self.base_path).st_dev
+
+        mount = os.path.join(self.base_path, 'mount')
+
+        class Entry():
+            def __init__(self, st_dev):
+                self.path = mount
+                self.name = 'mount'
+                self.st_dev = st_dev
+
+            def stat(self, follow_symlinks=True):
+                return self
+
+        self.assertFalse(path_filter.skip_directory(Entry(device)))
+        # a mount point of another file system
+        self.assertTrue(path_filter.skip_directory(Entry(device + 1)))
+        self.assertFalse(fss.PathFilter().skip_directory(Entry(device + 1)))
+
+
+class ArchiveHashBudgetTest(unittest.TestCase):
+    BIG = b'\0' * (fss.HASH_BLOCK_SIZE + 1)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.zip_path = os.path.join(self.directory.name, 'a.zip')
+        with zipfile.ZipFile(self.zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+            z.writestr('big.bin', self.BIG)
+            z.writestr('small.txt', b'small')
+        self.tar_path = os.path.join(self.directory.name, 'a.tgz')
+        with tarfile.open(self.tar_path, 'w:gz') as tar:
+            for name, data in (('big.bin', self.BIG), ('small.txt', b'small'), ):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check(self, records):
+        records = {record['file_name']: record for record in records}
+        self.assertEqual(records['big.bin']['dropbox_hash'], '')
+        self.assertEqual(records['big.bin']['hash_status'], 'skipped')
+        self.assertNotEqual(records['small.txt']['dropbox_hash'], '')
+        self.assertEqual(records['small.txt']['hash_status'], '')
+
+    def test_zip_member_over_budget(self):
+        self.check(fss.ZipCrawler(self.zip_path, None, hash_max_bytes=1024))
+
+    def test_zip_member_over_budget_with_workers(self):
+        self.check(fss.ZipCrawler(self.zip_path, None, workers=2, hash_max_bytes=1024))
+
+    def test_tar_member_over_budget(self):
+        self.check(fss.TarCrawler(self.tar_path, None, hash_max_bytes=1024))
+
+    def test_crawler_passes_budget(self):
+        crawler = fss.Crawler(
+            base_path=self.directory.name, search_archives=True, hash_max_bytes=fss.HASH_BLOCK_SIZE
+        )
+        members = [record for record in crawler if record['is_archive']]
+        for archive_path in (self.zip_path, self.tar_path, ):
+            self.check([record for record in members if record['full_path'].startswith(archive_path)])
+
+    def test_member_larger_than_its_header(self):
+        # a member can hold more than its header says, the budget stops it as it is read
+        budget = fss.HashBudget(max_bytes=1024)
+        with zipfile.ZipFile(self.zip_path) as z:
+            self.assertEqual(fss.zip_dropbox_hash(z, self.zip_path, 'big.bin', budget=budget), '')
+        self.assertEqual(budget.status, 'skipped')
+
+
+
+def tar_bytes(members, mode='w'):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode=mode) as tar:
+        for name, contents in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            tar.addfile(info, io.BytesIO(contents))
+    return data.getvalue()
+
+
+def content_hash(contents):
+    hasher = fss.DropboxHasher()
+    hasher.update_file_object(io.BytesIO(contents))
+    return hasher.hexdigest()
+
+
+class NestedArchiveTest(unittest.TestCase):
+    A = b'a' * 10
+    B = b'b' * 20
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        inner_zip = io.BytesIO()
+        with zipfile.ZipFile(inner_zip, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+            z.writestr('inner/a.txt', self.A)
+            z.writestr('inner/deep.tar.bz2', tar_bytes([('b.txt', self.B), ], mode='w:bz2'))
+        self.inner_zip = inner_zip.getvalue()
+        write_file(
+            os.path.join(self.directory.name, 'nested.tgz'),
+            tar_bytes([('inner.zip', self.inner_zip), ], mode='w:gz')
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def records(self, **arguments):
+        crawler = fss.Crawler(base_path=self.directory.name, search_archives=True, archive_depth=3, **arguments)
+        return {record['full_path'][len(self.directory.name):]: record for record in crawler}
+
+    def test_spool_is_seekable(self):
+        # zipfile needs seekable(), a SpooledTemporaryFile only has it from Python 3.11
+        spool = fss.ArchiveSpool(max_memory=10, max_disk=100)
+        for size in (10, 100, ):
+            fd, reservation = spool.open(size)
+            self.assertTrue(fd.seekable())
+            spool.close(fd, reservation)
+
+    def test_zip_inside_tar(self):
+        for archive_spool_memory in (fss.ARCHIVE_SPOOL_MEMORY, 0, ):
+            records = self.records(archive_spool_memory=archive_spool_memory)
+            self.assertEqual(sorted(records), [
+                '/nested.tgz',
+                '/nested.tgz/inner.zip',
+                '/nested.tgz/inner.zip/inner/a.txt',
+                '/nested.tgz/inner.zip/inner/deep.tar.bz2',
+                '/nested.tgz/inner.zip/inner/deep.tar.bz2/b.txt',
+            ])
+            self.assertEqual(records['/nested.tgz/inner.zip']['dropbox_hash'], content_hash(self.inner_zip))
+            self.assertEqual(records['/nested.tgz/inner.zip/inner/a.txt']['dropbox_hash'], content_hash(self.A))
+            self.assertEqual(
+                records['/nested.tgz/inner.zip/inner/deep.tar.bz2/b.txt']['dropbox_hash'], content_hash(self.B)
+            )
+
+    def test_inner_archive_over_budget(self):
+        records = self.records(hash_max_bytes=len(self.inner_zip) - 1)
+        self.assertEqual(records['/nested.tgz/inner.zip']['dropbox_hash'], '')
+        self.assertEqual(records['/nested.tgz/inner.zip']['hash_status'], 'skipped')
+        # still searched
+        self.assertEqual(records['/nested.tgz/inner.zip/inner/a.txt']['dropbox_hash'], content_hash(self.A))
+        self.assertEqual(records['/nested.tgz/inner.zip/inner/a.txt']['hash_status'], '')
+
+
+class ArchiveCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.base_path = os.path.join(self.directory.name, 'tree')
+        self.zip_path = os.path.join(self.base_path, 'a.zip')
+        self.write_zip({'m1.txt': b'one', 'd/m2.txt': b'two', })
+        write_file(os.path.join(self.base_path, 'a.tgz'), tar_bytes([('t.txt', b'three'), ], mode='w:gz'))
+        self.archive_cache = fss.ArchiveCache(os.path.join(self.directory.name, 'archives.db'))
+
+    def tearDown(self):
+        self.archive_cache.close()
+        self.directory.cleanup()
+
+    def write_zip(self, members):
+        os.makedirs(self.base_path, exist_ok=True)
+        with zipfile.ZipFile(self.zip_path, 'w') as z:
+            for name, contents in members.items():
+                z.writestr(name, contents)
+
+    def members(self, hash=True):
+        crawler = fss.Crawler(
+            base_path=self.base_path, search_archives=True, hash=hash, archive_cache=self.archive_cache
+        )
+        return [dict(record) for record in crawler if record['is_archive']]
+
+    def test_replay_without_opening(self):
+        listed = self.members()
+        self.assertEqual(len(listed), 3)
+        self.assertEqual(self.archive_cache.misses, 2)
+
+        unreadable = mock.Mock(side_effect=AssertionError('archive opened'))
+        with mock.patch.object(zipfile, 'ZipFile', unreadable), mock.patch.object(tarfile, 'open', unreadable):
+            replayed = self.members()
+        self.assertEqual(replayed, listed)
+        self.assertEqual(self.archive_cache.hits, 2)
+
+    def test_changed_archive_is_listed_again(self):
+        self.members()
+        self.write_zip({'m1.txt': b'one', 'm3.txt': b'four', })
+        # a different mtime even on coarse file systems
+        os.utime(self.zip_path, (0, 0))
+        names = sorted(record['file_name'] for record in self.members())
+        self.assertEqual(names, ['m1.txt', 'm3.txt', 't.txt'])
+
+    def test_unhashed_listing_doesnt_serve_hashing_crawl(self):
+        self.assertTrue(all(record['dropbox_hash'] == '' for record in self.members(hash=False)))
+        hashed = self.members()
+        self.assertTrue(all(record['dropbox_hash'] for record in hashed))
+        self.assertEqual(hashed, self.members())
+
+
+class TelemetryTest(unittest.TestCase):
+    def setUp(self):
+        fss.telemetry = fss.Telemetry()
+
+    def tearDown(self):
+        fss.telemetry = None
+
+    def test_directories_counted_by_both_walkers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for path in ('a/b/f1', 'a/f2', 'c/f3', 'f4', ):
+                write_file(os.path.join(directory, path), b'x')
+            for walker in fss.WALKERS:
+                fss.telemetry = fss.Telemetry()
+                records = list(fss.Crawler(base_path=directory, walker=walker, hash=False))
+                self.assertEqual(len(records), 4)
+                # the base path, a, a/b and c
+                self.assertEqual(fss.telemetry.report()['directories'], 4, walker)
+
+
+
+class Interrupted(Exception):
+    pass
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.base_path = os.path.join(self.directory.name, 'tree')
+        for i in range(60):
+            write_file(os.path.join(self.base_path, f"d{i % 6}", f"e{i % 2}", f"f{i}.txt"), b'x' * i)
+        self.checkpoint = os.path.join(self.directory.name, 'checkpoint.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def search(self, output_file, *argv):
+        run_main(self.base_path, '--output_file', output_file, *argv)
+        return read_file(output_file)
+
+    def interrupted_search(self, output_file, *argv, saves=2):
+        # stops the search right after its second checkpoint is saved
+        save = fss.Checkpoint.save
+        states = []
+
+        def save_then_stop(checkpoint, state):
+            save(checkpoint, state)
+            states.append(state)
+            if len(states) == saves:
+                raise Interrupted()
+
+        with mock.patch.object(fss.Checkpoint, 'save', save_then_stop):
+            with self.assertRaises(Interrupted):
+                self.search(output_file, '--checkpoint', self.checkpoint, '--checkpoint_interval', '0', *argv)
+        return states
+
+    def check_resume(self, *argv, ordered=True):
+        # a --checkpoint search always walks with scandir
+        expected = self.search(
+            os.path.join(self.directory.name, 'expected.json'), '--checkpoint', self.checkpoint, *argv
+        )
+        output_file = os.path.join(self.directory.name, 'output.json')
+        states = self.interrupted_search(output_file, *argv)
+        self.assertTrue(os.path.exists(self.checkpoint))
+        self.assertTrue(states[-1]['stack'])
+        self.assertLess(os.path.getsize(output_file), len(expected))
+
+        resumed = self.search(output_file, '--checkpoint', self.checkpoint, '--resume', *argv)
+        if ordered:
+            self.assertEqual(resumed, expected)
+        else:
+            # every file written exactly once, io_order windows end early at checkpoints
+            self.assertEqual(sorted(resumed.splitlines()), sorted(expected.splitlines()))
+        self.assertEqual(resumed.count(b'"full_path"'), 60)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume(self):
+        self.check_resume()
+
+    def test_resume_with_io_order(self):
+        for io_order in ('inode', 'extent', ):
+            self.check_resume('--io_order', io_order, '--io_window', '4', ordered=False)
+
+    def test_resume_with_hash_workers(self):
+        self.check_resume('--hash_workers', '2')
+
+
+class InventoryTest(unittest.TestCase):
+    NAMES = ('plain.txt', 'say "hi".txt', '"quoted"', "it's.txt", )
+
+    def test_txt_and_csv_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            base_path = os.path.join(directory, 'tree')
+            for name in self.NAMES:
+                write_file(os.path.join(base_path, name), b'x')
+            for output_format in ('txt', 'csv', 'json', 'jsonl', ):
+                inventory = os.path.join(directory, 'inventory.' + output_format)
+                run_main(base_path, '--output_format', output_format, '--output_file', inventory)
+                records = list(fss.read_inventory(inventory))
+                self.assertEqual(sorted(record['file_name'] for record in records), sorted(self.NAMES))
+                for record in records:
+                    self.assertEqual(record['full_path'], os.path.join(base_path, record['file_name']))
+                    self.assertEqual(record['size'], 1)
+                    self.assertIs(record['is_archive'], False)
+                    if output_format != 'csv':
+                        # csv writes None as an empty string
+                        self.assertIsNone(record['volume'], output_format)
+
+
+class MergeTest(unittest.TestCase):
+    def test_external_sort_spills_and_merges(self):
+        generator = random.Random(0)
+        items = [(generator.choice('abcdef') * 64, generator.randrange(1000), i % 3, f"/f{i}", ) for i in range(1000)]
+        with tempfile.TemporaryDirectory() as directory:
+            sort = fss.ExternalSort(max_memory=1000, directory=directory)
+            for item in items:
+                sort.add(item, 100)
+            self.assertEqual(sort.spilled, 100)
+            # merged in several passes
+            with mock.patch.object(fss, 'MERGE_FAN_IN', 4):
+                self.assertEqual(list(sort.sorted()), sorted(items))
+            sort.close()
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_external_sort_in_memory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sort = fss.ExternalSort(directory=directory)
+            for item in ((2, 'b'), (1, 'a'), (3, 'c'), ):
+                sort.add(item, 10)
+            self.assertEqual(list(sort.sorted()), [(1, 'a'), (2, 'b'), (3, 'c')])
+            self.assertEqual(sort.spilled, 0)
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_merge_inventories(self):
+        with tempfile.TemporaryDirectory() as directory:
+            inventories = []
+            for volume, files in (
+                    ('usb1', {'shared.txt': b'shared', 'only1.txt': b'one', 'empty': b'', }),
+                    ('usb2', {'copy/shared.txt': b'shared', 'only2.txt': b'two', 'also2.txt': b'two', }),
+                ):
+                for name, contents in files.items():
+                    write_file(os.path.join(directory, volume, name), contents)
+                inventory = os.path.join(directory, volume + '.txt')
+                run_main(
+                    os.path.join(directory, volume), '--volume', volume,
+                    '--output_format', 'txt', '--output_file', inventory
+                )
+                inventories.append(inventory)
+
+            spill_directory = os.path.join(directory, 'spill')
+            os.mkdir(spill_directory)
+            reports = {}
+            for report in ('duplicates', 'unique', 'volumes', ):
+                output_file = os.path.join(directory, report + '.jsonl')
+                with mock.patch.object(sys, 'argv', ['file_system_searcher.py', 'merge', ] + inventories + [
+                        '--report', report, '--merge_memory', '1', '--spill_directory', spill_directory,
+                        '--output_format', 'jsonl', '--output_file', output_file,
+                    ]):
+                    fss.main()
+                reports[report] = jsonl_records(output_file)
+                self.assertEqual(os.listdir(spill_directory), [])
+
+        duplicates = reports['duplicates']
+        self.assertEqual(
+            sorted((record['volume'], os.path.basename(record['full_path'])) for record in duplicates),
+            [('usb1', 'shared.txt'), ('usb2', 'shared.txt')]
+        )
+        self.assertTrue(all(record['volumes'] == 2 for record in duplicates))
+        self.assertEqual(
+            sorted(os.path.basename(record['full_path']) for record in reports['unique']),
+            ['also2.txt', 'only1.txt', 'only2.txt']
+        )
+        volumes = {record['volume']: record for record in reports['volumes']}
+        self.assertEqual(sorted(volumes), ['usb1', 'usb2'])
+        self.assertEqual(volumes['usb1']['files'], 3)
+        self.assertEqual(volumes['usb1']['shared_files'], 1)
+        self.assertEqual(volumes['usb1']['unhashed_files'], 1)
+        self.assertEqual(volumes['usb2']['unique_files'], 2)
+
+
+class WatcherTest(unittest.TestCase):
+    def test_new_directory_with_one_file_system(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path_filter = fss.PathFilter(None, None, True)
+            path_filter.set_base(directory)
+            watcher = fss.Watcher([path_filter, ])
+            if watcher.inotify is None:
+                self.skipTest('inotify not available')
+            try:
+                watcher.add_tree(0, directory)
+                new_directory = os.path.join(directory, 'new')
+                os.mkdir(new_directory)
+                deadline = time.monotonic() + 5
+                while not watcher.pending() and time.monotonic() < deadline:
+                    watcher.read()
+                removed, trees, files = watcher.take()
+            finally:
+                watcher.inotify.close()
+        self.assertEqual(trees, {(0, new_directory, )})
+
+
+
+class SearchIndexTest(unittest.TestCase):
+    NAMES = ('photo[1].jpg', 'photo1.jpg', '100%_done.txt', '100x_done.txt', 'a_b.txt', 'axb.txt', )
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.search_index = fss.SearchIndex(os.path.join(self.directory.name, 'index.db'))
+        for i, name in enumerate(self.NAMES):
+            self.search_index.add({
+                'volume': 'usb1', 'full_path': '/base/d/' + name, 'file_name': name,
+                'relative_path': 'd/' + name, 'size': i, 'modified': f"2020-01-0{i + 1}T00:00:00+00:00",
+                'suffix': os.path.splitext(name)[1],
+            })
+        self.search_index.write()
+
+    def tearDown(self):
+        self.search_index.close()
+        self.directory.cleanup()
+
+    def names(self, **query):
+        return sorted(record['file_name'] for record in self.search_index.search(**query))
+
+    def test_text_is_literal(self):
+        self.assertEqual(self.names(text='photo[1]'), ['photo[1].jpg'])
+        self.assertEqual(self.names(text='100%_'), ['100%_done.txt'])
+        self.assertEqual(self.names(text='a_b'), ['a_b.txt'])
+        self.assertEqual(self.names(text='PHOTO'), ['photo1.jpg', 'photo[1].jpg'])
+
+    def test_glob(self):
+        self.assertEqual(self.names(glob='photo[1].jpg'), ['photo1.jpg'])
+        self.assertEqual(self.names(glob='photo[[]1].jpg'), ['photo[1].jpg'])
+        self.assertEqual(self.names(glob='100%_*'), ['100%_done.txt'])
+        self.assertEqual(self.names(glob='*.txt', in_path=True), ['100%_done.txt', '100x_done.txt', 'a_b.txt', 'axb.txt'])
+
+    def test_ranges(self):
+        self.assertEqual(self.names(min_size=1, max_size=2), ['100%_done.txt', 'photo1.jpg'])
+        self.assertEqual(self.names(modified_before='2020-01-02'), ['photo[1].jpg'])
+        self.assertEqual(self.names(suffix='.jpg', modified_after='2020-01-02'), ['photo1.jpg'])
+
+    def test_search_again_updates_entries(self):
+        self.search_index.add({
+            'volume': 'usb1', 'full_path': '/base/d/axb.txt', 'file_name': 'axb.txt',
+            'relative_path': 'd/axb.txt', 'size': 100, 'modified': "2020-02-01T00:00:00+00:00",
+            'suffix': '.txt',
+        })
+        self.search_index.write()
+        entries = list(self.search_index.search(text='axb'))
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['size'], 100)
+        self.assertEqual(self.names(min_size=100), ['axb.txt'])
+
+    def test_archive_member_suffix(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with zipfile.ZipFile(os.path.join(directory, 'a.zip'), 'w') as z:
+                z.writestr('m.csv', b'member')
+                z.writestr('README', b'member')
+            for record in fss.Crawler(base_path=directory, search_archives=True):
+                self.search_index.add(record)
+        self.search_index.write()
+        self.assertEqual(self.names(suffix='.csv'), ['m.csv'])
+        self.assertEqual(self.names(suffix='.zip'), ['a.zip'])
+        self.assertEqual(self.names(text='README'), ['README'])
+
+
+
+class AsyncCrawlerTest(unittest.TestCase):
+    def crawl(self, crawler, stop=None):
+        async def records():
+            found = []
+            iterator = crawler.__aiter__()
+            try:
+                async for record in iterator:
+                    found.append(dict(record))
+                    if len(found) == stop:
+                        break
+            finally:
+                # stops the crawl's tasks when the loop breaks early
+                await iterator.aclose()
+            return found
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(records())
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def test_same_records_as_crawler(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(50):
+                write_file(os.path.join(directory, f"d{i % 7}", f"e{i % 3}", f"f{i}.txt"), b'x' * i)
+            with zipfile.ZipFile(os.path.join(directory, 'a.zip'), 'w') as z:
+                z.writestr('m.txt', b'member')
+            expected = [dict(record) for record in fss.Crawler(base_path=directory, search_archives=True)]
+            found = self.crawl(fss.AsyncCrawler(base_path=directory, concurrency=4, search_archives=True))
+            stopped = self.crawl(fss.AsyncCrawler(base_path=directory, concurrency=4), stop=5)
+
+        key = lambda record: record['full_path']
+        self.assertEqual(sorted(found, key=key), sorted(expected, key=key))
+        self.assertEqual(len(expected), 52)
+        self.assertEqual(len(stopped), 5)
+
+    def test_hash_threads_are_capped(self):
+        hash_buffer = fss.hash_buffer
+        threads = set()
+
+        def recording_hash_buffer():
+            threads.add(threading.get_ident())
+            return hash_buffer()
+
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(40):
+                write_file(os.path.join(directory, f"d{i % 4}", f"f{i}.txt"), b'x' * (i + 1))
+            with mock.patch.object(fss, 'hash_buffer', recording_hash_buffer):
+                found = self.crawl(fss.AsyncCrawler(base_path=directory, concurrency=16, hash_concurrency=2))
+
+        self.assertEqual(len(found), 40)
+        self.assertTrue(all(record['dropbox_hash'] for record in found))
+        self.assertLessEqual(len(threads), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()